@@ -0,0 +1,442 @@
+#!/usr/bin/python3
+
+##############################################################
+#Description: reproducible benchmarks for mri_quickgifs and percsigchange.
+#             Synthetic 4D series (and fake FEAT directories) are generated
+#             from a fixed seed at realistic sizes, each case is run in its
+#             own process (so peak memory belongs to that case alone) with
+#             the tools' --profile stage timings switched on, and the
+#             results are compared against a stored baseline.
+#
+#
+#Usage: python3 qa_benchmarks.py [options]
+#
+#Cases:
+#   quickgifs_[size]_[nii|niigz]: mri_quickgifs.main on a synthetic series
+#       small:      64x64x64x200
+#       medium:     96x96x96x600
+#       multiband:  104x104x72x1200
+#   percsigchange_feat: percsigchange.generate_map for every PE of a fake FEAT directory
+#   encoders: every available mri_quickgifs animation encoder on the same frames
+#       (center slice movie and slices of one volume of the small series)
+#   startup: import time of each entry point (python -X importtime, in a
+#       fresh interpreter) and the wall time of "--help" for both CLIs
+#
+#Outputs:
+#   A json file of per-case wall time, stage times and peak memory. With
+#   --baseline, cases that got slower (or bigger) than the tolerance allows
+#   are listed and the script exits with status 1.
+#
+#History: (10/2026) Added benchmark suite
+##################################################################
+
+import os, sys
+import json
+import gzip
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import contextlib
+import numpy as np
+import nibabel as nib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+QUICKGIFS_DIR = os.path.join(REPO_DIR, 'mri_quickgifs')
+PERCSIGCHANGE_DIR = os.path.join(REPO_DIR, 'percsigchange')
+
+SERIES_SIZES = {
+    'small': (64, 64, 64, 200),
+    'medium': (96, 96, 96, 600),
+    'multiband': (104, 104, 72, 1200),
+    }
+SERIES_FORMATS = ['nii', 'niigz']
+
+#Fake FEAT analysis: image grid, number of EVs and number of time points
+FEAT_SHAPE = (64, 64, 40)
+FEAT_EVS = 6
+FEAT_POINTS = 200
+
+#Seed for every generated image, so all runs see the same data
+SEED = 1234
+
+#Number of volumes generated (and written) at a time
+WRITE_CHUNK_VOLS = 50
+
+#Entry points whose startup is timed: (directory, module name)
+STARTUP_MODULES = [
+    (QUICKGIFS_DIR, 'mri_quickgifs'),
+    (QUICKGIFS_DIR, 'mri_quickgifs_batch'),
+    (QUICKGIFS_DIR, 'mri_quickgifs_gui'),
+    (QUICKGIFS_DIR, 'mri_quickgifs_realtime'),
+    (PERCSIGCHANGE_DIR, 'percsigchange'),
+    (PERCSIGCHANGE_DIR, 'percsigchange_batch'),
+    (PERCSIGCHANGE_DIR, 'percsigchange_group'),
+    (PERCSIGCHANGE_DIR, 'percsigchange_roi'),
+    ]
+
+#Command line tools whose --help wall time is timed
+HELP_MODULES = [
+    (QUICKGIFS_DIR, 'mri_quickgifs'),
+    (QUICKGIFS_DIR, 'mri_quickgifs_realtime'),
+    (PERCSIGCHANGE_DIR, 'percsigchange'),
+    (PERCSIGCHANGE_DIR, 'percsigchange_group'),
+    (PERCSIGCHANGE_DIR, 'percsigchange_roi'),
+    ]
+
+
+def case_names(sizes=None):
+    #Names of all benchmark cases, optionally only for some series sizes
+    if sizes is None:
+        sizes = list(SERIES_SIZES.keys())
+    names = []
+    for size_name in sizes:
+        for series_format in SERIES_FORMATS:
+            names.append('quickgifs_{}_{}'.format(size_name, series_format))
+    names.append('percsigchange_feat')
+    names.append('encoders')
+    names.append('startup')
+    return names
+
+
+def _phantom(vol_shape):
+    #Ellipsoid "head" with a brighter core, so the mask, tSNR and gifs
+    #look like a real acquisition
+    grid = np.meshgrid(*[np.linspace(-1, 1, x) for x in vol_shape], indexing='ij')
+    radius = np.sqrt(grid[0]**2/0.8**2 + grid[1]**2/0.9**2 + grid[2]**2/0.85**2)
+    phantom = np.zeros(vol_shape, dtype=np.float32)
+    phantom[radius<1] = 600.0
+    phantom[radius<0.6] = 900.0
+    return phantom
+
+
+def make_func_series(output_file, img_dims, seed=SEED):
+    #Write a synthetic int16 4D series: phantom plus a slow linear drift,
+    #a slow oscillation and gaussian noise. Volumes are generated and
+    #written a chunk at a time, so the full series is never held in memory
+    #(the multiband case is ~1.9 GB as int16). .nii.gz files are
+    #compressed with level 1 to keep generation quick.
+    vol_shape = img_dims[:3]
+    num_vols = img_dims[3]
+    rng = np.random.default_rng(seed)
+    phantom = _phantom(vol_shape)
+    noise_scale = np.where(phantom>0, 12.0, 3.0).astype(np.float32)
+
+    header = nib.Nifti1Header()
+    header.set_data_shape(img_dims)
+    header.set_data_dtype(np.int16)
+    header.set_zooms((2.4, 2.4, 2.4, 0.8))
+    header.set_qform(np.diag([2.4, 2.4, 2.4, 1]), code=1)
+    header.set_sform(np.diag([2.4, 2.4, 2.4, 1]), code=1)
+    header.set_slope_inter(1, 0)
+    header['vox_offset'] = 352
+
+    if output_file.endswith('.gz'):
+        fo = gzip.open(output_file, 'wb', compresslevel=1)
+    else:
+        fo = open(output_file, 'wb')
+    with fo:
+        header.write_to(fo)
+        fo.write(b'\x00'*(352 - 348))
+        for first_vol in range(0, num_vols, WRITE_CHUNK_VOLS):
+            chunk_vols = min(WRITE_CHUNK_VOLS, num_vols - first_vol)
+            time_points = np.arange(first_vol, first_vol+chunk_vols, dtype=np.float32)
+            signal = 1 + 0.0002*time_points + 0.005*np.sin(2*np.pi*time_points/40.0)
+            chunk = phantom[..., np.newaxis]*signal
+            chunk += noise_scale[..., np.newaxis]*rng.standard_normal(chunk.shape, dtype=np.float32)
+            np.clip(chunk, 0, 32767, out=chunk)
+            #Volumes are contiguous in a 4D NIfTI (time is the slowest axis)
+            fo.write(np.round(chunk).astype('<i2').tobytes(order='F'))
+    return output_file
+
+
+def make_feat_dir(feat_dir, vol_shape=FEAT_SHAPE, num_evs=FEAT_EVS, num_points=FEAT_POINTS, seed=SEED):
+    #Create a fake FEAT directory with a design.mat, mean_func.nii.gz and
+    #a stats/pe[N].nii.gz image per EV
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(feat_dir, 'stats'), exist_ok=True)
+    affine = np.diag([2.0, 2.0, 2.0, 1.0])
+
+    #Blocked EVs convolved with a crude gamma-shaped response
+    response = np.arange(0, 20, dtype=np.float64)
+    response = response**5*np.exp(-response)
+    response /= response.sum()
+    design_matrix = np.zeros((num_points, num_evs))
+    for ev_num in range(num_evs):
+        boxcar = ((np.arange(num_points) + 7*ev_num) // 15) % (num_evs + 1) == 0
+        design_matrix[:, ev_num] = np.convolve(boxcar.astype(np.float64), response)[:num_points]*(ev_num + 1)
+    with open(os.path.join(feat_dir, 'design.mat'), 'w') as fo:
+        fo.write('/NumWaves\t{}\n'.format(num_evs))
+        fo.write('/NumPoints\t{}\n'.format(num_points))
+        fo.write('/PPheights\t\t{}\n'.format(' '.join(['{:e}'.format(x) for x in np.ptp(design_matrix, axis=0)])))
+        fo.write('\n/Matrix\n')
+        for design_row in design_matrix:
+            fo.write('\t'.join(['{:e}'.format(x) for x in design_row])+'\t\n')
+
+    mean_func_data = _phantom(vol_shape)
+    nib.save(nib.Nifti1Image(mean_func_data, affine), os.path.join(feat_dir, 'mean_func.nii.gz'))
+    for ev_num in range(num_evs):
+        pe_data = (rng.standard_normal(vol_shape)*5).astype(np.float32)
+        pe_data[mean_func_data==0] = 0
+        nib.save(nib.Nifti1Image(pe_data, affine), os.path.join(feat_dir, 'stats', 'pe{}.nii.gz'.format(ev_num+1)))
+    return feat_dir
+
+
+def _case_input(case_name, data_dir):
+    #Generate (or reuse) the input data of a case and return its path
+    if case_name == 'percsigchange_feat':
+        feat_dir = os.path.join(data_dir, 'bench_feat.feat')
+        if not os.path.exists(os.path.join(feat_dir, 'stats', 'pe{}.nii.gz'.format(FEAT_EVS))):
+            print('Generating {}...'.format(feat_dir))
+            make_feat_dir(feat_dir)
+        return feat_dir
+    if case_name == 'encoders':
+        return _case_input('quickgifs_small_nii', data_dir)
+    if case_name == 'startup':
+        #Nothing to generate; the entry points are timed in the repository
+        return REPO_DIR
+    size_name, series_format = case_name.split('_')[1:]
+    extension = {'nii': '.nii', 'niigz': '.nii.gz'}[series_format]
+    input_file = os.path.join(data_dir, 'bench_{}{}'.format(size_name, extension))
+    if not os.path.exists(input_file):
+        print('Generating {} {}...'.format(input_file, SERIES_SIZES[size_name]))
+        partial_file = input_file.replace('bench_', 'partial_bench_')
+        make_func_series(partial_file, SERIES_SIZES[size_name])
+        os.replace(partial_file, input_file)
+    return input_file
+
+
+def _import_time(module_dir, module_name):
+    #Cumulative import time (s) of a module in a fresh interpreter, from
+    #python -X importtime
+    import_call = [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module_name)]
+    import_output = subprocess.run(import_call, cwd=module_dir, check=True, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.PIPE, universal_newlines=True).stderr
+    import_time = None
+    for import_line in import_output.splitlines():
+        if not import_line.startswith('import time:') or '|' not in import_line:
+            continue
+        self_us, cumulative_us, imported_module = import_line[len('import time:'):].split('|')
+        if imported_module.strip() == module_name:
+            import_time = int(cumulative_us)/1e6
+    return import_time
+
+
+def _run_case_here(case_name, input_path, work_dir):
+    #Run one case in this process and return its wall time and stage times
+    output_bytes = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if case_name == 'startup':
+            stages = []
+            start_time = time.perf_counter()
+            for module_dir, module_name in STARTUP_MODULES:
+                stages.append({'stage': 'import '+module_name, 'wall_s': _import_time(module_dir, module_name)})
+            for module_dir, module_name in HELP_MODULES:
+                help_start = time.perf_counter()
+                subprocess.run([sys.executable, module_name+'.py', '--help'], cwd=module_dir, check=True, stdout=subprocess.DEVNULL)
+                stages.append({'stage': module_name+' --help', 'wall_s': time.perf_counter() - help_start})
+            wall_time = time.perf_counter() - start_time
+        elif case_name == 'encoders':
+            sys.path.insert(0, QUICKGIFS_DIR)
+            import mri_quickgifs as mquick
+            import mri_quickgifs_encoders as mqenc
+            input_img = nib.load(input_path, mmap=True)
+            center_array = np.asarray(input_img.dataobj[:, input_img.shape[1]//2, :, :], dtype=np.float64)
+            volume_array = np.asarray(input_img.dataobj[..., 0], dtype=np.float64)
+            movie_frames = mquick._build_frames(center_array, 3, prog_rows_flag=1)
+            volume_frames = mquick._build_frames(volume_array, 3)
+            stages = []
+            start_time = time.perf_counter()
+            for encoder in mqenc.available_encoders():
+                encode_time = 0.0
+                output_bytes[encoder] = 0
+                for frame_name, frames, duration in [('movie', movie_frames, 0.1), ('volume', volume_frames, 0.2)]:
+                    output_file, frame_time, frame_bytes = mqenc.encode_frames(frames, os.path.join(work_dir, frame_name),
+                                                                               duration=duration, encoder=encoder)
+                    encode_time += frame_time
+                    output_bytes[encoder] += frame_bytes
+                stages.append({'stage': 'encode '+encoder, 'wall_s': encode_time})
+            wall_time = time.perf_counter() - start_time
+        elif case_name == 'percsigchange_feat':
+            sys.path.insert(0, PERCSIGCHANGE_DIR)
+            sys.path.insert(0, QUICKGIFS_DIR)
+            import percsigchange as psc
+            from mri_quickgifs_profile import StageProfiler
+            profiler = StageProfiler(enabled=1)
+            start_time = time.perf_counter()
+            for pe_index in psc.find_pe_indices(input_path):
+                psc.generate_map(input_path, pe_index, output_dir=work_dir, profiler=profiler)
+            wall_time = time.perf_counter() - start_time
+            stages = profiler.report()['stages']
+        else:
+            sys.path.insert(0, QUICKGIFS_DIR)
+            import mri_quickgifs as mquick
+            start_time = time.perf_counter()
+            output_html = mquick.main(0, input_path, 0, work_dir, force=1, cache_dir=os.path.join(work_dir, 'cache'), profile=1)
+            wall_time = time.perf_counter() - start_time
+            input_prefix = os.path.split(input_path)[-1].split('.nii')[0]
+            profile_file = os.path.join(os.path.dirname(output_html), 'mriquickgifs_{}_profile.json'.format(input_prefix))
+            with open(profile_file, 'r') as fo:
+                stages = json.load(fo)['stages']
+    stage_times = {}
+    for stage_record in stages:
+        #Gifs are reported together; one entry per gif is too fine to compare
+        stage_name = 'gifs' if stage_record['stage'].startswith('gif ') else stage_record['stage']
+        stage_times[stage_name] = stage_times.get(stage_name, 0.0) + stage_record['wall_s']
+    return {'wall_s': wall_time, 'stages': stage_times, 'bytes': output_bytes}
+
+
+def _peak_rss_mb():
+    #Peak memory of this process. On Linux, VmHWM is used since ru_maxrss
+    #carries over the parent's peak across fork/exec.
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status', 'r') as fo:
+            for status_line in fo:
+                if status_line.startswith('VmHWM:'):
+                    return int(status_line.split()[1])/1024.0
+    import resource
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak_rss/(1024.0*1024.0)
+    return peak_rss/1024.0
+
+
+def run_case(case_name, data_dir, repeats=3):
+    #Run a case repeats times, each in a fresh process, and keep the
+    #fastest wall time (and its stage times) and the largest peak memory
+    input_path = _case_input(case_name, data_dir)
+    runs = []
+    for repeat_num in range(repeats):
+        work_dir = tempfile.mkdtemp(prefix='bench_', dir=data_dir)
+        try:
+            case_call = [sys.executable, os.path.abspath(__file__), '--run-case', case_name,
+                         '--input', input_path, '--work-dir', work_dir]
+            case_output = subprocess.run(case_call, check=True, stdout=subprocess.PIPE, universal_newlines=True)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        runs.append(json.loads(case_output.stdout.strip().splitlines()[-1]))
+    best_run = min(runs, key=lambda x: x['wall_s'])
+    return {
+        'wall_s': best_run['wall_s'],
+        'wall_s_all': [x['wall_s'] for x in runs],
+        'stages': best_run['stages'],
+        'peak_rss_mb': max([x['peak_rss_mb'] for x in runs]),
+        'bytes': best_run['bytes'],
+        }
+
+
+def compare(results, baseline, tolerance=0.2):
+    #List the cases whose wall time, stage times or peak memory grew by
+    #more than tolerance (a fraction) relative to the baseline. Stages
+    #under 50 ms are left out of the comparison; they're mostly noise.
+    regressions = []
+    for case_name, case_result in results['cases'].items():
+        base_result = baseline.get('cases', {}).get(case_name)
+        if base_result is None:
+            continue
+        checks = [('wall_s', case_result['wall_s'], base_result['wall_s']),
+                  ('peak_rss_mb', case_result['peak_rss_mb'], base_result['peak_rss_mb'])]
+        for stage_name, stage_time in case_result['stages'].items():
+            base_time = base_result['stages'].get(stage_name)
+            if base_time is not None and base_time >= 0.05:
+                checks.append(('stage:'+stage_name, stage_time, base_time))
+        for check_name, new_value, base_value in checks:
+            if base_value and new_value > base_value*(1+tolerance):
+                regressions.append((case_name, check_name, base_value, new_value))
+    return regressions
+
+
+def run_benchmarks(cases, data_dir, output_file, repeats=3, baseline_file=None, tolerance=0.2):
+    #Run the cases, write the results and compare them to a baseline.
+    #Returns the results and the list of regressions.
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    results = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'nibabel': nib.__version__,
+        'cpu_count': os.cpu_count(),
+        'repeats': repeats,
+        'cases': {},
+        }
+    print('{:<32} {:>10} {:>13}'.format('Case', 'Wall (s)', 'Peak RSS (MB)'))
+    for case_name in cases:
+        case_result = run_case(case_name, data_dir, repeats=repeats)
+        results['cases'][case_name] = case_result
+        print('{:<32} {:>10.3f} {:>13.1f}'.format(case_name, case_result['wall_s'], case_result['peak_rss_mb']))
+        for stage_name, stage_time in sorted(case_result['stages'].items(), key=lambda x: -x[1]):
+            print('    {:<28} {:>10.3f}'.format(stage_name, stage_time))
+        for output_name, output_bytes in sorted(case_result['bytes'].items(), key=lambda x: x[1]):
+            print('    {:<28} {:>10.1f} KB'.format(output_name, output_bytes/1024.0))
+    with open(output_file, 'w') as fo:
+        json.dump(results, fo, indent=1)
+    print('Results: {}'.format(output_file))
+
+    regressions = []
+    if baseline_file is not None:
+        with open(baseline_file, 'r') as fo:
+            baseline = json.load(fo)
+        regressions = compare(results, baseline, tolerance=tolerance)
+        if regressions:
+            print('REGRESSIONS (more than {:.0f}% worse than {}):'.format(tolerance*100, baseline_file))
+            for case_name, check_name, base_value, new_value in regressions:
+                print('    {} {}: {:.3f} -> {:.3f}'.format(case_name, check_name, base_value, new_value))
+        else:
+            print('No regressions against {}'.format(baseline_file))
+    return results, regressions
+
+
+if __name__ == "__main__":
+
+    #Set up argument parser and help dialogue
+    parser=argparse.ArgumentParser(
+        description='''Benchmark mri_quickgifs and percsigchange on synthetic data. ''',
+        usage='python3 qa_benchmarks.py [options]')
+    parser.add_argument('--sizes', help='comma-separated series sizes to run ({}), or "all" (default: small)'.format(','.join(SERIES_SIZES.keys())),
+                        default='small')
+    parser.add_argument('--cases', help='comma-separated case names to run instead (see --list)', default=None)
+    parser.add_argument('--list', help='list the case names and exit', action='store_const', const=1, default=0)
+    parser.add_argument('--repeats', help='runs per case; the fastest is kept (default: 3)', type=int, default=3)
+    parser.add_argument('--data-dir', help='where synthetic data are generated and kept between runs (default: a directory in the system temp dir)',
+                        default=os.path.join(tempfile.gettempdir(), 'qa_benchmark_data'))
+    parser.add_argument('--output', help='results json file (default: benchmark_results.json)', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='results json file of an earlier run to compare against', default=None)
+    parser.add_argument('--tolerance', help='fraction a time or memory value may grow before it counts as a regression (default: 0.2)',
+                        type=float, default=0.2)
+    #Used internally to run a single case in a fresh process
+    parser.add_argument('--run-case', help=argparse.SUPPRESS, default=None)
+    parser.add_argument('--input', help=argparse.SUPPRESS, default=None)
+    parser.add_argument('--work-dir', help=argparse.SUPPRESS, default=None)
+    args = parser.parse_args()
+
+    if args.run_case is not None:
+        case_result = _run_case_here(args.run_case, args.input, args.work_dir)
+        case_result['peak_rss_mb'] = _peak_rss_mb()
+        print(json.dumps(case_result))
+        sys.exit(0)
+
+    if args.sizes == 'all':
+        sizes = list(SERIES_SIZES.keys())
+    else:
+        sizes = args.sizes.split(',')
+        for size_name in sizes:
+            if size_name not in SERIES_SIZES:
+                parser.error('unknown size: {}'.format(size_name))
+    if args.cases is not None:
+        cases = args.cases.split(',')
+        for case_name in cases:
+            if case_name not in case_names():
+                parser.error('unknown case: {}'.format(case_name))
+    else:
+        cases = case_names(sizes)
+    if args.list:
+        print('\n'.join(case_names()))
+        sys.exit(0)
+
+    results, regressions = run_benchmarks(cases, args.data_dir, args.output, repeats=args.repeats,
+                                          baseline_file=args.baseline, tolerance=args.tolerance)
+    if regressions:
+        sys.exit(1)
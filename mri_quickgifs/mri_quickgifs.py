@@ -16,6 +16,17 @@
 #           HTML file displaying output gifs
 #   .../output_dir/quickgifs_[input_filename_prefix]/pictures_gifs/
 #           Output directory containing gifs
+#   .../output_dir/quickgifs_[input_filename_prefix]/mriquickgifs_[input_filename_prefix]_metrics.json:
+#           Quantitative QC metrics (tSNR, global signal, DVARS, slice spikes, stage timings)
+#   .../output_dir/quickgifs_[input_filename_prefix]/quickgifs_manifest.json:
+#           Record of the input, parameters and outputs of the last run (used to skip unchanged reruns)
+#   .../output_dir/quickgifs_[input_filename_prefix]/cache/
+#           Cached statistics (.npy) used to regenerate missing gifs (see --cache-dir)
+#   .../output_dir/quickgifs_[input_filename_prefix]/intermediate_images/
+#           Float32 mean, stdev and tSNR images (and detrended series) with --saveimages
+#   With --preview, the gifs below are replaced by [input_filename_prefix]_center_[x|y|z]_preview_3.gif
+#   (at most 50 frames) and [input_filename_prefix]_cut_[mean|stdev|snr]_sheet.png contact sheets.
+#   With --encoder, the animations are written as .webp, .png (APNG) or .mp4 files instead of .gif.
 #   Gifs Created:
 #           [input_filename_prefix]_center_x_3.gif: center slice of the input image along the x axis at each time point
 #           [input_filename_prefix]_center_y_3.gif: center slice of the input image along the y axis at each time point
@@ -33,16 +44,38 @@
 #History: (04/2019) Written by John Graner, Ph.D., LaBar Laboratory, Center for Cognitive Neuroscience, Duke University, Durham, NC, USA
 ##################################################################
 
-from PIL import Image as pImage
 import os, sys
+import time
+import threading
 import subprocess
+import gzip
 import argparse
-import nibabel as nib
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from scipy import signal
-import imageio
+#nibabel, imageio and Pillow are slow to import, so they are imported in
+#the stages that use them; --help, argument errors and the GUI start
+#without loading them.
+import mri_quickgifs_cache as mqcache
+import mri_quickgifs_metrics as mqmetrics
+import mri_quickgifs_encoders as mqenc
+import mri_quickgifs_saveimages as mqsave
+from mri_quickgifs_profile import StageProfiler, NO_PROFILE
 
 
+__version__ = '1.2.0'
+
+#Number of volumes read at a time when no memory budget is given
+DEFAULT_CHUNK_VOLS = 32
+
+#Voxels per slab in the temporal statistics (keeps each slab's shifted
+#copy of a chunk small enough to stay in cache)
+STATS_SLAB_VOXELS = 16384
+
+#Preview tier (--preview): most frames in a center slice gif, and largest
+#side (in pixels) of each slice in a contact sheet
+PREVIEW_FRAMES = 50
+PREVIEW_TILE_SIZE = 128
+
 
 def _format_input_file(raw_input_file):
     #Check to see if the file was passed without a path.
@@ -68,6 +101,9 @@ def _get_niiprefext(input_nii):
     if input_nii[-7:] == '.nii.gz':
         extension = '.nii.gz'
         input_prefix = os.path.split(input_nii)[-1][:-7]
+    elif input_nii[-4:] == '.nii':
+        extension = '.nii'
+        input_prefix = os.path.split(input_nii)[-1][:-4]
     elif input_nii[-3:] == '.gz':
         extension = '.gz'
         input_prefix = os.path.split(input_nii)[-1][:-3]
@@ -80,43 +116,140 @@ def _get_niiprefext(input_nii):
 
 def _grayscale_conv(input_array, perc=None):
     #Convert an input array to 0-255 to support
-    #grayscale png output
+    #grayscale picture output. Returns a uint8 array; the scaling is
+    #done in place on a single float copy of the input.
     if perc is not None:
         max_val = np.percentile(input_array, perc)
     else:
         max_val = input_array.max()
 
-    gs_array = 255*(input_array/max_val)
-    gs_array[np.where(gs_array>255)] = 255
+    gs_array = np.divide(input_array, max_val, dtype=np.float64)
+    gs_array *= 255
+    np.nan_to_num(gs_array, copy=False, nan=0, posinf=255, neginf=0)
+    np.clip(gs_array, 0, 255, out=gs_array)
+    np.rint(gs_array, out=gs_array)
+    return gs_array.astype(np.uint8)
 
-    gs_array = np.rint(gs_array)
-    return gs_array
 
+def _build_frames(input_array, slice_dim, prog_rows_flag=0):
+    #Turn a 3D array into a stack of gif frames, one per slice along
+    #slice_dim, with shape (slices, rows, columns, 2) in "LA" format.
+    #Each slice is rotated (if needed) so its longest side is the width,
+    #and a progress bar can be added along the bottom of each frame.
 
-def _format_picture(input_array, bot_rows_to_add=None):
-    #The input will be an array as read by nib
-    #The output will be a PIL Image object
-    #Rotate the image (if needed) so the longest side is the width
-    if input_array.shape[1] == max(input_array.shape):
-        array_to_use = input_array
-    else:
-        array_to_use = np.rot90(input_array)
+    #Transpose the data so we can always create slices along the
+    #last dimension of the array, then scale the whole stack to 0-255.
+    transpose_array = np.arange(3)
+    transpose_array = np.roll(transpose_array, 3-slice_dim)
+    data_to_slice = _grayscale_conv(input_array.transpose(transpose_array), perc=99.95)
+    num_slices = data_to_slice.shape[-1]
+    longest_side = max(data_to_slice.shape[0:2])
+
+    #Put the slices first and rotate them all at once
+    frame_stack = np.moveaxis(data_to_slice, 2, 0)
+    if data_to_slice.shape[1] != longest_side:
+        frame_stack = np.rot90(frame_stack, axes=(1, 2))
+
+    #If desired, add some rows to the bottom of each picture to
+    #display progress through the gif
+    num_rows = frame_stack.shape[1]
+    if prog_rows_flag:
+        num_rows += 5
+    frames = np.empty((num_slices, num_rows, longest_side, 2), dtype=np.uint8)
+    frames[:, :frame_stack.shape[1], :, 0] = frame_stack
+    frames[..., 1] = 255
+    if prog_rows_flag:
+        step_per_picture = float(longest_side)/float(num_slices)
+        progress_indices = np.ceil(np.arange(num_slices)*step_per_picture).astype(int)
+        prog_bars = np.arange(longest_side)[np.newaxis, :] < progress_indices[:, np.newaxis]
+        frames[:, frame_stack.shape[1]:, :, 0] = 255*prog_bars[:, np.newaxis, :]
+    return frames
+
+
+def _contact_sheet(input_array, slice_dim=3, tile_size=PREVIEW_TILE_SIZE):
+    #Tile every slice along slice_dim into one grayscale image, with the
+    #same scaling and orientation as the gif frames. Slices larger than
+    #tile_size are shrunk by keeping every Nth voxel.
+    frames = _build_frames(input_array, slice_dim)[..., 0]
+    shrink = max(1, int(np.ceil(max(frames.shape[1:])/float(tile_size))))
+    frames = frames[:, ::shrink, ::shrink]
+    num_slices, tile_rows, tile_cols = frames.shape
+    num_columns = int(np.ceil(np.sqrt(num_slices)))
+    num_rows = int(np.ceil(num_slices/float(num_columns)))
+    sheet = np.zeros((num_rows*tile_rows, num_columns*tile_cols), dtype=np.uint8)
+    for slice_num in range(num_slices):
+        row_num, column_num = divmod(slice_num, num_columns)
+        sheet[row_num*tile_rows:(row_num+1)*tile_rows, column_num*tile_cols:(column_num+1)*tile_cols] = frames[slice_num]
+    return sheet
+
+
+def write_contact_sheet(input_array, output_dir, output_png_prefix, slice_dim=3):
+    #Write the contact sheet of a 3D array as a png file
+    import imageio
+    output_png = os.path.join(output_dir, '{}_sheet.png'.format(output_png_prefix))
+    imageio.imwrite(output_png, _contact_sheet(input_array, slice_dim))
+    return output_png
+
+
+def _media_tag(src, height, width):
+    #html tag displaying one animation (mp4 files need a video tag)
+    if src.endswith('.mp4'):
+        return '<VIDEO SRC="{}" HEIGHT={} WIDTH={} AUTOPLAY LOOP MUTED PLAYSINLINE></VIDEO>'.format(src, height, width)
+    return '<IMAGE SRC="{}" HEIGHT={} WIDTH={} ALT="gif_test">'.format(src, height, width)
+
+
+def _write_preview_html(input_prefix, output_dir, cuttrs, scale_dict, time_step, extension='.gif'):
+    #Write out the html file of the preview tier: decimated center slice
+    #gifs and one contact sheet per statistic, plus a note on how to get
+    #the full-resolution gifs.
 
-    if bot_rows_to_add is not None:
-        array_to_use = np.concatenate((array_to_use, bot_rows_to_add),axis=0)
+    if not os.path.exists(output_dir):
+        print('Output directory not found: {} -- _write_preview_html()'.format(output_dir))
+        return None
+
+    height = 200
+    sheet_width = 600
 
-    pil_image = pImage.fromarray(array_to_use)
-    #Convert the image mode to "LA" for writing
-    output_pimage = pil_image.convert(mode="LA")
-    return output_pimage
+    line_list = [
+    '<HTML>',
+    '<HEAD>',
+    '<TITLE>mri_quickgifs Summary (preview)</TITLE>',
+    '</HEAD>',
+    '<BODY>',
+    '<H1>Note: The first {} TRs were removed from the data before creating these movies.</H1>'.format(cuttrs),
+    '<P>This is a preview: the movies show every {} TR(s) and the statistic images are shown as contact sheets of the axial slices. '
+    'Run mri_quickgifs.py again without --preview to create the full-resolution gifs from the cached statistics.</P>'.format(time_step),
+    '<H2>fMRI Center Slices Over Time</H2>',
+    '<br>',
+    _media_tag('.\pictures_gifs\{}_center_x_preview_3{}'.format(input_prefix,extension),height,height*scale_dict['yz_scale']),
+    _media_tag('.\pictures_gifs\{}_center_y_preview_3{}'.format(input_prefix,extension),height,height*scale_dict['xz_scale']),
+    _media_tag('.\pictures_gifs\{}_center_z_preview_3{}'.format(input_prefix,extension),height,height*scale_dict['xy_scale']),
+    '<br>',
+    '<H2>Mean Image</H2>',
+    '<br>',
+    '<IMAGE SRC=".\pictures_gifs\{}_cut_mean_sheet.png" WIDTH={} ALT="sheet">'.format(input_prefix,sheet_width),
+    '<br>',
+    '<H2>Standard Deviation Image</H2>',
+    '<br>',
+    '<IMAGE SRC=".\pictures_gifs\{}_cut_stdev_sheet.png" WIDTH={} ALT="sheet">'.format(input_prefix,sheet_width),
+    '<br>',
+    '<H2>Temporal SNR Image</H2>',
+    '<br>',
+    '<IMAGE SRC=".\pictures_gifs\{}_cut_snr_sheet.png" WIDTH={} ALT="sheet">'.format(input_prefix,sheet_width),
+    '<br>',
+    '</BODY>',
+    '</HTML>'
+    ]
 
+    output_file = os.path.join(output_dir, 'mriquickgifs_{}.html'.format(input_prefix))
+    with open(output_file, 'w') as fo:
+        for line in line_list:
+            fo.write('{}\n'.format(line))
 
-def _try_delete(file_to_go):
-    if os.path.exists(file_to_go):
-        os.remove(file_to_go)
+    return output_file
 
 
-def _write_html(input_prefix, output_dir, cuttrs, scale_dict):
+def _write_html(input_prefix, output_dir, cuttrs, scale_dict, extension='.gif'):
     #Write out an html file to display the various gifs created.
     #For now, just assume a static set of gifs.
 
@@ -135,27 +268,27 @@ def _write_html(input_prefix, output_dir, cuttrs, scale_dict):
     '<H1>Note: The first {} TRs were removed from the data before creating these movies.</H1>'.format(cuttrs),
     '<H2>fMRI Center Slices Over Time</H2>',
     '<br>',
-    '<IMAGE SRC=".\pictures_gifs\{}_center_x_3.gif" HEIGHT={} WIDTH={} ALT="gif_test">'.format(input_prefix,height,height*scale_dict['yz_scale']),
-    '<IMAGE SRC=".\pictures_gifs\{}_center_y_3.gif" HEIGHT={} WIDTH={} ALT="gif_test">'.format(input_prefix,height,height*scale_dict['xz_scale']),
-    '<IMAGE SRC=".\pictures_gifs\{}_center_z_3.gif" HEIGHT={} WIDTH={} ALT="gif_test">'.format(input_prefix,height,height*scale_dict['xy_scale']),
+    _media_tag('.\pictures_gifs\{}_center_x_3{}'.format(input_prefix,extension),height,height*scale_dict['yz_scale']),
+    _media_tag('.\pictures_gifs\{}_center_y_3{}'.format(input_prefix,extension),height,height*scale_dict['xz_scale']),
+    _media_tag('.\pictures_gifs\{}_center_z_3{}'.format(input_prefix,extension),height,height*scale_dict['xy_scale']),
     '<br>',
     '<H2>Mean Image</H2>',
     '<br>',
-    '<IMAGE SRC=".\pictures_gifs\{}_cut_mean_1.gif" HEIGHT={} WIDTH={} ALT="gif_test">'.format(input_prefix,height,height*scale_dict['yz_scale']),
-    '<IMAGE SRC=".\pictures_gifs\{}_cut_mean_2.gif" HEIGHT={} WIDTH={} ALT="gif_test">'.format(input_prefix,height,height*scale_dict['xz_scale']),
-    '<IMAGE SRC=".\pictures_gifs\{}_cut_mean_3.gif" HEIGHT={} WIDTH={} ALT="gif_test">'.format(input_prefix,height,height*scale_dict['xy_scale']),
+    _media_tag('.\pictures_gifs\{}_cut_mean_1{}'.format(input_prefix,extension),height,height*scale_dict['yz_scale']),
+    _media_tag('.\pictures_gifs\{}_cut_mean_2{}'.format(input_prefix,extension),height,height*scale_dict['xz_scale']),
+    _media_tag('.\pictures_gifs\{}_cut_mean_3{}'.format(input_prefix,extension),height,height*scale_dict['xy_scale']),
     '<br>',
     '<H2>Standard Deviation Image</H2>',
     '<br>',
-    '<IMAGE SRC=".\pictures_gifs\{}_cut_stdev_1.gif" HEIGHT={} WIDTH={} ALT="gif_test">'.format(input_prefix,height,height*scale_dict['yz_scale']),
-    '<IMAGE SRC=".\pictures_gifs\{}_cut_stdev_2.gif" HEIGHT={} WIDTH={} ALT="gif_test">'.format(input_prefix,height,height*scale_dict['xz_scale']),
-    '<IMAGE SRC=".\pictures_gifs\{}_cut_stdev_3.gif" HEIGHT={} WIDTH={} ALT="gif_test">'.format(input_prefix,height,height*scale_dict['xy_scale']),
+    _media_tag('.\pictures_gifs\{}_cut_stdev_1{}'.format(input_prefix,extension),height,height*scale_dict['yz_scale']),
+    _media_tag('.\pictures_gifs\{}_cut_stdev_2{}'.format(input_prefix,extension),height,height*scale_dict['xz_scale']),
+    _media_tag('.\pictures_gifs\{}_cut_stdev_3{}'.format(input_prefix,extension),height,height*scale_dict['xy_scale']),
     '<br>',
     '<H2>Temporal SNR Image</H2>',
     '<br>',
-    '<IMAGE SRC=".\pictures_gifs\{}_cut_snr_1.gif" HEIGHT={} WIDTH={} ALT="gif_test">'.format(input_prefix,height,height*scale_dict['yz_scale']),
-    '<IMAGE SRC=".\pictures_gifs\{}_cut_snr_2.gif" HEIGHT={} WIDTH={} ALT="gif_test">'.format(input_prefix,height,height*scale_dict['xz_scale']),
-    '<IMAGE SRC=".\pictures_gifs\{}_cut_snr_3.gif" HEIGHT={} WIDTH={} ALT="gif_test">'.format(input_prefix,height,height*scale_dict['xy_scale']),
+    _media_tag('.\pictures_gifs\{}_cut_snr_1{}'.format(input_prefix,extension),height,height*scale_dict['yz_scale']),
+    _media_tag('.\pictures_gifs\{}_cut_snr_2{}'.format(input_prefix,extension),height,height*scale_dict['xz_scale']),
+    _media_tag('.\pictures_gifs\{}_cut_snr_3{}'.format(input_prefix,extension),height,height*scale_dict['xy_scale']),
     '<br>',
     '</BODY>',
     '</HTML>'
@@ -169,52 +302,333 @@ def _write_html(input_prefix, output_dir, cuttrs, scale_dict):
     return output_file
 
 
-def arr_to_gif(input_array, slice_dim, output_dir, output_gif_prefix, prog_rows_flag=0, duration=0.1):
-    #Scale the image to 0-255
-    input_array = _grayscale_conv(input_array, perc=99.95)
-
-    #Transpose the data so we can always create slices along the
-    #last dimension of the array.
-    transpose_array = np.arange(3)
-    transpose_array = np.roll(transpose_array, 3-slice_dim)
-
-    data_to_slice = input_array.transpose(transpose_array)
-    num_slices = data_to_slice.shape[-1]
-
-    #If desired, create some rows to add to the bottom of the picture to
-    #display progress through the gif
-    if prog_rows_flag:
-        longest_side = max(data_to_slice.shape[0:2])
-        step_per_picture = float(longest_side)/float(num_slices)
-        progress_indices = np.ceil(np.arange(num_slices)*step_per_picture)
-
-    #Create pictures of each slice
-    slice_files = []
-    for slice_num in range(num_slices):
-        slice_data = data_to_slice[:,:,slice_num]
-        if prog_rows_flag:
-            prog_rows = np.zeros((5, longest_side))
-            prog_rows[:, 0:int(progress_indices[slice_num])] = 255
+def _chunk_vols_for_budget(img_dims, data_dtype, stats_dtype, max_memory=None, detrend_order=1, jobs=1):
+    #Work out how many volumes to read at a time. With no memory budget
+    #a fixed default is used; otherwise the chunk is sized so that the
+    #statistics, the center slice images and one chunk fit in max_memory MB.
+    if max_memory is None:
+        return DEFAULT_CHUNK_VOLS
+    vol_voxels = img_dims[0]*img_dims[1]*img_dims[2]
+    stats_bytes = np.dtype(stats_dtype).itemsize
+    #Accumulators (one per basis function plus sum(y^2)), offset and the
+    #three output images of _TemporalStats
+    fixed_bytes = (detrend_order+6)*vol_voxels*stats_bytes
+    #Center slice images through time
+    fixed_bytes += (img_dims[1]*img_dims[2] + img_dims[0]*img_dims[2] + img_dims[0]*img_dims[1])*img_dims[3]*np.dtype(data_dtype).itemsize
+    #Each volume in a chunk is held as read, plus a slab of it in each
+    #thread's work buffer
+    if jobs is None or jobs < 1:
+        jobs = os.cpu_count() or 1
+    per_vol_bytes = vol_voxels*np.dtype(data_dtype).itemsize + jobs*min(vol_voxels, STATS_SLAB_VOXELS)*stats_bytes
+    budget_bytes = float(max_memory)*1024*1024 - fixed_bytes
+    if budget_bytes < per_vol_bytes:
+        print('WARNING: --max-memory of {} MB is too small for this image; reading one volume at a time'.format(max_memory))
+        return 1
+    return int(budget_bytes // per_vol_bytes)
+
+
+def _open_gzip(input_file, gzip_backend='auto'):
+    #Open a gzipped file for sequential reading. 'auto' uses the fastest
+    #installed inflate implementation (isal, then zlib-ng), falling back
+    #to the standard library.
+    if gzip_backend in ('auto', 'isal'):
+        try:
+            from isal import igzip
+            return igzip.open(input_file, 'rb')
+        except ImportError:
+            if gzip_backend == 'isal':
+                print('gzip backend "isal" requested but python-isal is not installed!')
+                raise RuntimeError
+    if gzip_backend in ('auto', 'zlib-ng'):
+        try:
+            from zlib_ng import gzip_ng
+            return gzip_ng.open(input_file, 'rb')
+        except ImportError:
+            if gzip_backend == 'zlib-ng':
+                print('gzip backend "zlib-ng" requested but zlib-ng is not installed!')
+                raise RuntimeError
+    if gzip_backend not in ('auto', 'stdlib'):
+        print('Unrecognized gzip backend: {}'.format(gzip_backend))
+        raise RuntimeError
+    return gzip.open(input_file, 'rb')
+
+
+def _read_full(fobj, buffer_view):
+    #Fill buffer_view from fobj, returning the number of bytes read
+    #(less than the buffer size only at the end of the file)
+    num_read = 0
+    while num_read < len(buffer_view):
+        this_read = fobj.readinto(buffer_view[num_read:])
+        if not this_read:
+            break
+        num_read += this_read
+    return num_read
+
+
+def _iter_gz_time_chunks(input_img, start_vol, chunk_vols, gzip_backend='auto'):
+    #Inflate a compressed image once, front to back, yielding chunks of
+    #volumes as soon as they are decompressed. Volumes are contiguous in
+    #a NIfTI file (time is the slowest axis), so each chunk is a single read.
+    from nibabel.volumeutils import apply_read_scaling
+    data_proxy = input_img.dataobj
+    vol_shape = tuple(input_img.shape[:3])
+    num_vols = input_img.shape[3]
+    data_dtype = data_proxy.dtype
+    vol_bytes = int(np.prod(vol_shape))*data_dtype.itemsize
+    chunk_buffer = bytearray(vol_bytes*min(chunk_vols, num_vols-start_vol))
+    with _open_gzip(input_img.get_filename(), gzip_backend) as fobj:
+        #Skip the header and any volumes being cut (forward seeks only)
+        fobj.seek(int(data_proxy.offset) + start_vol*vol_bytes)
+        for first_vol in range(start_vol, num_vols, chunk_vols):
+            num_chunk = min(chunk_vols, num_vols-first_vol)
+            buffer_view = memoryview(chunk_buffer)[:num_chunk*vol_bytes]
+            if _read_full(fobj, buffer_view) != len(buffer_view):
+                print('Compressed image ended early: {}'.format(input_img.get_filename()))
+                raise RuntimeError
+            chunk = np.frombuffer(buffer_view, dtype=data_dtype).reshape(vol_shape + (num_chunk,), order='F')
+            if data_proxy.slope != 1 or data_proxy.inter != 0:
+                chunk = apply_read_scaling(chunk, data_proxy.slope, data_proxy.inter)
+            yield first_vol-start_vol, chunk
+
+
+def _iter_time_chunks(input_img, input_extension, start_vol, chunk_vols, gzip_backend='auto'):
+    #Yield (first_volume, chunk) pairs of consecutive volumes, beginning
+    #at start_vol. Uncompressed images are memory-mapped by nibabel, so
+    #slicing the dataobj only reads the requested volumes from disk.
+    #Compressed images are streamed through a single sequential inflate.
+    #The chunks may share memory with each other, so copy anything that
+    #needs to outlive the next chunk.
+    if input_extension != '.nii':
+        for chunk_info in _iter_gz_time_chunks(input_img, start_vol, chunk_vols, gzip_backend):
+            yield chunk_info
+        return
+    num_vols = input_img.shape[3]
+    for first_vol in range(start_vol, num_vols, chunk_vols):
+        last_vol = min(first_vol+chunk_vols, num_vols)
+        yield first_vol-start_vol, np.asanyarray(input_img.dataobj[..., first_vol:last_vol])
+
+
+class _CenterSlices():
+    #Collect the center slice along each axis at every time point
+    #from chunks of volumes.
+    def __init__(self, img_dims):
+        self.img_dims = img_dims
+        self.center_x = round(img_dims[0] / 2.0)
+        self.center_y = round(img_dims[1] / 2.0)
+        self.center_z = round(img_dims[2] / 2.0)
+        self.center_x_image = None
+        self.center_y_image = None
+        self.center_z_image = None
+
+    def update(self, first_vol, chunk):
+        #Copy the center slices of a chunk that starts at time point first_vol
+        if self.center_x_image is None:
+            x_dim, y_dim, z_dim, time_points = self.img_dims
+            self.center_x_image = np.empty((y_dim, z_dim, time_points), dtype=chunk.dtype)
+            self.center_y_image = np.empty((x_dim, z_dim, time_points), dtype=chunk.dtype)
+            self.center_z_image = np.empty((x_dim, y_dim, time_points), dtype=chunk.dtype)
+        last_vol = first_vol + chunk.shape[3]
+        self.center_x_image[:, :, first_vol:last_vol] = chunk[self.center_x, :, :, :]
+        self.center_y_image[:, :, first_vol:last_vol] = chunk[:, self.center_y, :, :]
+        self.center_z_image[:, :, first_vol:last_vol] = chunk[:, :, self.center_z, :]
+
+
+class _TemporalStats():
+    #Accumulate everything needed for the temporal mean, the detrended
+    #temporal standard deviation and the temporal SNR in a single pass over
+    #time. Instead of building detrended copies of the 4D data, each voxel's
+    #time series is projected onto a polynomial (Legendre) basis of time as
+    #the chunks arrive, and the fit is solved at the end with a precomputed
+    #pseudo-inverse of the small shared design Gram matrix.
+    #The voxels are split into slabs that are processed on a thread pool
+    #(numpy releases the GIL for the GEMMs); each thread reuses one
+    #preallocated slab-sized work buffer, so no full-size copy of a chunk
+    #is ever made.
+    def __init__(self, vol_shape, dtype=np.float64, detrend_order=1, total_vols=None, jobs=1):
+        self.vol_shape = tuple(vol_shape)
+        self.dtype = np.dtype(dtype)
+        self.detrend_order = int(detrend_order)
+        if self.detrend_order < 0:
+            raise RuntimeError('Detrend order must be 0 or more: {}'.format(detrend_order))
+        #With the length of the series known, time is mapped onto [-1, 1]
+        #(where the Legendre basis is well conditioned)
+        if total_vols is not None and total_vols > 1:
+            self.time_center = (total_vols - 1)/2.0
+            self.time_scale = (total_vols - 1)/2.0
         else:
-            prog_rows = None
-        slice_to_write = _format_picture(slice_data, bot_rows_to_add=prog_rows)
-        slice_outfile = os.path.join(output_dir, 'temp_slice_gif_{}.png'.format(slice_num))
-        slice_to_write.save(slice_outfile)
-        slice_files.append(slice_outfile)
-    #Create a gif of the center slice pictures
-    images = []
-    for filename in slice_files:
-        images.append(imageio.imread(filename))
-    output_gif = os.path.join(output_dir, '{prefix}_{dim}.gif'.format(prefix=output_gif_prefix,dim=slice_dim))
-    imageio.mimsave(output_gif, images, duration=duration)
-    #Delete pngs
-    for filename in slice_files:
-        _try_delete(filename)
-    return output_gif
+            self.time_center = 0.0
+            self.time_scale = 1.0
+        self.num_vols = 0
+        num_voxels = int(np.prod(self.vol_shape))
+        num_basis = self.detrend_order + 1
+        #Gram matrix of the design (shared by every voxel)
+        self.gram = np.zeros((num_basis, num_basis), dtype=np.float64)
+        #The data are shifted by the first volume before being summed to
+        #keep the sums small (detrending is unaffected by a constant shift)
+        self.offset = None
+        #Projections of each voxel onto the basis (the first is the sum of y)
+        self.sum_basis_y = np.zeros((num_basis, num_voxels), dtype=self.dtype)
+        self.sum_yy = np.zeros(num_voxels, dtype=self.dtype)
+        self.max_chunk = 0
+        self.thread_buffers = threading.local()
+        if jobs is None or jobs < 1:
+            jobs = os.cpu_count() or 1
+        self.jobs = int(jobs)
+        self.slabs = [slice(x, min(x+STATS_SLAB_VOXELS, num_voxels)) for x in range(0, num_voxels, STATS_SLAB_VOXELS)]
+        self.executor = None
+
+    def _map_slabs(self, slab_function, *slab_args):
+        #Run slab_function(slab, *slab_args) for every slab of voxels
+        if self.jobs == 1:
+            for slab in self.slabs:
+                slab_function(slab, *slab_args)
+            return
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.jobs)
+        for slab_result in self.executor.map(lambda x: slab_function(x, *slab_args), self.slabs):
+            pass
+
+    def _basis(self, first_vol, num_chunk):
+        #Legendre polynomials of (scaled) time for a run of volumes
+        t = (np.arange(first_vol, first_vol+num_chunk, dtype=np.float64) - self.time_center)/self.time_scale
+        return np.polynomial.legendre.legvander(t, self.detrend_order)
+
+    def _update_slab(self, slab, flat_chunk, basis):
+        #Shift the slab into this thread's (volumes, voxels) work buffer and
+        #add its projections and sum of squares
+        buffer = getattr(self.thread_buffers, 'buffer', None)
+        if buffer is None or buffer.shape[0] < self.max_chunk:
+            buffer = np.empty((self.max_chunk, STATS_SLAB_VOXELS), dtype=self.dtype)
+            self.thread_buffers.buffer = buffer
+        work = buffer[:flat_chunk.shape[1], :slab.stop-slab.start]
+        np.subtract(flat_chunk[slab].T, self.offset[slab], out=work, casting='unsafe')
+        self.sum_basis_y[:, slab] += np.dot(basis.T, work)
+        self.sum_yy[slab] += np.einsum('ij,ij->j', work, work)
+
+    def update(self, chunk):
+        #Add a 4D chunk of consecutive volumes (time on the last axis)
+        if chunk.ndim == 3:
+            chunk = chunk[..., np.newaxis]
+        num_chunk = chunk.shape[3]
+        #(voxels, volumes), a view for the usual Fortran-ordered chunks
+        flat_chunk = chunk.reshape((-1, num_chunk), order='F')
+        if self.offset is None:
+            self.offset = np.array(flat_chunk[:, 0], dtype=self.dtype)
+        self.max_chunk = max(self.max_chunk, num_chunk)
+        basis = self._basis(self.num_vols, num_chunk)
+        self._map_slabs(self._update_slab, flat_chunk, basis.astype(self.dtype))
+        self.gram += np.dot(basis.T, basis)
+        self.num_vols += num_chunk
+
+    def _rss_slab(self, slab, gram_pinv, rss):
+        #Residual sum of squares: sum(y^2) minus the part explained by the fit
+        projections = self.sum_basis_y[:, slab]
+        slab_coefficients = np.dot(gram_pinv, projections)
+        rss[slab] = self.sum_yy[slab] - np.einsum('ij,ij->j', slab_coefficients, projections)
+        if self.coefficients is not None:
+            self.coefficients[:, slab] = slab_coefficients
+
+    def finalize(self, keep_fit=0):
+        #Return the temporal mean, detrended stdev and tSNR images. With
+        #keep_fit, the polynomial coefficients of every voxel are kept for
+        #residuals().
+        if self.num_vols == 0:
+            raise RuntimeError('No volumes were passed to the temporal statistics!')
+        n = float(self.num_vols)
+        gram_pinv = np.linalg.pinv(self.gram).astype(self.dtype)
+        rss = np.empty(self.sum_yy.shape, dtype=self.dtype)
+        if keep_fit:
+            self.coefficients = np.empty(self.sum_basis_y.shape, dtype=self.dtype)
+        else:
+            self.coefficients = None
+        self._map_slabs(self._rss_slab, gram_pinv, rss)
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.thread_buffers = threading.local()
+        np.maximum(rss, 0, out=rss)
+        stdev_data = np.sqrt(rss/n).reshape(self.vol_shape, order='F')
+        mean_data = (self.sum_basis_y[0]/n + self.offset).reshape(self.vol_shape, order='F')
+        tsnr_data = np.zeros(mean_data.shape, dtype=self.dtype)
+        tsnr_data = np.divide(mean_data, stdev_data, out=tsnr_data, where=stdev_data!=0)
+        return mean_data, stdev_data, tsnr_data
+
+    def residuals(self, chunks):
+        #Yield the detrended series (each voxel minus its fitted polynomial,
+        #so the standard deviation image is their RMS) as float32
+        #(volumes, voxels) arrays, from the same chunks passed to update()
+        #again. Needs finalize(keep_fit=1).
+        for first_vol, chunk in chunks:
+            if chunk.ndim == 3:
+                chunk = chunk[..., np.newaxis]
+            num_chunk = chunk.shape[3]
+            flat_chunk = chunk.reshape((-1, num_chunk), order='F')
+            basis = self._basis(first_vol, num_chunk).astype(self.dtype)
+            residual_chunk = np.empty((num_chunk, flat_chunk.shape[0]), dtype=np.float32)
+            for slab in self.slabs:
+                residual_chunk[:, slab] = flat_chunk[slab].T - self.offset[slab] - np.dot(basis, self.coefficients[:, slab])
+            yield residual_chunk
+
+
+def _encode_array(input_array, slice_dim, output_dir, output_gif_prefix, prog_rows_flag=0, duration=0.1,
+                  encoder=mqenc.DEFAULT_ENCODER):
+    #Build all the frames in memory at once and write them out in one pass
+    #(no temporary files, so concurrent runs can't collide). Returns the
+    #file name, encode time and file size.
+    frames = _build_frames(input_array, slice_dim, prog_rows_flag=prog_rows_flag)
+    output_base = os.path.join(output_dir, '{prefix}_{dim}'.format(prefix=output_gif_prefix,dim=slice_dim))
+    return mqenc.encode_frames(frames, output_base, duration=duration, encoder=encoder)
+
+
+def arr_to_gif(input_array, slice_dim, output_dir, output_gif_prefix, prog_rows_flag=0, duration=0.1,
+               encoder=mqenc.DEFAULT_ENCODER):
+    #Write the slices of a 3D array along slice_dim as an animation (a gif
+    #unless another encoder is chosen) and return its file name
+    return _encode_array(input_array, slice_dim, output_dir, output_gif_prefix, prog_rows_flag=prog_rows_flag,
+                         duration=duration, encoder=encoder)[0]
+
+
+def _report_progress(progress, stage, fraction):
+    #Pass a stage name and the fraction of it done to a progress callback
+    #(if there is one). The callback may raise an exception to stop the run.
+    if progress is not None:
+        progress(stage, fraction)
+
+
+def _render_gifs(render_jobs, output_dir, jobs=1, profiler=NO_PROFILE, encoder=mqenc.DEFAULT_ENCODER, progress=None):
+    #Encode each (array, slice_dim, prefix, prog_rows_flag, duration) job.
+    #With jobs > 1 they are spread over a thread pool; the source arrays
+    #are shared (read-only) between threads rather than copied. A list of
+    #(file name, encode time, bytes) is returned in job order whatever
+    #order they finish in.
+    done_lock = threading.Lock()
+    done_count = [0]
+
+    def render_one(job):
+        with profiler.stage('gif {}_{}'.format(job[2], job[1])):
+            encoded_file = _encode_array(job[0], job[1], output_dir, job[2], prog_rows_flag=job[3], duration=job[4], encoder=encoder)
+        with done_lock:
+            done_count[0] += 1
+            _report_progress(progress, 'gifs', done_count[0]/float(len(render_jobs)))
+        return encoded_file
+
+    if jobs is None or jobs < 1:
+        jobs = os.cpu_count() or 1
+    #A cached rerun may have no gifs left to render
+    if jobs == 1 or len(render_jobs) < 2:
+        return [render_one(x) for x in render_jobs]
+    with ThreadPoolExecutor(max_workers=min(jobs, len(render_jobs))) as executor:
+        futures = [executor.submit(render_one, x) for x in render_jobs]
+        return [x.result() for x in futures]
 
 
 # def main(args):
-def main(cuttrs, raw_input_file, save_int, output_dir):
+def main(cuttrs, raw_input_file, save_int, output_dir, float32=0, max_memory=None, gzip_backend='auto', jobs=1,
+         force=0, cache_dir=None, cache_max_mb=None, cache_hash=0, profile=0, preview=0, encoder=mqenc.DEFAULT_ENCODER,
+         detrend_order=1, progress=None, save_compression=mqsave.DEFAULT_COMPRESSION, save_series=0):
+
+    #Per-stage timing/memory profiling (does nothing unless profile is set)
+    profiler = StageProfiler(enabled=profile)
 
     #Extract the number of TRs to cut (default is 0)
     # cuttrs = int(args.cuttrs)
@@ -226,6 +640,9 @@ def main(cuttrs, raw_input_file, save_int, output_dir):
     # save_int = args.saveimages
     if save_int:
         print('--saveimages set; will output intermediate images...')
+    elif save_series:
+        print('The detrended series is only saved along with --saveimages!')
+        raise RuntimeError
 
     #If the input file name wasn't passed with a path, append the
     #current working directory.
@@ -257,19 +674,31 @@ def main(cuttrs, raw_input_file, save_int, output_dir):
         print('Creating asset output directory: {}'.format(picgifs_output_dir))
         os.mkdir(picgifs_output_dir)
     saveint_output_dir = os.path.join(output_dir, 'intermediate_images')
-    if save_int:
+    if save_int and not os.path.exists(saveint_output_dir):
         print('Creating intermediate image output directory: {}'.format(saveint_output_dir))
         os.mkdir(saveint_output_dir)
 
-    #Read the input file in as a nibabel image object
-    input_img = nib.load(input_func_data)
-    input_data = input_img.get_data()
-    ##TODO: Check the shape of the input data (should be 4D)
-    print('Removing first {} timepoints...'.format(cuttrs))
-    cut_data = input_data[:,:,:,cuttrs:]
+    _report_progress(progress, 'starting', 0.0)
+
+    #Make sure the chosen animation encoder can be used before any work is done
+    mqenc.check_encoder(encoder)
+    gif_extension = mqenc.extension(encoder)
+
+    #Read the input file in as a nibabel image object. Only the header is
+    #read here; the data are read in chunks of volumes below.
+    with profiler.stage('load header'):
+        import nibabel as nib
+        input_img = nib.load(input_func_data, mmap=True)
+    if len(input_img.shape) != 4:
+        print('Input image should be 4D! Instead has shape: {}'.format(input_img.shape))
+        raise RuntimeError
+    num_vols = input_img.shape[3]
+    if cuttrs >= num_vols:
+        print('Cannot remove {} timepoints from an image with only {}!'.format(cuttrs, num_vols))
+        raise RuntimeError
 
-    #Get the number of voxels in each dimension
-    img_dims = cut_data.shape
+    #Get the number of voxels in each dimension (after the cut)
+    img_dims = tuple(input_img.shape[:3]) + (num_vols-cuttrs,)
 
     #Get the voxel sizes in mm
     input_header = input_img.header
@@ -281,74 +710,213 @@ def main(cuttrs, raw_input_file, save_int, output_dir):
     print('scale_dict: {}'.format(scale_dict))
     print('vox_sizes: {}'.format(vox_sizes))
 
-    #Detrend data and create temporal standard deviation images
-    print('Detrending input data...')
-    detrend_data = signal.detrend(input_data, axis=3, type='linear')
-    detrend_cut = signal.detrend(cut_data, axis=3, type='linear')
-    print('Creating temporal standard deviation image...')
-    stdev_data = np.std(detrend_data, axis=3)
-    stdev_cut = np.std(cut_data, axis=3)
-
-    #Create temporal mean image
-    print('Creating temporal mean image...')
-    mean_data = np.mean(input_data, axis=3)
-    mean_cut = np.mean(cut_data, axis=3)
-
-    #Create temporal SNR image
-    print('Creating temporal SNR image...')
-    tsnr_data = np.zeros(mean_data.shape)
-    tsnr_data = np.divide(mean_data, stdev_data, out=tsnr_data, where=stdev_data!=0)
-    tsnr_cut = np.zeros(mean_cut.shape)
-    tsnr_cut = np.divide(mean_cut, stdev_cut, out=tsnr_cut, where=stdev_cut!=0)
-
-    ##Create gifs that go through the center slices at each timepoint##
-    #Get the center slice number of each dimension
-    center_x = round(img_dims[0] / 2.0)
-    center_y = round(img_dims[1] / 2.0)
-    center_z = round(img_dims[2] / 2.0)
-    time_points = img_dims[3]
-
-    #Keep only the center slice of each dimension
-    center_x_image = cut_data[center_x, :, :, :]
-    center_y_image = cut_data[:, center_y, :, :]
-    center_z_image = cut_data[:, :, center_z, :]
-
     #Get the input image prefix
     input_prefix = os.path.split(input_func_data)[-1].split('.nii')[0]
 
-    #Create gifs through time
-    print('Creating center slice gifs...')
-    center_x_gif = arr_to_gif(center_x_image, 3, picgifs_output_dir, '{}_center_x'.format(input_prefix), prog_rows_flag=1)
-    center_y_gif = arr_to_gif(center_y_image, 3, picgifs_output_dir, '{}_center_y'.format(input_prefix), prog_rows_flag=1)
-    center_z_gif = arr_to_gif(center_z_image, 3, picgifs_output_dir, '{}_center_z'.format(input_prefix), prog_rows_flag=1)
-
-    ##Create gifs going through the mean image in each dimension
-    print('Creating temporal mean gifs...')
-    mean_gif_one = arr_to_gif(mean_cut, 1, picgifs_output_dir, '{}_cut_mean'.format(input_prefix), prog_rows_flag=0, duration=0.2)
-    mean_gif_two = arr_to_gif(mean_cut, 2, picgifs_output_dir, '{}_cut_mean'.format(input_prefix), prog_rows_flag=0, duration=0.2)
-    mean_gif_three = arr_to_gif(mean_cut, 3, picgifs_output_dir, '{}_cut_mean'.format(input_prefix), prog_rows_flag=0, duration=0.2)
-
-    #Create gifs going through the stdev image
-    print('Creating temporal standard deviation gifs...')
-    stdev_gif_one = arr_to_gif(stdev_cut, 1, picgifs_output_dir, '{}_cut_stdev'.format(input_prefix), prog_rows_flag=0, duration=0.2)
-    stdev_gif_two = arr_to_gif(stdev_cut, 2, picgifs_output_dir, '{}_cut_stdev'.format(input_prefix), prog_rows_flag=0, duration=0.2)
-    stdev_gif_three = arr_to_gif(stdev_cut, 3, picgifs_output_dir, '{}_cut_stdev'.format(input_prefix), prog_rows_flag=0, duration=0.2)
-
-    #Create gifs going through the snr image
-    print('Creating temporal SNR gifs...')
-    snr_gif_one = arr_to_gif(tsnr_cut, 1, picgifs_output_dir, '{}_cut_snr'.format(input_prefix), prog_rows_flag=0, duration=0.2)
-    snr_gif_two = arr_to_gif(tsnr_cut, 2, picgifs_output_dir, '{}_cut_snr'.format(input_prefix), prog_rows_flag=0, duration=0.2)
-    snr_gif_three = arr_to_gif(tsnr_cut, 3, picgifs_output_dir, '{}_cut_snr'.format(input_prefix), prog_rows_flag=0, duration=0.2)
+    #The gifs to create: (array name, slice_dim, gif prefix, prog_rows_flag, duration).
+    #First the center slices through time, then the mean, stdev and snr
+    #images along each dimension.
+    gif_specs = [
+        ('center_x', 3, '{}_center_x'.format(input_prefix), 1, 0.1),
+        ('center_y', 3, '{}_center_y'.format(input_prefix), 1, 0.1),
+        ('center_z', 3, '{}_center_z'.format(input_prefix), 1, 0.1),
+        ]
+    for array_name, stat_name in [('mean', 'mean'), ('stdev', 'stdev'), ('tsnr', 'snr')]:
+        for slice_dim in [1, 2, 3]:
+            gif_specs.append((array_name, slice_dim, '{}_cut_{}'.format(input_prefix, stat_name), 0, 0.2))
+    if preview:
+        #Preview tier: center slice gifs with at most PREVIEW_FRAMES frames
+        #and a contact sheet per statistic instead of its three gifs. The
+        #full-resolution gifs are made by a later run without --preview
+        #(from the cached statistics).
+        time_step = max(1, int(np.ceil(img_dims[3]/float(PREVIEW_FRAMES))))
+        gif_specs = [(x[0], x[1], x[2]+'_preview', x[3], x[4]) for x in gif_specs if x[0].startswith('center')]
+        sheet_specs = [(x, '{}_cut_{}'.format(input_prefix, y)) for x, y in [('mean', 'mean'), ('stdev', 'stdev'), ('tsnr', 'snr')]]
+    else:
+        time_step = 1
+        sheet_specs = []
+    gif_files = [os.path.join(picgifs_output_dir, '{}_{}{}'.format(x[2], x[1], gif_extension)) for x in gif_specs]
+    sheet_files = [os.path.join(picgifs_output_dir, '{}_sheet.png'.format(x[1])) for x in sheet_specs]
+    output_html = os.path.join(output_dir, 'mriquickgifs_{}.html'.format(input_prefix))
+    metrics_file = os.path.join(output_dir, 'mriquickgifs_{}_metrics.json'.format(input_prefix))
+    #With --saveimages, the statistic images (and the detrended series)
+    #are written to intermediate_images/ as float32 NIfTI files
+    saved_images = []
+    if save_int:
+        for array_name in ['mean', 'stdev', 'tsnr']:
+            saved_images.append((array_name, mqsave.image_file(saveint_output_dir, '{}_cut_{}'.format(input_prefix, array_name), save_compression)))
+    series_file = None
+    if save_int and save_series:
+        series_file = mqsave.image_file(saveint_output_dir, '{}_cut_detrended'.format(input_prefix), save_compression)
+    saved_files = [x[1] for x in saved_images] + [x for x in [series_file] if x is not None]
+
+    #Check the cache: skip the run if nothing has changed, or reuse the
+    #saved statistics if only some outputs are missing
+    if cache_dir is None:
+        cache_root = os.path.join(output_dir, 'cache')
+    else:
+        cache_root = cache_dir
+    #The encoder and report tier don't change the statistics (so aren't in
+    #the cache key) but do change the gifs, html and metrics
+    output_params = {'encoder': encoder, 'preview': int(bool(preview))}
+    up_to_date = 0
+    with profiler.stage('cache check'):
+        cache_key, key_dict = mqcache.make_cache_key(input_func_data, {'cuttrs': cuttrs, 'float32': float32, 'detrend_order': detrend_order}, __version__, hash_input=cache_hash)
+        array_names = ['mean', 'stdev', 'tsnr', 'center_x', 'center_y', 'center_z', 'global_signal', 'dvars', 'slice_means']
+        arrays = None
+        if force:
+            print('--force set; ignoring any cached results...')
+        elif mqcache.outputs_current(output_dir, cache_key, gif_files + sheet_files + [output_html, metrics_file] + saved_files,
+                                     output_params=output_params):
+            up_to_date = 1
+        else:
+            arrays = mqcache.load_arrays(cache_root, cache_key, array_names)
+            if arrays is not None and series_file is not None and not os.path.exists(series_file):
+                #The detrended series needs the fit, which isn't cached
+                arrays = None
+    #Return after the cache check stage has closed, so it is in the report
+    if up_to_date:
+        print('-------------------------------------------------')
+        print('Input and parameters unchanged; outputs are up to date.')
+        print('Output html file: {}'.format(output_html))
+        print('-------------------------------------------------')
+        if profile:
+            profiler.write_report(os.path.join(output_dir, 'mriquickgifs_{}_profile.json'.format(input_prefix)))
+        _report_progress(progress, 'done', 1.0)
+        return output_html
+
+    stage_times = {}
+    stage_start = time.time()
+    stats = None
+    if arrays is not None:
+        print('Using cached statistics from: {}'.format(os.path.join(cache_root, cache_key)))
+        #Existing animations are only kept if the last run used the same
+        #encoder (gif and gif-optimized files share a name)
+        last_manifest = mqcache.read_manifest(output_dir)
+        if last_manifest is not None and (last_manifest.get('output_params') or {}).get('encoder') != encoder:
+            print('Encoder changed since the last run; rewriting the animations...')
+        else:
+            gif_specs = [x for x, y in zip(gif_specs, gif_files) if not os.path.exists(y)]
+        sheet_specs = [x for x, y in zip(sheet_specs, sheet_files) if not os.path.exists(y)]
+    else:
+        #Create temporal mean, (polynomially detrended) standard deviation and
+        #SNR images and pull out the center slices in a single pass over
+        #chunks of the cut data
+        print('Removing first {} timepoints...'.format(cuttrs))
+        print('Creating temporal mean, standard deviation and SNR images...')
+        if float32:
+            stats_dtype = np.float32
+        else:
+            stats_dtype = np.float64
+        chunk_vols = _chunk_vols_for_budget(img_dims, input_img.get_data_dtype(), stats_dtype, max_memory,
+                                            detrend_order=detrend_order, jobs=jobs)
+        print('Reading {} volumes at a time...'.format(chunk_vols))
+        stats = _TemporalStats(img_dims[:3], dtype=stats_dtype, detrend_order=detrend_order, total_vols=img_dims[3], jobs=jobs)
+        center_slices = _CenterSlices(img_dims)
+        volume_metrics = mqmetrics.VolumeMetrics(img_dims[:3])
+        chunk_iter = _iter_time_chunks(input_img, input_extension, cuttrs, chunk_vols, gzip_backend=gzip_backend)
+        while True:
+            with profiler.stage('read (+cut)'):
+                chunk_info = next(chunk_iter, None)
+            if chunk_info is None:
+                break
+            first_vol, chunk = chunk_info
+            _report_progress(progress, 'statistics', first_vol/float(img_dims[3]))
+            with profiler.stage('detrend + statistics'):
+                stats.update(chunk)
+            with profiler.stage('center slices'):
+                center_slices.update(first_vol, chunk)
+            with profiler.stage('metrics series'):
+                volume_metrics.update(chunk)
+        with profiler.stage('detrend + statistics'):
+            stats_images = stats.finalize(keep_fit=series_file is not None)
+        arrays = {}
+        arrays['mean'], arrays['stdev'], arrays['tsnr'] = stats_images
+        #Keep only the center slice of each dimension
+        arrays['center_x'] = center_slices.center_x_image
+        arrays['center_y'] = center_slices.center_y_image
+        arrays['center_z'] = center_slices.center_z_image
+        #Per-volume global signal, DVARS and slice means for the metrics
+        arrays.update(volume_metrics.series())
+        with profiler.stage('cache save'):
+            mqcache.save_arrays(cache_root, cache_key, arrays)
+            mqcache.evict(cache_root, cache_max_mb, keep_key=cache_key)
+
+    #Save the intermediate images on a background thread while the gifs are
+    #rendered. The detrended series is made by reading the data again.
+    image_writer = None
+    if save_int:
+        print('Saving intermediate images in the background...')
+        image_writer = mqsave.ImageWriter(profiler=profiler)
+        for array_name, saved_file in saved_images:
+            image_writer.submit(mqsave.write_image, arrays[array_name], input_header, input_img.affine, saved_file, save_compression)
+        if series_file is not None and stats is not None:
+            residual_chunks = stats.residuals(_iter_time_chunks(input_img, input_extension, cuttrs, chunk_vols, gzip_backend=gzip_backend))
+            image_writer.submit(mqsave.write_series, residual_chunks, img_dims, input_header, input_img.affine, series_file, save_compression)
+
+    #Create the gifs
+    print('Creating center slice, temporal mean, standard deviation and SNR gifs ({} to write)...'.format(len(gif_specs)))
+    stage_times['statistics'] = time.time() - stage_start
+    stage_start = time.time()
+    render_jobs = []
+    for gif_spec in gif_specs:
+        if gif_spec[0].startswith('center'):
+            render_jobs.append((arrays[gif_spec[0]][..., ::time_step],) + tuple(gif_spec[1:]))
+        else:
+            render_jobs.append((arrays[gif_spec[0]],) + tuple(gif_spec[1:]))
+    _report_progress(progress, 'gifs', 0.0)
+    encoded_files = _render_gifs(render_jobs, picgifs_output_dir, jobs=jobs, profiler=profiler, encoder=encoder, progress=progress)
+    for array_name, sheet_prefix in sheet_specs:
+        with profiler.stage('sheet {}'.format(sheet_prefix)):
+            write_contact_sheet(arrays[array_name], picgifs_output_dir, sheet_prefix)
+    stage_times['gifs'] = time.time() - stage_start
 
     #Write out the html
+    _report_progress(progress, 'html', 0.0)
     print('Writing output html file...')
-    output_html = _write_html(input_prefix, output_dir, cuttrs, scale_dict)
+    stage_start = time.time()
+    with profiler.stage('write html'):
+        if preview:
+            output_html = _write_preview_html(input_prefix, output_dir, cuttrs, scale_dict, time_step, extension=gif_extension)
+        else:
+            output_html = _write_html(input_prefix, output_dir, cuttrs, scale_dict, extension=gif_extension)
     if output_html is None:
         print('Something went wrong creating html file! -- mri_quickgifs.main()')
         raise RuntimeError
+    stage_times['html'] = time.time() - stage_start
+
+    #Write out the quantitative QC metrics (from the arrays already made)
+    _report_progress(progress, 'metrics', 0.0)
+    print('Writing QC metrics file...')
+    with profiler.stage('metrics'):
+        metrics = mqmetrics.summarize(arrays['mean'], arrays['stdev'], arrays['tsnr'], arrays, stage_times=stage_times)
+        metrics['input_file'] = input_func_data
+        metrics['cuttrs'] = cuttrs
+        metrics['encoding'] = {
+            'encoder': encoder,
+            'encode_s': sum([x[1] for x in encoded_files]),
+            'bytes': sum([x[2] for x in encoded_files]),
+            'files': dict([(os.path.basename(x[0]), {'encode_s': x[1], 'bytes': x[2]}) for x in encoded_files]),
+            }
+        mqmetrics.write_metrics(metrics, metrics_file)
+    if encoded_files:
+        print('Encoded {} files with the {} encoder: {:.2f} s, {:.2f} MB'.format(
+            len(encoded_files), encoder, metrics['encoding']['encode_s'], metrics['encoding']['bytes']/(1024.0*1024.0)))
+    print('Median tSNR in brain mask: {}, mean DVARS: {}, slice spikes: {}'.format(
+        mqmetrics.format_value(metrics['median_tsnr']), mqmetrics.format_value(metrics['mean_dvars']), metrics['num_spikes']))
+    if image_writer is not None:
+        with profiler.stage('wait for saved images'):
+            for saved_file in image_writer.wait():
+                print('Saved image: {}'.format(saved_file))
+    mqcache.write_manifest(output_dir, cache_key, key_dict, gif_files + sheet_files + [output_html, metrics_file] + saved_files,
+                           output_params=output_params)
     print('-------------------------------------------------')
     print('Output html file: {}'.format(output_html))
     print('-------------------------------------------------')
+    if profile:
+        profiler.write_report(os.path.join(output_dir, 'mriquickgifs_{}_profile.json'.format(input_prefix)))
+    _report_progress(progress, 'done', 1.0)
+    return output_html
 
 if __name__ == "__main__":
     
@@ -357,8 +925,29 @@ if __name__ == "__main__":
         description='''Generate quick visualization of input image and some basic statistical volumes. ''',
         usage='python3 -m mri_quickgifs raw_input_file [output_dir]')
     parser.add_argument('--cuttrs', help='set number of trs to exclude (i.e. pre-steady-state trs)', default=0)
-    parser.add_argument('--saveimages', help='do not delete intermediate image files (this will drastically increase the size of the output)',
+    parser.add_argument('--saveimages', help='save the temporal mean, stdev and SNR images as float32 NIfTI files in intermediate_images/',
+                         action='store_const', const=1, default=0)
+    parser.add_argument('--saveimages-compression', help='gzip level (1-9) of the saved images; 0 writes uncompressed .nii files (default: {})'.format(mqsave.DEFAULT_COMPRESSION),
+                         type=int, choices=range(10), metavar='LEVEL', default=mqsave.DEFAULT_COMPRESSION)
+    parser.add_argument('--saveimages-series', help='with --saveimages, also save the detrended time series (as large as the input, in float32)',
+                         action='store_const', const=1, default=0)
+    parser.add_argument('--float32', help='accumulate the temporal statistics in float32 (less memory, slightly less precision)',
+                         action='store_const', const=1, default=0)
+    parser.add_argument('--max-memory', help='approximate memory budget in MB; sets how many volumes are read at a time', type=float, default=None)
+    parser.add_argument('--gzip-backend', help='library used to inflate .nii.gz inputs (default: fastest installed)',
+                         choices=['auto', 'isal', 'zlib-ng', 'stdlib'], default='auto')
+    parser.add_argument('--jobs', help='number of threads for the statistics and of gifs to render at once (0 uses every cpu)', type=int, default=1)
+    parser.add_argument('--detrend-order', help='order of the polynomial removed before the standard deviation (default: 1, linear)', type=int, default=1)
+    parser.add_argument('--force', help='ignore cached results and redo everything', action='store_const', const=1, default=0)
+    parser.add_argument('--cache-dir', help='(shared) directory for cached statistics (default: a "cache" directory in the output dir)', default=None)
+    parser.add_argument('--cache-max-mb', help='evict least recently used cache entries beyond this size in MB', type=float, default=None)
+    parser.add_argument('--cache-hash', help='identify the input by a hash of its contents instead of its size and modification time',
+                         action='store_const', const=1, default=0)
+    parser.add_argument('--profile', help='record the time and memory used by each stage and write a json report',
+                         action='store_const', const=1, default=0)
+    parser.add_argument('--preview', help='write a small preview report (decimated center slice gifs and contact sheets) instead of the full-resolution gifs',
                          action='store_const', const=1, default=0)
+    parser.add_argument('--encoder', help='animation format/encoder (default: gif)', choices=list(mqenc.ENCODERS.keys()), default=mqenc.DEFAULT_ENCODER)
     parser.add_argument('raw_input_file', help='path and filename of a 4D .nii or .nii.gz')
     parser.add_argument('output_dir', nargs='?', default=None, help='where things will get written. If not provided, uses current working dir')
     args = parser.parse_args()
@@ -375,5 +964,7 @@ if __name__ == "__main__":
     #Extract passed argument as output dir
     output_dir = args.output_dir
 
-    main(cuttrs, raw_input_file, save_int, output_dir)
+    main(cuttrs, raw_input_file, save_int, output_dir, float32=args.float32, max_memory=args.max_memory, gzip_backend=args.gzip_backend, jobs=args.jobs,
+         force=args.force, cache_dir=args.cache_dir, cache_max_mb=args.cache_max_mb, cache_hash=args.cache_hash, profile=args.profile, preview=args.preview, encoder=args.encoder, detrend_order=args.detrend_order,
+         save_compression=args.saveimages_compression, save_series=args.saveimages_series)
     # main(args)
\ No newline at end of file
@@ -0,0 +1,204 @@
+#!/usr/bin/python3
+
+##############################################################
+#Description: run mri_quickgifs on a whole cohort of 4D images at once,
+#             spreading the runs across a pool of worker processes, and
+#             write an index html file linking each run's summary page
+#
+#
+#Usage: python3 -m mri_quickgifs_batch [options] input [input ...]
+#
+#Inputs:
+#   input: any mix of
+#       - a glob pattern (quote it so the shell doesn't expand it), e.g. "/data/sub-*/func/*_bold.nii.gz"
+#       - a text file listing one image path per line
+#       - a directory; BIDS-like "func" directories are searched for *_bold.nii[.gz]
+#         files, falling back to every .nii/.nii.gz file below the directory
+#
+#Outputs:
+#   The usual mri_quickgifs outputs for each image, plus
+#   .../[index_dir]/mriquickgifs_cohort.html: HTML file linking every run's summary
+#
+#History: (10/2026) Batch mode split out of mri_quickgifs.py
+##################################################################
+
+import os, sys
+import io
+import glob
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import mri_quickgifs as mquick
+import mri_quickgifs_encoders as mqenc
+
+
+def _is_nifti(filename):
+    return filename.endswith('.nii') or filename.endswith('.nii.gz')
+
+
+def _find_dir_inputs(input_dir):
+    #Look for BIDS-like functional runs first, then any NIfTI file
+    bids_files = glob.glob(os.path.join(input_dir, '**', 'func', '*_bold.nii*'), recursive=True)
+    bids_files = [x for x in bids_files if _is_nifti(x)]
+    if bids_files:
+        return sorted(bids_files)
+    all_files = glob.glob(os.path.join(input_dir, '**', '*.nii*'), recursive=True)
+    return sorted([x for x in all_files if _is_nifti(x)])
+
+
+def collect_inputs(input_list):
+    #Expand the passed globs, list files and directories into a sorted,
+    #de-duplicated list of absolute image paths
+    found_files = []
+    for input_item in input_list:
+        if os.path.isdir(input_item):
+            found_files.extend(_find_dir_inputs(input_item))
+        elif os.path.isfile(input_item) and not _is_nifti(input_item):
+            with open(input_item, 'r') as fo:
+                found_files.extend([x.strip() for x in fo if x.strip() and not x.strip().startswith('#')])
+        else:
+            matches = glob.glob(input_item)
+            if not matches:
+                print('WARNING: nothing found for input: {}'.format(input_item))
+            found_files.extend(sorted(matches))
+
+    input_files = []
+    for found_file in found_files:
+        found_file = os.path.abspath(found_file)
+        if found_file not in input_files:
+            input_files.append(found_file)
+    return input_files
+
+
+def _check_output_clashes(input_files, output_dir):
+    #Every run writes to quickgifs_[prefix]; with a shared output directory
+    #two inputs with the same file name would overwrite each other.
+    if output_dir is None:
+        return
+    prefix_dict = {}
+    for input_file in input_files:
+        input_prefix = os.path.split(input_file)[-1].split('.nii')[0]
+        prefix_dict.setdefault(input_prefix, []).append(input_file)
+    clashes = [x for x in prefix_dict.values() if len(x) > 1]
+    if clashes:
+        for clash in clashes:
+            print('Inputs would share an output directory: {}'.format(', '.join(clash)))
+        raise RuntimeError('Input file names must be unique when an output directory is passed!')
+
+
+def _run_one(input_file, cuttrs, output_dir, options):
+    #Run mri_quickgifs.main() on one image inside a worker process. The
+    #run's messages are captured so parallel runs don't interleave.
+    run_log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(run_log):
+            output_html = mquick.main(cuttrs, input_file, 0, output_dir, **options)
+        return input_file, output_html, None
+    except Exception as ex:
+        run_log.write('{}: {}\n'.format(type(ex).__name__, ex))
+        return input_file, None, run_log.getvalue()
+
+
+def _write_cohort_html(results, index_file):
+    #Write an html file linking each run's summary page
+    index_dir = os.path.split(os.path.abspath(index_file))[0]
+    num_failed = len([x for x in results if x[1] is None])
+
+    line_list = [
+    '<HTML>',
+    '<HEAD>',
+    '<TITLE>mri_quickgifs Cohort Summary</TITLE>',
+    '</HEAD>',
+    '<BODY>',
+    '<H1>mri_quickgifs: {} runs ({} failed)</H1>'.format(len(results), num_failed),
+    '<OL>',
+    ]
+    for input_file, output_html, error_text in results:
+        if output_html is not None:
+            link = os.path.relpath(output_html, index_dir).replace(os.sep, '/')
+            line_list.append('<LI><A HREF="{}">{}</A></LI>'.format(link, input_file))
+        else:
+            last_line = error_text.strip().split('\n')[-1]
+            line_list.append('<LI>{} -- FAILED: {}</LI>'.format(input_file, last_line))
+    line_list.extend(['</OL>', '</BODY>', '</HTML>'])
+
+    with open(index_file, 'w') as fo:
+        for line in line_list:
+            fo.write('{}\n'.format(line))
+    return index_file
+
+
+def run_batch(input_files, cuttrs=0, output_dir=None, workers=None, index_file=None, **options):
+    #Run mri_quickgifs on every input file using a pool of worker processes.
+    #Extra keyword options (float32, max_memory, ...) are passed to main().
+    #Returns a list of (input_file, output_html, error_text) in input order.
+    if not input_files:
+        raise RuntimeError('No input images to process!')
+    if output_dir is not None:
+        output_dir = os.path.abspath(output_dir)
+    _check_output_clashes(input_files, output_dir)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(int(workers), len(input_files)))
+
+    print('Running mri_quickgifs on {} images with {} workers...'.format(len(input_files), workers))
+    result_dict = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_run_one, x, cuttrs, output_dir, options) for x in input_files]
+        for future in as_completed(futures):
+            input_file, output_html, error_text = future.result()
+            result_dict[input_file] = (input_file, output_html, error_text)
+            if output_html is not None:
+                print('[{}/{}] Finished: {}'.format(len(result_dict), len(input_files), input_file))
+            else:
+                print('[{}/{}] FAILED: {}'.format(len(result_dict), len(input_files), input_file))
+                print(error_text)
+    results = [result_dict[x] for x in input_files]
+
+    if index_file is None:
+        if output_dir is not None:
+            index_dir = output_dir
+        else:
+            index_dir = os.getcwd()
+        index_file = os.path.join(index_dir, 'mriquickgifs_cohort.html')
+    _write_cohort_html(results, index_file)
+    print('-------------------------------------------------')
+    print('Cohort html file: {}'.format(index_file))
+    print('-------------------------------------------------')
+    return results
+
+
+if __name__ == "__main__":
+
+    #Set up argument parser and help dialogue
+    parser=argparse.ArgumentParser(
+        description='''Run mri_quickgifs on many images in parallel and write a cohort index page. ''',
+        usage='python3 -m mri_quickgifs_batch [options] input [input ...]')
+    parser.add_argument('--cuttrs', help='set number of trs to exclude (i.e. pre-steady-state trs)', default=0)
+    parser.add_argument('--workers', help='number of images to process at once (default: number of cpus)', type=int, default=None)
+    parser.add_argument('--max-memory', help='approximate memory budget in MB for each worker', type=float, default=None)
+    parser.add_argument('--float32', help='accumulate the temporal statistics in float32 (less memory, slightly less precision)',
+                         action='store_const', const=1, default=0)
+    parser.add_argument('--gzip-backend', help='library used to inflate .nii.gz inputs (default: fastest installed)',
+                         choices=['auto', 'isal', 'zlib-ng', 'stdlib'], default='auto')
+    parser.add_argument('--force', help='ignore cached results and redo everything', action='store_const', const=1, default=0)
+    parser.add_argument('--cache-dir', help='shared directory for cached statistics (default: a "cache" directory in each output dir)', default=None)
+    parser.add_argument('--cache-max-mb', help='evict least recently used cache entries beyond this size in MB', type=float, default=None)
+    parser.add_argument('--detrend-order', help='order of the polynomial removed before the standard deviation (default: 1, linear)', type=int, default=1)
+    parser.add_argument('--preview', help='write small preview reports instead of the full-resolution gifs',
+                        action='store_const', const=1, default=0)
+    parser.add_argument('--encoder', help='animation format/encoder (default: gif)', choices=list(mqenc.ENCODERS.keys()),
+                        default=mqenc.DEFAULT_ENCODER)
+    parser.add_argument('--output-dir', help='where things will get written. If not provided, each image\'s own directory is used', default=None)
+    parser.add_argument('--index', help='path of the cohort html file (default: mriquickgifs_cohort.html in the output dir or current dir)', default=None)
+    parser.add_argument('inputs', nargs='+', help='glob patterns, text files listing images, and/or directories to search')
+    args = parser.parse_args()
+
+    input_files = collect_inputs(args.inputs)
+    results = run_batch(input_files, cuttrs=int(args.cuttrs), output_dir=args.output_dir, workers=args.workers,
+                        index_file=args.index, float32=args.float32, max_memory=args.max_memory,
+                        gzip_backend=args.gzip_backend, force=args.force, cache_dir=args.cache_dir,
+                        cache_max_mb=args.cache_max_mb, preview=args.preview,
+                        encoder=args.encoder, detrend_order=args.detrend_order)
+    if [x for x in results if x[1] is None]:
+        sys.exit(1)
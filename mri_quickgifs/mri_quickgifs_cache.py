@@ -0,0 +1,162 @@
+##############################################################
+#Description: output cache for mri_quickgifs. A run is identified by a
+#             key built from the input file (size and mtime, or a content
+#             hash), the parameters that change the results, and the tool
+#             version. The key is stored in a manifest in the
+#             quickgifs_[prefix] directory, and the computed arrays (mean,
+#             stdev, tSNR and center slice images) are saved as .npy files
+#             in a cache directory so missing gifs can be regenerated
+#             without reading the 4D input again.
+#
+#History: (10/2026) Added output caching for mri_quickgifs
+##################################################################
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+
+
+MANIFEST_NAME = 'quickgifs_manifest.json'
+
+
+def _hash_file(input_file, block_size=1024*1024):
+    #Hash the full contents of a file
+    file_hash = hashlib.blake2b(digest_size=20)
+    with open(input_file, 'rb') as fo:
+        for block in iter(lambda: fo.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def make_cache_key(input_file, params, tool_version, hash_input=False):
+    #Build the key identifying a run's results. By default the input is
+    #identified by its path, size and modification time; with hash_input
+    #its contents are hashed instead (so copies of a file share a key).
+    file_stat = os.stat(input_file)
+    key_dict = {'tool_version': tool_version, 'params': params, 'size': file_stat.st_size}
+    if hash_input:
+        key_dict['content_hash'] = _hash_file(input_file)
+    else:
+        key_dict['path'] = os.path.abspath(input_file)
+        key_dict['mtime_ns'] = file_stat.st_mtime_ns
+    key_text = json.dumps(key_dict, sort_keys=True)
+    return hashlib.sha1(key_text.encode('utf-8')).hexdigest(), key_dict
+
+
+def read_manifest(output_dir):
+    #Return the manifest dict of a quickgifs output directory (or None)
+    manifest_file = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_file):
+        return None
+    try:
+        with open(manifest_file, 'r') as fo:
+            return json.load(fo)
+    except ValueError:
+        print('WARNING: ignoring unreadable cache manifest: {}'.format(manifest_file))
+        return None
+
+
+def write_manifest(output_dir, cache_key, key_dict, output_files, output_params=None):
+    #Record the key of a finished run, the settings that only change how
+    #its outputs are written (e.g. the encoder) and the files it produced
+    manifest = {
+        'cache_key': cache_key,
+        'key': key_dict,
+        'output_params': output_params,
+        'outputs': [os.path.relpath(x, output_dir) for x in output_files],
+        'written': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+    manifest_file = os.path.join(output_dir, MANIFEST_NAME)
+    temp_file = '{}.{}.tmp'.format(manifest_file, os.getpid())
+    with open(temp_file, 'w') as fo:
+        json.dump(manifest, fo, indent=2)
+    os.replace(temp_file, manifest_file)
+    return manifest_file
+
+
+def outputs_current(output_dir, cache_key, output_files, output_params=None):
+    #True if the last run in output_dir had the same key and output
+    #settings and every expected output file is still there
+    manifest = read_manifest(output_dir)
+    if manifest is None or manifest.get('cache_key') != cache_key:
+        return False
+    if manifest.get('output_params') != output_params:
+        return False
+    return all([os.path.exists(x) for x in output_files])
+
+
+def load_arrays(cache_root, cache_key, array_names):
+    #Load the cached arrays for a key, or return None if any are missing.
+    #A hit marks the entry as recently used (for eviction).
+    entry_dir = os.path.join(cache_root, cache_key)
+    array_files = [os.path.join(entry_dir, '{}.npy'.format(x)) for x in array_names]
+    if not all([os.path.exists(x) for x in array_files]):
+        return None
+    try:
+        arrays = dict([(x, np.load(y)) for x, y in zip(array_names, array_files)])
+    except (OSError, ValueError):
+        print('WARNING: ignoring unreadable cache entry: {}'.format(entry_dir))
+        return None
+    os.utime(entry_dir)
+    return arrays
+
+
+def save_arrays(cache_root, cache_key, arrays):
+    #Save a dict of arrays as a cache entry. The entry is written to a
+    #temporary directory and renamed into place so concurrent runs never
+    #see a partial entry.
+    if not os.path.exists(cache_root):
+        os.makedirs(cache_root, exist_ok=True)
+    entry_dir = os.path.join(cache_root, cache_key)
+    temp_dir = '{}.{}.tmp'.format(entry_dir, os.getpid())
+    os.makedirs(temp_dir, exist_ok=True)
+    for array_name, array_data in arrays.items():
+        np.save(os.path.join(temp_dir, '{}.npy'.format(array_name)), array_data)
+    if os.path.exists(entry_dir):
+        shutil.rmtree(entry_dir, ignore_errors=True)
+    try:
+        os.replace(temp_dir, entry_dir)
+    except OSError:
+        #Another run wrote the same entry first
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return entry_dir
+
+
+def _dir_size(dir_name):
+    total_size = 0
+    for root, dirs, files in os.walk(dir_name):
+        for file_name in files:
+            try:
+                total_size += os.path.getsize(os.path.join(root, file_name))
+            except OSError:
+                pass
+    return total_size
+
+
+def evict(cache_root, max_mb, keep_key=None):
+    #Remove the least recently used entries until the cache directory is
+    #no larger than max_mb. The entry for keep_key is never removed.
+    if max_mb is None or not os.path.exists(cache_root):
+        return []
+    entries = []
+    for entry_name in os.listdir(cache_root):
+        entry_dir = os.path.join(cache_root, entry_name)
+        if os.path.isdir(entry_dir) and not entry_name.endswith('.tmp'):
+            entries.append((os.path.getmtime(entry_dir), entry_name, _dir_size(entry_dir)))
+    total_size = sum([x[2] for x in entries])
+    max_size = float(max_mb)*1024*1024
+    evicted = []
+    for entry_time, entry_name, entry_size in sorted(entries):
+        if total_size <= max_size:
+            break
+        if entry_name == keep_key:
+            continue
+        shutil.rmtree(os.path.join(cache_root, entry_name), ignore_errors=True)
+        total_size -= entry_size
+        evicted.append(entry_name)
+    if evicted:
+        print('Evicted {} old entries from cache: {}'.format(len(evicted), cache_root))
+    return evicted
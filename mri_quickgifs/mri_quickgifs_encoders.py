@@ -0,0 +1,145 @@
+##############################################################
+#Description: animation encoders for mri_quickgifs. Every encoder takes
+#             the same stack of grayscale frames from _build_frames and
+#             writes one animation file, so the output format can be
+#             chosen per run (--encoder) and compared on encode time and
+#             file size:
+#               gif:           imageio.mimsave (the original writer)
+#               gif-optimized: Pillow, one global palette holding only the
+#                              gray levels used (in order); later frames are
+#                              cropped to the region that changed from the
+#                              previous frame (lossless)
+#               webp:          lossless animated WebP (Pillow built with libwebp)
+#               apng:          animated PNG (lossless)
+#               mp4:           H.264 video through the ffmpeg binary bundled
+#                              with imageio-ffmpeg (lossy; pip install imageio-ffmpeg)
+#
+#History: (10/2026) Added pluggable encoders
+##################################################################
+
+import os
+import time
+import numpy as np
+#imageio and Pillow are imported by the encoders that use them
+
+
+DEFAULT_ENCODER = 'gif'
+
+
+def _pil_frames(frames):
+    #Pillow grayscale ("L") images of the luminance channel of LA frames
+    from PIL import Image
+    return [Image.fromarray(np.ascontiguousarray(x[..., 0]), 'L') for x in frames]
+
+
+def _encode_gif(frames, output_file, duration):
+    import imageio
+    imageio.mimsave(output_file, list(frames), duration=duration)
+
+
+def _encode_gif_optimized(frames, output_file, duration):
+    #All frames share one global palette of the gray levels that are
+    #actually used, kept in increasing order so neighbouring pixels keep
+    #similar indices, and cut to the smallest power of two (fewer LZW bits
+    #per pixel than a full 256-level palette). Passing the palette to
+    #Pillow stops it writing a local color table for every frame, and the
+    #padding entries are unused gray levels so that every entry is unique
+    #(Pillow remaps duplicate colors one frame at a time, which is slow).
+    #Pillow only stores the bounding box of the pixels that differ from the
+    #previous frame.
+    from PIL import Image
+    gray_frames = frames[..., 0]
+    levels = np.flatnonzero(np.bincount(gray_frames.ravel(), minlength=256))
+    level_index = np.zeros(256, dtype=np.uint8)
+    level_index[levels] = np.arange(len(levels))
+    palette_size = 1 << max(1, int(np.ceil(np.log2(len(levels)))))
+    palette_levels = np.concatenate([levels, np.setdiff1d(np.arange(256), levels)])[:palette_size]
+    palette = np.repeat(palette_levels[:, None], 3, axis=1).astype(np.uint8).tobytes()
+    pil_frames = []
+    for gray_frame in gray_frames:
+        pil_frame = Image.fromarray(np.ascontiguousarray(level_index[gray_frame]), 'P')
+        pil_frame.putpalette(palette)
+        pil_frames.append(pil_frame)
+    pil_frames[0].save(output_file, save_all=True, append_images=pil_frames[1:], palette=palette,
+                       duration=int(round(duration*1000)), loop=0, optimize=False)
+
+
+def _encode_webp(frames, output_file, duration):
+    pil_frames = _pil_frames(frames)
+    pil_frames[0].save(output_file, save_all=True, append_images=pil_frames[1:],
+                       duration=int(round(duration*1000)), loop=0, lossless=True, method=0)
+
+
+def _encode_apng(frames, output_file, duration):
+    pil_frames = _pil_frames(frames)
+    pil_frames[0].save(output_file, save_all=True, append_images=pil_frames[1:],
+                       duration=int(round(duration*1000)), loop=0)
+
+
+def _encode_mp4(frames, output_file, duration):
+    #H.264 (yuv420p) needs even frame sizes, so frames are padded by a
+    #row/column of black if needed
+    gray_frames = frames[..., 0]
+    pad_rows = gray_frames.shape[1] % 2
+    pad_cols = gray_frames.shape[2] % 2
+    if pad_rows or pad_cols:
+        gray_frames = np.pad(gray_frames, ((0, 0), (0, pad_rows), (0, pad_cols)))
+    import imageio
+    with imageio.get_writer(output_file, format='FFMPEG', mode='I', fps=1.0/duration, codec='libx264',
+                            pixelformat='yuv420p', macro_block_size=2, quality=8) as writer:
+        for gray_frame in gray_frames:
+            writer.append_data(gray_frame)
+
+
+#Encoder name: (file extension, encoding function)
+ENCODERS = {
+    'gif': ('.gif', _encode_gif),
+    'gif-optimized': ('.gif', _encode_gif_optimized),
+    'webp': ('.webp', _encode_webp),
+    'apng': ('.png', _encode_apng),
+    'mp4': ('.mp4', _encode_mp4),
+    }
+
+
+def check_encoder(encoder):
+    #Raise a RuntimeError if an encoder is unknown or its optional
+    #dependencies are missing
+    if encoder not in ENCODERS:
+        raise RuntimeError('Unknown encoder: {} (choose from {})'.format(encoder, ', '.join(ENCODERS.keys())))
+    if encoder == 'webp':
+        from PIL import features
+        if not features.check('webp'):
+            raise RuntimeError('The webp encoder needs Pillow built with WebP support!')
+    if encoder == 'mp4':
+        try:
+            import imageio_ffmpeg
+        except ImportError:
+            raise RuntimeError('The mp4 encoder needs imageio-ffmpeg to be installed (pip install imageio-ffmpeg)!')
+
+
+def available_encoders():
+    #Names of the encoders that can be used in this environment
+    encoder_names = []
+    for encoder in ENCODERS:
+        try:
+            check_encoder(encoder)
+        except RuntimeError:
+            continue
+        encoder_names.append(encoder)
+    return encoder_names
+
+
+def extension(encoder):
+    return ENCODERS[encoder][0]
+
+
+def encode_frames(frames, output_base, duration=0.1, encoder=DEFAULT_ENCODER):
+    #Write a (frames, rows, columns, 2) LA uint8 stack to output_base plus
+    #the encoder's extension. Returns the file name, the time spent
+    #encoding and the size of the file in bytes.
+    file_extension, encode_function = ENCODERS[encoder]
+    output_file = output_base + file_extension
+    start_time = time.perf_counter()
+    encode_function(frames, output_file, duration)
+    encode_time = time.perf_counter() - start_time
+    return output_file, encode_time, os.path.getsize(output_file)
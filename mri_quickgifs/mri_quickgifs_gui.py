@@ -1,24 +1,67 @@
-
-
 import os
+import queue
+import threading
+import collections
 import tkinter as tk
 from tkinter import filedialog as fd
 import mri_quickgifs as mquick
 
 
+#How often (ms) the window checks for progress from the running jobs
+POLL_MS = 200
+
+
+class _JobCancelled(Exception):
+    pass
+
+
+class _GuiJob():
+    #One queued run of mri_quickgifs and its current state
+    def __init__(self, job_num, raw_input_file, cuttrs, save_int, output_dir):
+        self.job_num = job_num
+        self.raw_input_file = raw_input_file
+        self.cuttrs = cuttrs
+        self.save_int = save_int
+        self.output_dir = output_dir
+        self.cancel_event = threading.Event()
+        self.thread = None
+        self.status = 'queued'
+        self.stage = ''
+        self.fraction = 0.0
+
+    def describe(self):
+        #Line shown for the job in the job list
+        if self.status == 'running':
+            state_text = '{} {:3.0f}%'.format(self.stage, 100*self.fraction)
+        else:
+            state_text = self.status
+        return '{:>3}. {:<28} {}'.format(self.job_num, state_text, os.path.basename(self.raw_input_file))
+
+
 class quickgifs_gui():
     def __init__(self):
         self.window = tk.Tk()
         self.window.title('MRI Quickgifs')
 
+        #Jobs wait in the GUI's own queue and are started on background
+        #threads, at most "Parallel Runs" at a time (re-read whenever a job
+        #is started, so it can be changed while jobs are queued). They
+        #report progress through a thread-safe queue that the window polls
+        #with after(), so Tk is only ever touched from the main thread.
+        self.jobs = []
+        self.pending = collections.deque()
+        self.num_running = 0
+        self.max_running = 1
+        self.events = queue.Queue()
+
         self.frame_files = tk.Frame()
         #Create frame of input file information
-        self.input_file_lbl = tk.Label(self.frame_files, text='Input Image File:')
+        self.input_file_lbl = tk.Label(self.frame_files, text='Input Image File(s):')
         self.inputfile_var = tk.StringVar(self.window)
         self.input_file_entry = tk.Entry(self.frame_files, textvariable=self.inputfile_var)
         self.input_file_btn = tk.Button(self.frame_files, text='Open', command=self.gui_open_input)
 
-       	self.out_dir_lbl = tk.Label(self.frame_files, text='Output Dir.:')
+        self.out_dir_lbl = tk.Label(self.frame_files, text='Output Dir.:')
         self.outdir_var = tk.StringVar(self.window)
         self.out_dir_entry = tk.Entry(self.frame_files, textvariable=self.outdir_var)
         self.out_dir_btn = tk.Button(self.frame_files, text='Select', command=self.gui_select_outdir)
@@ -39,33 +82,51 @@ class quickgifs_gui():
         self.save_var = tk.IntVar()
         self.save_var.set(0)
         self.save_cbtn = tk.Checkbutton(self.frame_options, text='Save Intermedates', variable=self.save_var, onvalue=1, offvalue=0)
+        self.workers_lbl = tk.Label(self.frame_options, text='Parallel Runs:')
+        self.workers_var = tk.StringVar(self.window)
+        self.workers_var.set('1')
+        self.workers_entry = tk.Entry(self.frame_options, textvariable=self.workers_var)
 
         self.dummytr_lbl.grid(row=0, column=0, sticky='w')
         self.dummytr_entry.grid(row=0, column=1, sticky='w')
         # self.save_cbtn.grid(row=1, column=0, sticky='w')
+        self.workers_lbl.grid(row=2, column=0, sticky='w')
+        self.workers_entry.grid(row=2, column=1, sticky='w')
+
+        #Create frame for the job queue
+        self.frame_jobs = tk.Frame()
+        self.jobs_lbl = tk.Label(self.frame_jobs, text='Jobs:')
+        self.jobs_list = tk.Listbox(self.frame_jobs, width=80, height=8, selectmode=tk.EXTENDED, font='TkFixedFont')
+        self.jobs_lbl.grid(row=0, column=0, sticky='w')
+        self.jobs_list.grid(row=1, column=0, sticky='we')
 
         #Create frame for response buttons
         self.frame_responses = tk.Frame()
         self.go_btn = tk.Button(self.frame_responses, text='Go', command=self.gui_run_btn)
+        self.cancel_btn = tk.Button(self.frame_responses, text='Cancel Selected', command=self.gui_cancel_btn)
         self.quit_btn = tk.Button(self.frame_responses, text='Quit', command=self.gui_quit_btn)
         self.go_btn.grid(row=0, column=0, sticky='w')
-        self.quit_btn.grid(row=0, column=1, sticky='w')
+        self.cancel_btn.grid(row=0, column=1, sticky='w')
+        self.quit_btn.grid(row=0, column=2, sticky='w')
 
         #Put all the frames into the GUI window
         self.frame_files.pack(fill=tk.X, expand=True)
         self.frame_options.pack(fill=tk.X, expand=True)
+        self.frame_jobs.pack(fill=tk.X, expand=True)
         self.frame_responses.pack(fill=tk.X, expand=True)
+        self.window.protocol('WM_DELETE_WINDOW', self.gui_quit_btn)
 
 
     def run_loop(self):
+        self.window.after(POLL_MS, self.poll_jobs)
         self.window.mainloop()
 
 
     def gui_open_input(self):
-    	print('Opening file selection dialogue...')
-    	#Open file-selection dialogue to get a file path and name
-    	input_filename = fd.askopenfilename(parent=self.window)
-    	self.inputfile_var.set(input_filename)
+        print('Opening file selection dialogue...')
+        #Open file-selection dialogue to get one or more file paths and names
+        input_filenames = fd.askopenfilenames(parent=self.window)
+        self.inputfile_var.set(';'.join(input_filenames))
 
     def gui_select_outdir(self):
         print('Opening directory selection dialogue...')
@@ -73,24 +134,119 @@ class quickgifs_gui():
         self.outdir_var.set(output_dir)
 
     def gui_quit_btn(self):
-        #Close the GUI
+        #Stop any running jobs (at their next progress report), drop the
+        #queued ones and close the GUI
+        for job in self.jobs:
+            job.cancel_event.set()
+        self.pending.clear()
         self.window.destroy()
 
 
+    def _run_job(self, job):
+        #Runs on a worker thread: everything goes back to the window
+        #through the event queue
+        def progress(stage, fraction):
+            if job.cancel_event.is_set():
+                raise _JobCancelled()
+            self.events.put((job, 'running', stage, fraction))
+
+        if job.cancel_event.is_set():
+            self.events.put((job, 'cancelled', '', 0.0))
+            return
+        try:
+            mquick.main(job.cuttrs, job.raw_input_file, job.save_int, job.output_dir, progress=progress)
+        except _JobCancelled:
+            self.events.put((job, 'cancelled', '', 0.0))
+        except Exception as ex:
+            print(ex)
+            self.events.put((job, 'failed: {}'.format(ex), '', 0.0))
+        else:
+            self.events.put((job, 'done', '', 1.0))
+
+
     def gui_run_btn(self):
-        #Pull variables from the GUI
+        #Pull variables from the GUI and queue one job per input file
         try:
-            raw_input_file = str(self.inputfile_var.get())
+            raw_input_files = [x.strip() for x in str(self.inputfile_var.get()).split(';') if x.strip()]
             cuttrs = int(self.dummytr_var.get())
             save_int = int(self.save_var.get())
             output_dir = str(self.outdir_var.get())
-
-            #Pass the input arguments to mri_quickgifs main()
-            mquick.main(cuttrs, raw_input_file, save_int, output_dir)
         except Exception as ex:
             print(ex)
+            return
+
+        for raw_input_file in raw_input_files:
+            job = _GuiJob(len(self.jobs)+1, raw_input_file, cuttrs, save_int, output_dir)
+            self.jobs.append(job)
+            self.jobs_list.insert(tk.END, job.describe())
+            self.pending.append(job)
+        self._start_jobs()
+
+
+    def _parallel_runs(self):
+        #Current "Parallel Runs" value (the last valid one while the entry
+        #holds something that isn't a number)
+        try:
+            self.max_running = max(1, int(self.workers_var.get()))
+        except ValueError:
+            pass
+        return self.max_running
+
+
+    def _start_jobs(self):
+        #Start queued jobs while fewer than "Parallel Runs" are running
+        while self.pending and self.num_running < self._parallel_runs():
+            job = self.pending.popleft()
+            self.num_running += 1
+            job.thread = threading.Thread(target=self._run_job, args=(job,), name='quickgifs job {}'.format(job.job_num))
+            job.thread.start()
+
+
+    def gui_cancel_btn(self):
+        #Cancel the selected jobs: queued jobs are dropped, running jobs
+        #stop at their next progress report
+        for list_index in self.jobs_list.curselection():
+            job = self.jobs[list_index]
+            if job.status not in ['queued', 'running']:
+                continue
+            job.cancel_event.set()
+            if job in self.pending:
+                self.pending.remove(job)
+                job.status = 'cancelled'
+            else:
+                job.status = 'cancelling'
+            self._show_job(job)
+
+
+    def _show_job(self, job):
+        list_index = job.job_num - 1
+        self.jobs_list.delete(list_index)
+        self.jobs_list.insert(list_index, job.describe())
+
+
+    def poll_jobs(self):
+        #Apply the progress reported by the workers since the last poll
+        changed_jobs = set()
+        while True:
+            try:
+                job, status, stage, fraction = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if status != 'running':
+                #The job's thread has finished
+                self.num_running -= 1
+            elif job.status == 'cancelling':
+                continue
+            job.status = status
+            job.stage = stage
+            job.fraction = fraction
+            changed_jobs.add(job)
+        for job in changed_jobs:
+            self._show_job(job)
+        self._start_jobs()
+        self.window.after(POLL_MS, self.poll_jobs)
 
 
 if __name__ == '__main__':
     obj = quickgifs_gui()
-    obj.run_loop()
\ No newline at end of file
+    obj.run_loop()
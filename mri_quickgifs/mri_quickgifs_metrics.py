@@ -0,0 +1,263 @@
+#!/usr/bin/python3
+
+##############################################################
+#Description: quantitative QC metrics for mri_quickgifs. The per-volume
+#             series (global signal, DVARS and slice means) are gathered
+#             during mri_quickgifs' single pass over the data, and the
+#             summary values reuse the mean, stdev and tSNR images it
+#             already computes. Run as a script, this module gathers the
+#             metrics files of many runs into one table and flags outliers.
+#
+#
+#Usage: python3 -m mri_quickgifs_metrics [--threshold FLOAT] output_csv input [input ...]
+#
+#Inputs:
+#   input: mriquickgifs_*_metrics.json files, glob patterns or directories to search
+#   output_csv: table with one row per run
+#
+#History: (10/2026) Added QC metrics output for mri_quickgifs
+##################################################################
+
+import os, sys
+import csv
+import glob
+import json
+import argparse
+import numpy as np
+
+
+#|robust z| above which a slice mean counts as a spike
+SPIKE_THRESHOLD = 5.0
+
+#Summary values compared across a cohort, and which direction is bad
+#(1: high values are bad, -1: low values are bad, 0: either)
+COHORT_METRICS = [
+    ('median_tsnr', -1),
+    ('mean_dvars', 1),
+    ('max_dvars', 1),
+    ('global_signal_cv', 1),
+    ('num_spikes', 1),
+    ('mask_voxels', 0),
+    ]
+
+
+def brain_mask(mean_image):
+    #Rough intensity mask: voxels brighter than a quarter of the 98th
+    #percentile of the non-zero voxels
+    positive_values = mean_image[mean_image>0]
+    if positive_values.size == 0:
+        return np.zeros(mean_image.shape, dtype=bool)
+    return mean_image > 0.25*np.percentile(positive_values, 98)
+
+
+def _robust_z(values, axis=-1):
+    #(value - median)/(1.4826*MAD) along an axis, 0 where the MAD is 0
+    median_values = np.median(values, axis=axis, keepdims=True)
+    mad_values = 1.4826*np.median(np.abs(values - median_values), axis=axis, keepdims=True)
+    robust_z = np.zeros(values.shape, dtype=np.float64)
+    np.divide(values - median_values, mad_values, out=robust_z, where=mad_values!=0)
+    return robust_z
+
+
+class VolumeMetrics():
+    #Gather per-volume series from the same chunks of volumes that the
+    #temporal statistics see: the global signal, DVARS (RMS change from
+    #the previous volume) and the mean of every axial slice. All are taken
+    #within a mask made from the first volume. Each chunk is copied once
+    #to float32; the slice sums are one reduction over it, and it is then
+    #differenced in place for DVARS.
+    def __init__(self, vol_shape):
+        self.vol_shape = vol_shape
+        self.mask = None
+        self.prev_volume = None
+        self.global_signal = []
+        self.dvars = []
+        self.slice_means = []
+
+    def _mask_sums(self, chunk_data):
+        #(slices, volumes) sums over the mask voxels of each slice
+        return np.einsum('pzt,zp->zt', chunk_data, self.slice_weights).astype(np.float64)
+
+    def update(self, chunk):
+        if chunk.ndim == 3:
+            chunk = chunk[..., np.newaxis]
+        if self.mask is None:
+            self.mask = brain_mask(np.asarray(chunk[..., 0], dtype=np.float64))
+            #Row z picks out the mask voxels of slice z
+            self.slice_weights = np.ascontiguousarray(self.mask.reshape(-1, self.vol_shape[2], order='F').T, dtype=np.float32)
+            self.slice_counts = self.mask.sum(axis=(0, 1))
+            self.mask_count = max(1, int(self.slice_counts.sum()))
+        num_vols = chunk.shape[3]
+        #(x*y, slices, volumes)
+        chunk_data = np.array(chunk, dtype=np.float32, order='F').reshape(-1, self.vol_shape[2], num_vols, order='F')
+
+        slice_sums = self._mask_sums(chunk_data)
+        self.global_signal.append(slice_sums.sum(axis=0)/self.mask_count)
+        slice_means = np.zeros(slice_sums.shape)
+        np.divide(slice_sums, self.slice_counts[:, np.newaxis], out=slice_means, where=self.slice_counts[:, np.newaxis]!=0)
+        self.slice_means.append(slice_means)
+
+        #Difference each volume from the one before it, last first so the
+        #chunk can be overwritten
+        last_volume = chunk_data[..., -1].copy()
+        for vol_num in range(num_vols-1, 0, -1):
+            chunk_data[..., vol_num] -= chunk_data[..., vol_num-1]
+        if self.prev_volume is None:
+            chunk_data[..., 0] = 0
+        else:
+            chunk_data[..., 0] -= self.prev_volume
+        np.multiply(chunk_data, chunk_data, out=chunk_data)
+        dvars = np.sqrt(self._mask_sums(chunk_data).sum(axis=0)/self.mask_count)
+        if self.prev_volume is None:
+            dvars[0] = np.nan
+        self.dvars.append(dvars)
+        self.prev_volume = last_volume
+
+    def series(self):
+        #Return the per-volume arrays gathered so far (these are what gets cached)
+        return {
+            'global_signal': np.concatenate(self.global_signal),
+            'dvars': np.concatenate(self.dvars),
+            'slice_means': np.concatenate(self.slice_means, axis=1),
+            }
+
+
+def _json_float(value):
+    #JSON has no NaN or infinity, so undefined values (e.g. with an empty
+    #brain mask or a single volume) are written as null
+    value = float(value)
+    if np.isfinite(value):
+        return value
+    return None
+
+
+def format_value(value, value_format='{:.2f}'):
+    #Text of a metric for printing, which may be None (undefined)
+    if value is None:
+        return 'n/a'
+    return value_format.format(value)
+
+
+def summarize(mean_image, stdev_image, tsnr_image, series, stage_times=None):
+    #Build the metrics dict of a run from its statistic images and
+    #per-volume series
+    mask = brain_mask(mean_image)
+    global_signal = series['global_signal']
+    dvars = series['dvars']
+    slice_means = series['slice_means']
+
+    #Spikes: slices whose mean is far from that slice's typical value
+    spike_list = []
+    if slice_means.shape[1] > 2:
+        slice_z = _robust_z(slice_means, axis=1)
+        for slice_num, vol_num in zip(*np.nonzero(np.abs(slice_z) > SPIKE_THRESHOLD)):
+            spike_list.append({'volume': int(vol_num), 'slice': int(slice_num), 'z': float(slice_z[slice_num, vol_num])})
+
+    mean_global = float(np.mean(global_signal))
+    metrics = {
+        'num_vols': int(len(global_signal)),
+        'mask_voxels': int(mask.sum()),
+        'median_tsnr': _json_float(np.median(tsnr_image[mask])) if mask.any() else None,
+        'mean_tsnr': _json_float(np.mean(tsnr_image[mask])) if mask.any() else None,
+        'median_stdev': _json_float(np.median(stdev_image[mask])) if mask.any() else None,
+        'mean_global_signal': _json_float(mean_global),
+        'global_signal_cv': _json_float(np.std(global_signal)/mean_global) if mean_global else None,
+        'mean_dvars': _json_float(np.nanmean(dvars)) if len(dvars) > 1 else None,
+        'max_dvars': _json_float(np.nanmax(dvars)) if len(dvars) > 1 else None,
+        'num_spikes': len(spike_list),
+        'spikes': spike_list,
+        'global_signal': [_json_float(x) for x in global_signal],
+        'dvars': [_json_float(x) for x in dvars],
+        }
+    if stage_times is not None:
+        metrics['stage_times'] = dict(stage_times)
+    return metrics
+
+
+def write_metrics(metrics, output_file):
+    #allow_nan=False: a NaN that wasn't mapped to None is an error rather
+    #than invalid JSON
+    with open(output_file, 'w') as fo:
+        json.dump(metrics, fo, indent=1, allow_nan=False)
+    return output_file
+
+
+def collect_metrics_files(input_list):
+    #Expand metrics files, glob patterns and directories into a list of
+    #metrics json files
+    metrics_files = []
+    for input_item in input_list:
+        if os.path.isdir(input_item):
+            found_files = sorted(glob.glob(os.path.join(input_item, '**', 'mriquickgifs_*_metrics.json'), recursive=True))
+        else:
+            found_files = sorted(glob.glob(input_item))
+        for found_file in found_files:
+            found_file = os.path.abspath(found_file)
+            if found_file not in metrics_files:
+                metrics_files.append(found_file)
+    return metrics_files
+
+
+def aggregate(metrics_files, output_csv, threshold=3.5):
+    #Gather the summary values of many runs into one table and flag the
+    #runs whose values are outliers (|robust z| > threshold, in the bad
+    #direction) relative to the cohort. Returns the table rows.
+    table_rows = []
+    for metrics_file in metrics_files:
+        with open(metrics_file, 'r') as fo:
+            metrics = json.load(fo)
+        table_row = {'metrics_file': metrics_file, 'input_file': metrics.get('input_file', ''), 'num_vols': metrics.get('num_vols')}
+        for metric_name, bad_direction in COHORT_METRICS:
+            table_row[metric_name] = metrics.get(metric_name, float('nan'))
+        table_rows.append(table_row)
+
+    for table_row in table_rows:
+        table_row['flags'] = []
+    if len(table_rows) > 2:
+        for metric_name, bad_direction in COHORT_METRICS:
+            values = np.array([np.nan if x[metric_name] is None else x[metric_name] for x in table_rows], dtype=np.float64)
+            valid = ~np.isnan(values)
+            if valid.sum() < 3:
+                continue
+            metric_z = np.zeros(values.shape)
+            metric_z[valid] = _robust_z(values[valid])
+            for table_row, z_value in zip(table_rows, metric_z):
+                if bad_direction == 0:
+                    is_outlier = abs(z_value) > threshold
+                else:
+                    is_outlier = bad_direction*z_value > threshold
+                if is_outlier:
+                    table_row['flags'].append(metric_name)
+
+    column_names = ['input_file', 'num_vols'] + [x[0] for x in COHORT_METRICS] + ['flags', 'metrics_file']
+    with open(output_csv, 'w', newline='') as fo:
+        table_writer = csv.DictWriter(fo, fieldnames=column_names)
+        table_writer.writeheader()
+        for table_row in table_rows:
+            csv_row = dict(table_row)
+            csv_row['flags'] = ';'.join(table_row['flags'])
+            table_writer.writerow(csv_row)
+    return table_rows
+
+
+if __name__ == "__main__":
+
+    #Set up argument parser and help dialogue
+    parser=argparse.ArgumentParser(
+        description='''Gather mri_quickgifs metrics from many runs into one table and flag outliers. ''',
+        usage='python3 -m mri_quickgifs_metrics [--threshold FLOAT] output_csv input [input ...]')
+    parser.add_argument('--threshold', help='robust z-score beyond which a run is flagged (default: 3.5)', type=float, default=3.5)
+    parser.add_argument('output_csv', help='table to write, one row per run')
+    parser.add_argument('inputs', nargs='+', help='metrics json files, glob patterns or directories to search')
+    args = parser.parse_args()
+
+    metrics_files = collect_metrics_files(args.inputs)
+    if not metrics_files:
+        print('No metrics files found!')
+        sys.exit(1)
+    table_rows = aggregate(metrics_files, args.output_csv, threshold=args.threshold)
+    flagged_rows = [x for x in table_rows if x['flags']]
+    print('{} runs, {} flagged'.format(len(table_rows), len(flagged_rows)))
+    for table_row in flagged_rows:
+        print('FLAGGED: {} ({})'.format(table_row['input_file'] or table_row['metrics_file'], ', '.join(table_row['flags'])))
+    print('Metrics table: {}'.format(args.output_csv))
@@ -0,0 +1,133 @@
+##############################################################
+#Description: lightweight per-stage profiling for mri_quickgifs and
+#             percsigchange (which imports this module from here). Wrap a
+#             stage in "with profiler.stage('name'):" to record its wall
+#             time, CPU time (including child processes such as fslmaths)
+#             and the peak memory (RSS) of the process at the end of the
+#             stage. Stages that run more than once are summed. A disabled
+#             profiler hands back the same do-nothing context manager
+#             every time, so profiling costs nothing unless --profile is
+#             passed.
+#
+#History: (10/2026) Added stage profiling
+##################################################################
+
+import os
+import json
+import time
+import threading
+import contextlib
+try:
+    import resource
+except ImportError:
+    #Not available on Windows; peak memory isn't reported there
+    resource = None
+
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+def _peak_rss_mb():
+    #Peak resident memory of this process so far, in MB
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    if os.uname().sysname == 'Darwin':
+        return peak_rss/(1024.0*1024.0)
+    return peak_rss/1024.0
+
+
+def _child_cpu_time():
+    #CPU time used by finished child processes (e.g. subprocess calls)
+    if resource is None:
+        return 0.0
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return child_usage.ru_utime + child_usage.ru_stime
+
+
+class _Stage():
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.thread_time()
+        self.start_child_cpu = _child_cpu_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stage_record = {
+            'stage': self.name,
+            'wall_s': time.perf_counter() - self.start_wall,
+            #CPU time of the thread that ran the stage, plus any child processes it waited on
+            'cpu_s': time.thread_time() - self.start_cpu + _child_cpu_time() - self.start_child_cpu,
+            'peak_rss_mb': _peak_rss_mb(),
+            'thread': threading.current_thread().name,
+            }
+        if exc_type is not None:
+            stage_record['error'] = exc_type.__name__
+        self.profiler._add(stage_record)
+        return False
+
+
+class StageProfiler():
+    def __init__(self, enabled=False):
+        self.enabled = bool(enabled)
+        self.stages = []
+        self._lock = threading.Lock()
+        self._start_wall = time.perf_counter()
+
+    def stage(self, name):
+        #Context manager timing one stage (a shared no-op when disabled)
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def _add(self, stage_record):
+        #Repeated stages (e.g. reading each chunk) are summed into one record
+        with self._lock:
+            for old_record in self.stages:
+                if old_record['stage'] == stage_record['stage']:
+                    old_record['wall_s'] += stage_record['wall_s']
+                    old_record['cpu_s'] += stage_record['cpu_s']
+                    old_record['calls'] += 1
+                    if stage_record['peak_rss_mb'] is not None:
+                        old_record['peak_rss_mb'] = max(old_record['peak_rss_mb'], stage_record['peak_rss_mb'])
+                    if 'error' in stage_record:
+                        old_record['error'] = stage_record['error']
+                    return
+            stage_record['calls'] = 1
+            self.stages.append(stage_record)
+
+    def report(self):
+        #All recorded stages plus the total wall time and overall peak memory
+        return {
+            'total_wall_s': time.perf_counter() - self._start_wall,
+            'peak_rss_mb': _peak_rss_mb(),
+            'stages': list(self.stages),
+            }
+
+    def write_report(self, output_file):
+        #Write the report as json and print a short summary
+        report = self.report()
+        with open(output_file, 'w') as fo:
+            json.dump(report, fo, indent=1)
+        print('-------------------------------------------------')
+        print('{:<40} {:>6} {:>9} {:>9} {:>13}'.format('Stage', 'Calls', 'Wall (s)', 'CPU (s)', 'Peak RSS (MB)'))
+        for stage_record in report['stages']:
+            if stage_record['peak_rss_mb'] is None:
+                peak_text = 'n/a'
+            else:
+                peak_text = '{:.1f}'.format(stage_record['peak_rss_mb'])
+            print('{:<40} {:>6} {:>9.3f} {:>9.3f} {:>13}'.format(stage_record['stage'][:40], stage_record['calls'],
+                                                          stage_record['wall_s'], stage_record['cpu_s'], peak_text))
+        print('Total wall time: {:.3f} s'.format(report['total_wall_s']))
+        print('Profile report: {}'.format(output_file))
+        print('-------------------------------------------------')
+        return output_file
+
+
+#Shared disabled profiler for callers that don't pass one
+NO_PROFILE = StageProfiler(enabled=False)
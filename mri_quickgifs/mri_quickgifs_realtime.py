@@ -0,0 +1,279 @@
+#!/usr/bin/python3
+
+##############################################################
+#Description: incremental ("real-time") version of mri_quickgifs for use
+#             while a run is still being acquired. New volumes are picked
+#             up as they arrive, the running temporal statistics are
+#             updated with O(1) work per volume, and the gifs and html
+#             file are refreshed every N volumes.
+#
+#
+#Usage: python3 -m mri_quickgifs_realtime [options] input [output_dir]
+#
+#Inputs:
+#   input: either a directory that per-volume NIfTI files (3D .nii/.nii.gz) are
+#          written into (processed in file name order), or a single uncompressed
+#          4D .nii file that volumes are being appended to
+#   [output_dir]: path where things will get written. If not provided, defaults to the directory of the input.
+#
+#Outputs:
+#   The same quickgifs_[prefix] directory, gifs and html file as mri_quickgifs.py,
+#   rewritten every --refresh volumes and once more when the run ends.
+#
+#History: (10/2026) Added incremental mode for mri_quickgifs
+##################################################################
+
+import os
+import time
+import argparse
+import numpy as np
+#nibabel is slow to import, so it is imported where images are read and
+#written; --help and argument errors don't load it
+import mri_quickgifs as mquick
+
+
+class _WelfordStats():
+    #Running temporal mean and variance (Welford's algorithm). Each new
+    #volume costs O(1) work per voxel and the statistics can be read at
+    #any point without revisiting earlier volumes.
+    def __init__(self, vol_shape, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self.num_vols = 0
+        self.mean = np.zeros(vol_shape, dtype=self.dtype)
+        self.sum_sq = np.zeros(vol_shape, dtype=self.dtype)
+
+    def update(self, volume):
+        self.num_vols += 1
+        delta = np.array(volume, dtype=self.dtype)
+        delta -= self.mean
+        self.mean += delta/self.num_vols
+        #delta*(x - new mean), reusing the delta array
+        delta *= volume - self.mean
+        self.sum_sq += delta
+
+    def finalize(self):
+        #Return the current temporal mean, stdev and tSNR images
+        if self.num_vols == 0:
+            raise RuntimeError('No volumes were passed to the temporal statistics!')
+        stdev_data = np.sqrt(self.sum_sq/self.num_vols)
+        tsnr_data = np.zeros(self.mean.shape, dtype=self.dtype)
+        tsnr_data = np.divide(self.mean, stdev_data, out=tsnr_data, where=stdev_data!=0)
+        return self.mean.copy(), stdev_data, tsnr_data
+
+
+class _VolumeDirSource():
+    #New volumes from a directory of per-volume NIfTI files
+    def __init__(self, input_dir):
+        self.input_dir = input_dir
+        self.done_files = set()
+
+    def new_volumes(self):
+        #Return the volumes of any new, complete files (in name order).
+        #Files that can't be read yet (still being written) are retried
+        #on the next call.
+        import nibabel as nib
+        volumes = []
+        file_names = sorted([x for x in os.listdir(self.input_dir) if x.endswith('.nii') or x.endswith('.nii.gz')])
+        for file_name in file_names:
+            if file_name in self.done_files:
+                continue
+            try:
+                volume = np.asanyarray(nib.load(os.path.join(self.input_dir, file_name)).dataobj)
+            except Exception:
+                break
+            if volume.ndim == 4:
+                volume = volume[..., 0]
+            volumes.append(volume)
+            self.done_files.add(file_name)
+        return volumes
+
+    def voxel_sizes(self):
+        import nibabel as nib
+        file_names = sorted([x for x in os.listdir(self.input_dir) if x.endswith('.nii') or x.endswith('.nii.gz')])
+        return nib.load(os.path.join(self.input_dir, file_names[0])).header.get_zooms()[:3]
+
+
+class _AppendedFileSource():
+    #New volumes appended to an uncompressed 4D .nii file. The number of
+    #complete volumes is worked out from the file size, since the header
+    #may not be updated until the end of the run.
+    def __init__(self, input_file):
+        import nibabel as nib
+        input_img = nib.load(input_file)
+        self.input_file = input_file
+        self.vol_shape = tuple(input_img.shape[:3])
+        self.header = input_img.header
+        self.data_dtype = input_img.dataobj.dtype
+        self.offset = int(input_img.dataobj.offset)
+        self.slope = input_img.dataobj.slope
+        self.inter = input_img.dataobj.inter
+        self.vol_bytes = int(np.prod(self.vol_shape))*self.data_dtype.itemsize
+        self.num_read = 0
+
+    def new_volumes(self):
+        num_complete = (os.path.getsize(self.input_file) - self.offset) // self.vol_bytes
+        volumes = []
+        if num_complete <= self.num_read:
+            return volumes
+        with open(self.input_file, 'rb') as fo:
+            fo.seek(self.offset + self.num_read*self.vol_bytes)
+            for vol_num in range(self.num_read, num_complete):
+                volume = np.frombuffer(fo.read(self.vol_bytes), dtype=self.data_dtype).reshape(self.vol_shape, order='F')
+                if self.slope != 1 or self.inter != 0:
+                    volume = volume*self.slope + self.inter
+                volumes.append(volume)
+        self.num_read = num_complete
+        return volumes
+
+    def voxel_sizes(self):
+        return self.header.get_zooms()[:3]
+
+
+class RealtimeQuickgifs():
+    #Keeps the running statistics and center slices of a growing series
+    #and (re)writes the quickgifs outputs on request.
+    def __init__(self, output_dir, input_prefix, vox_sizes, cuttrs=0, detrend=0, jobs=1):
+        self.output_dir = output_dir
+        self.input_prefix = input_prefix
+        self.vox_sizes = vox_sizes
+        self.cuttrs = cuttrs
+        self.detrend = detrend
+        self.jobs = jobs
+        self.picgifs_output_dir = os.path.join(output_dir, 'pictures_gifs')
+        if not os.path.exists(self.picgifs_output_dir):
+            os.makedirs(self.picgifs_output_dir)
+        self.num_seen = 0
+        self.stats = None
+        self.center_x_slices = []
+        self.center_y_slices = []
+        self.center_z_slices = []
+
+    def add_volume(self, volume):
+        #Add one 3D volume; the first cuttrs volumes are skipped
+        self.num_seen += 1
+        if self.num_seen <= self.cuttrs:
+            return
+        if self.stats is None:
+            if self.detrend:
+                self.stats = mquick._TemporalStats(volume.shape)
+            else:
+                self.stats = _WelfordStats(volume.shape)
+            self.center_x = round(volume.shape[0] / 2.0)
+            self.center_y = round(volume.shape[1] / 2.0)
+            self.center_z = round(volume.shape[2] / 2.0)
+        self.stats.update(volume)
+        self.center_x_slices.append(np.array(volume[self.center_x, :, :]))
+        self.center_y_slices.append(np.array(volume[:, self.center_y, :]))
+        self.center_z_slices.append(np.array(volume[:, :, self.center_z]))
+
+    def num_used(self):
+        if self.stats is None:
+            return 0
+        return self.stats.num_vols
+
+    def write_outputs(self):
+        #Render all the gifs and the html file from the current state
+        mean_data, stdev_data, tsnr_data = self.stats.finalize()
+        img_dims = mean_data.shape + (self.num_used(),)
+        vox_sizes = self.vox_sizes
+        scale_dict = {}
+        scale_dict['xy_scale'] = (vox_sizes[0]*img_dims[0])/(vox_sizes[1]*img_dims[1])
+        scale_dict['xz_scale']= (vox_sizes[0]*img_dims[1])/(vox_sizes[2]*img_dims[2])
+        scale_dict['yz_scale'] = (vox_sizes[1]*img_dims[1])/(vox_sizes[2]*img_dims[2])
+
+        input_prefix = self.input_prefix
+        render_jobs = [
+            (np.stack(self.center_x_slices, axis=2), 3, '{}_center_x'.format(input_prefix), 1, 0.1),
+            (np.stack(self.center_y_slices, axis=2), 3, '{}_center_y'.format(input_prefix), 1, 0.1),
+            (np.stack(self.center_z_slices, axis=2), 3, '{}_center_z'.format(input_prefix), 1, 0.1),
+            ]
+        for stat_image, stat_name in [(mean_data, 'mean'), (stdev_data, 'stdev'), (tsnr_data, 'snr')]:
+            for slice_dim in [1, 2, 3]:
+                render_jobs.append((stat_image, slice_dim, '{}_cut_{}'.format(input_prefix, stat_name), 0, 0.2))
+        mquick._render_gifs(render_jobs, self.picgifs_output_dir, jobs=self.jobs)
+        return mquick._write_html(input_prefix, self.output_dir, self.cuttrs, scale_dict)
+
+
+def run_realtime(input_path, output_dir=None, cuttrs=0, refresh=10, poll=1.0, timeout=60.0,
+                 expected_vols=None, detrend=0, jobs=1):
+    #Follow a growing series until expected_vols volumes have arrived or no
+    #new volume has arrived for timeout seconds, refreshing the outputs
+    #every refresh volumes. Returns the html file name.
+    input_path = os.path.abspath(input_path)
+    if os.path.isdir(input_path):
+        source = _VolumeDirSource(input_path)
+        input_prefix = os.path.basename(os.path.normpath(input_path))
+    elif input_path.endswith('.nii'):
+        source = _AppendedFileSource(input_path)
+        input_prefix = os.path.split(input_path)[-1][:-4]
+    else:
+        print('Input should be a directory of volumes or an uncompressed .nii file: {}'.format(input_path))
+        raise RuntimeError
+
+    if output_dir is None:
+        output_dir = os.path.split(input_path)[0]
+    output_dir = mquick._format_base_output_dir(output_dir, 'quickgifs_{}'.format(input_prefix))
+    if not os.path.exists(output_dir):
+        print('Creating output directory: {}'.format(output_dir))
+        os.mkdir(output_dir)
+
+    realtime_qc = None
+    output_html = None
+    last_written = 0
+    last_arrival = time.time()
+    print('Waiting for volumes in: {}'.format(input_path))
+    while True:
+        volumes = source.new_volumes()
+        if volumes:
+            last_arrival = time.time()
+            if realtime_qc is None:
+                realtime_qc = RealtimeQuickgifs(output_dir, input_prefix, source.voxel_sizes(),
+                                                cuttrs=cuttrs, detrend=detrend, jobs=jobs)
+            for volume in volumes:
+                realtime_qc.add_volume(volume)
+            num_used = realtime_qc.num_used()
+            if num_used > 1 and num_used - last_written >= refresh:
+                output_html = realtime_qc.write_outputs()
+                last_written = num_used
+                print('Updated outputs after {} volumes'.format(realtime_qc.num_seen))
+
+        finished = expected_vols is not None and realtime_qc is not None and realtime_qc.num_seen >= expected_vols
+        timed_out = time.time() - last_arrival > timeout
+        if finished or timed_out:
+            break
+        if not volumes:
+            time.sleep(poll)
+
+    if realtime_qc is None or realtime_qc.num_used() < 2:
+        print('Fewer than 2 usable volumes arrived; nothing to write!')
+        raise RuntimeError
+    if realtime_qc.num_used() != last_written:
+        output_html = realtime_qc.write_outputs()
+    print('-------------------------------------------------')
+    print('Volumes received: {}'.format(realtime_qc.num_seen))
+    print('Output html file: {}'.format(output_html))
+    print('-------------------------------------------------')
+    return output_html
+
+
+if __name__ == "__main__":
+
+    #Set up argument parser and help dialogue
+    parser=argparse.ArgumentParser(
+        description='''Follow a run as it is acquired and keep quick QC gifs up to date. ''',
+        usage='python3 -m mri_quickgifs_realtime [options] input [output_dir]')
+    parser.add_argument('--cuttrs', help='set number of trs to exclude (i.e. pre-steady-state trs)', default=0)
+    parser.add_argument('--refresh', help='rewrite the gifs and html every N volumes (default: 10)', type=int, default=10)
+    parser.add_argument('--poll', help='seconds to wait between checks for new volumes (default: 1)', type=float, default=1.0)
+    parser.add_argument('--timeout', help='finish when no new volume has arrived for this many seconds (default: 60)', type=float, default=60.0)
+    parser.add_argument('--expected-vols', help='finish as soon as this many volumes have arrived', type=int, default=None)
+    parser.add_argument('--detrend', help='use linearly detrended standard deviation (as mri_quickgifs.py does) instead of the plain running variance',
+                         action='store_const', const=1, default=0)
+    parser.add_argument('--jobs', help='number of gifs to render at once (0 uses every cpu)', type=int, default=1)
+    parser.add_argument('input', help='directory of per-volume .nii/.nii.gz files, or a growing 4D .nii file')
+    parser.add_argument('output_dir', nargs='?', default=None, help='where things will get written. If not provided, uses the directory of the input')
+    args = parser.parse_args()
+
+    run_realtime(args.input, output_dir=args.output_dir, cuttrs=int(args.cuttrs), refresh=args.refresh,
+                 poll=args.poll, timeout=args.timeout, expected_vols=args.expected_vols,
+                 detrend=args.detrend, jobs=args.jobs)
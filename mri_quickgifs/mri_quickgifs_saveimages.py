@@ -0,0 +1,95 @@
+##############################################################
+#Description: --saveimages output for mri_quickgifs. The temporal mean,
+#             detrended standard deviation and tSNR images (and, if asked
+#             for, the detrended time series) are written as float32 NIfTI
+#             files with the input's affine, on a background thread, while
+#             the gifs are rendered. Images are streamed straight into the
+#             output file: uncompressed (.nii) with a compression level of
+#             0, otherwise gzip (.nii.gz) at the given level.
+#
+#History: (10/2026) Added intermediate image export
+##################################################################
+
+import os
+import gzip
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+#gzip level of saved images (1 is nibabel's default: fast, nearly as small as 9)
+DEFAULT_COMPRESSION = 1
+
+
+def image_file(output_dir, output_prefix, compresslevel=DEFAULT_COMPRESSION):
+    #Path of a saved image: .nii when uncompressed, .nii.gz otherwise
+    if compresslevel:
+        return os.path.join(output_dir, output_prefix+'.nii.gz')
+    return os.path.join(output_dir, output_prefix+'.nii')
+
+
+def _float32_header(ref_header, affine, image_shape):
+    #Header of a float32 image with the input image's space
+    image_header = ref_header.copy()
+    image_header.set_data_shape(image_shape)
+    image_header.set_data_dtype(np.float32)
+    image_header.set_slope_inter(1, 0)
+    image_header.set_qform(affine)
+    image_header.set_sform(affine)
+    return image_header
+
+
+def _open_output(output_file, compresslevel):
+    if compresslevel:
+        return gzip.open(output_file, 'wb', compresslevel=int(compresslevel))
+    return open(output_file, 'wb')
+
+
+def write_image(image_data, ref_header, affine, output_file, compresslevel=DEFAULT_COMPRESSION):
+    #Write a 3D array as a float32 NIfTI image
+    image_header = _float32_header(ref_header, affine, image_data.shape)
+    with _open_output(output_file, compresslevel) as fo:
+        image_header.write_to(fo)
+        fo.write(np.asarray(image_data, dtype=image_header.get_data_dtype()).tobytes(order='F'))
+    return output_file
+
+
+def write_series(volume_chunks, image_shape, ref_header, affine, output_file, compresslevel=DEFAULT_COMPRESSION):
+    #Write a 4D float32 NIfTI image from an iterable of (volumes, voxels)
+    #arrays of consecutive volumes. Volumes are contiguous in a NIfTI file,
+    #so each chunk is appended as it arrives and the series is never held
+    #in memory.
+    image_header = _float32_header(ref_header, affine, image_shape)
+    num_written = 0
+    with _open_output(output_file, compresslevel) as fo:
+        image_header.write_to(fo)
+        for volume_chunk in volume_chunks:
+            fo.write(np.asarray(volume_chunk, dtype=image_header.get_data_dtype()).tobytes(order='C'))
+            num_written += volume_chunk.shape[0]
+    if num_written != image_shape[3]:
+        raise RuntimeError('Wrote {} of {} volumes to {}!'.format(num_written, image_shape[3], output_file))
+    return output_file
+
+
+class ImageWriter():
+    #Writes images on one background thread. submit() returns straight
+    #away; wait() blocks until everything is written and returns the files
+    #(re-raising any error from the writer thread).
+    def __init__(self, profiler=None):
+        self.profiler = profiler
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='saveimages')
+        self.futures = []
+
+    def _run(self, write_function, write_args):
+        if self.profiler is None:
+            return write_function(*write_args)
+        with self.profiler.stage('save images'):
+            return write_function(*write_args)
+
+    def submit(self, write_function, *write_args):
+        self.futures.append(self.executor.submit(self._run, write_function, write_args))
+
+    def wait(self):
+        try:
+            return [x.result() for x in self.futures]
+        finally:
+            self.executor.shutdown()
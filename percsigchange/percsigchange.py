@@ -1,9 +1,25 @@
 
 
 import os
-import pandas as pd
 import subprocess
 import argparse
+import contextlib
+import numpy as np
+#nibabel is slow to import, so it is imported where images are read and
+#written; --help and argument errors don't load it
+#Stage profiling is shared with mri_quickgifs (mri_quickgifs_profile.py)
+#and is used when the mri_quickgifs directory is on the Python path;
+#without it stages are simply not timed and --profile is an error
+try:
+    from mri_quickgifs_profile import StageProfiler, NO_PROFILE
+except ImportError:
+    StageProfiler = None
+
+    class _NoProfiler():
+        def stage(self, name):
+            return contextlib.nullcontext()
+
+    NO_PROFILE = _NoProfiler()
 
 
 
@@ -15,12 +31,42 @@ def __add_prefix(input_file, prefix):
     return output_file
 
 
-def calc_perc_change(input_pe_file, mean_func_file, pe_range, output_dir):
-    #Calculate the percent signal change image
+def perc_change_name(input_pe_file, output_dir, compress=1):
+    #Name of the percent signal change image for a PE image
     input_pe_name = os.path.split(input_pe_file)[-1]
     perc_change_name = __add_prefix(input_pe_name, '_percchange')
-    perc_change_file = os.path.join(output_dir, perc_change_name)
-
+    if compress and not perc_change_name.endswith('.gz'):
+        perc_change_name = perc_change_name+'.gz'
+    elif not compress and perc_change_name.endswith('.gz'):
+        perc_change_name = perc_change_name[:-3]
+    return os.path.join(output_dir, perc_change_name)
+
+
+def _round_ranges(pe_range, dtype=np.float32):
+    #Round event heights to 5 decimal places, as they are when passed to fslmaths
+    return np.array([float('{:.5f}'.format(x)) for x in np.ravel(pe_range)], dtype=dtype).reshape(np.shape(pe_range))
+
+
+def perc_change_array(pe_data, mean_func_data, pe_range, dtype=np.float32):
+    #Calculate pe*range/mean_func*100 in memory. Voxels where the mean
+    #functional image is zero are set to zero (as fslmaths -div does).
+    #The range is rounded to 5 decimal places, as it is when passed
+    #to fslmaths, so both backends give the same result.
+    #pe_range can also be an array of ranges for a stack of PEs along the
+    #last axis of pe_data (with mean_func_data broadcast against it).
+    pe_range = _round_ranges(pe_range, dtype=dtype)
+    perc_change_data = np.array(pe_data, dtype=dtype)
+    perc_change_data *= pe_range
+    mean_func_data = np.asarray(mean_func_data, dtype=dtype)
+    zero_mean = np.broadcast_to(mean_func_data==0, perc_change_data.shape)
+    np.divide(perc_change_data, mean_func_data, out=perc_change_data, where=~zero_mean)
+    perc_change_data[zero_mean] = 0
+    perc_change_data *= dtype(100.0)
+    return perc_change_data
+
+
+def _calc_perc_change_fslmaths(input_pe_file, mean_func_file, pe_range, perc_change_file, profiler=NO_PROFILE):
+    #Calculate the percent signal change image with fslmaths
     str_pe_range = '{:.5f}'.format(pe_range)
 
     calc_call = [
@@ -32,47 +78,121 @@ def calc_perc_change(input_pe_file, mean_func_file, pe_range, output_dir):
                  perc_change_file
                  ]
     try:
-        calc_output = subprocess.run(calc_call, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as err:
+        with profiler.stage('fslmaths'):
+            calc_output = subprocess.run(calc_call, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except (subprocess.CalledProcessError, OSError) as err:
         print('ERROR with calculation of percent signal change image!')
         print('Call: {}'.format(' '.join(calc_call)))
-        print('Process Messages: {}'.format(err.output))
+        print('Process Messages: {}'.format(getattr(err, 'output', err)))
         return None
 
     return perc_change_file
 
 
-def calc_pe_scale(designmat_file, pe_index):
-    #Convert the design.mat into a design.txt file
-    designtxt_file = designmat_file[:-4]+'.txt' 
-
-    convert_call = [
-                    'Vest2Text',
-                    designmat_file,
-                    designtxt_file
-                    ]
-    if not os.path.exists(designtxt_file):
-        try:
-            convert_output = subprocess.run(convert_call, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as err:
-            print('ERROR with conversion of design.mat to design.txt!')
-            print('Call: {}'.format(' '.join(convert_call)))
-            print('Process Messages: {}'.format(err.output))
-            return None
+def _calc_perc_change_numpy(input_pe_file, mean_func_file, pe_range, perc_change_file, profiler=NO_PROFILE):
+    #Calculate the percent signal change image in memory with nibabel/numpy
+    import nibabel as nib
+    try:
+        with profiler.stage('load images'):
+            pe_img = nib.load(input_pe_file)
+            pe_data = pe_img.get_fdata(dtype=np.float32)
+            mean_func_data = nib.load(mean_func_file).get_fdata(dtype=np.float32)
+    except Exception as err:
+        print('ERROR reading images for percent signal change calculation!')
+        print('Error: {}'.format(err))
+        return None
+    if pe_data.shape != mean_func_data.shape:
+        print('ERROR: PE image and mean functional image have different shapes: {} vs {}'.format(pe_data.shape, mean_func_data.shape))
+        return None
+
+    with profiler.stage('calculate percent change'):
+        perc_change_data = perc_change_array(pe_data, mean_func_data, pe_range)
+    with profiler.stage('save image'):
+        perc_change_img = nib.Nifti1Image(perc_change_data, pe_img.affine, pe_img.header)
+        perc_change_img.set_data_dtype(np.float32)
+        nib.save(perc_change_img, perc_change_file)
+    return perc_change_file
+
+
+def calc_perc_change(input_pe_file, mean_func_file, pe_range, output_dir, backend='numpy', compress=1, profiler=NO_PROFILE):
+    #Calculate the percent signal change image, either in-process
+    #(backend='numpy') or by calling fslmaths (backend='fslmaths')
+    perc_change_file = perc_change_name(input_pe_file, output_dir, compress=compress)
+    if backend == 'numpy':
+        return _calc_perc_change_numpy(input_pe_file, mean_func_file, pe_range, perc_change_file, profiler=profiler)
+    elif backend == 'fslmaths':
+        return _calc_perc_change_fslmaths(input_pe_file, mean_func_file, pe_range, perc_change_file, profiler=profiler)
     else:
-        print('design.txt already there...')
+        print('Unrecognized backend: {}'.format(backend))
+        return None
+
 
-    #Read in the contents of the design.txt file as a dataframe
-    design_matrix = pd.read_csv(designtxt_file, sep='\t', header=None)
+def read_vest(vest_file):
+    #Read an FSL VEST format file (e.g. design.mat or design.con) into a
+    #2D array. Returns the matrix and a dict of the "/Name value" header
+    #fields (e.g. NumWaves, NumPoints).
+    with open(vest_file, 'r') as fo:
+        vest_lines = fo.readlines()
+
+    headers = {}
+    matrix_start = None
+    for line_num, line in enumerate(vest_lines):
+        line = line.strip()
+        if line.startswith('/Matrix'):
+            matrix_start = line_num+1
+            break
+        if line.startswith('/'):
+            line_parts = line.split(None, 1)
+            if len(line_parts) > 1:
+                headers[line_parts[0][1:]] = line_parts[1].strip()
+            else:
+                headers[line_parts[0][1:]] = ''
+    if matrix_start is None:
+        raise RuntimeError('No /Matrix section found in VEST file: {}'.format(vest_file))
+
+    matrix = np.loadtxt(vest_lines[matrix_start:], ndmin=2)
+    if 'NumWaves' in headers and matrix.size and matrix.shape[1] != int(headers['NumWaves']):
+        raise RuntimeError('VEST file has {} columns but /NumWaves is {}: {}'.format(matrix.shape[1], headers['NumWaves'], vest_file))
+    for row_header in ['NumPoints', 'NumContrasts']:
+        if row_header in headers and matrix.shape[0] != int(headers[row_header]):
+            raise RuntimeError('VEST file has {} rows but /{} is {}: {}'.format(matrix.shape[0], row_header, headers[row_header], vest_file))
+    return matrix, headers
+
+
+#EV ranges of design files already read, keyed by file name and
+#modification time
+_ev_range_cache = {}
+
+
+def calc_ev_ranges(designmat_file):
+    #Return the range (max - min) of every EV in a design.mat file.
+    #Ranges are cached so each design is only read once per process.
+    cache_key = (os.path.abspath(designmat_file), os.stat(designmat_file).st_mtime_ns)
+    if cache_key not in _ev_range_cache:
+        design_matrix, headers = read_vest(designmat_file)
+        _ev_range_cache[cache_key] = design_matrix.max(axis=0) - design_matrix.min(axis=0)
+    return _ev_range_cache[cache_key]
+
+
+def calc_pe_scale(designmat_file, pe_index):
+    #Calculate the range of the design EV for a (1-based) PE index
+    try:
+        ev_ranges = calc_ev_ranges(designmat_file)
+    except (OSError, ValueError, RuntimeError) as err:
+        print('ERROR reading design matrix file: {}'.format(designmat_file))
+        print('Error: {}'.format(err))
+        return None
 
-    #Calculate ev range
     pe_index = int(pe_index)-1
-    pe_range = float(design_matrix.loc[:,pe_index].max()) - float(design_matrix.loc[:,pe_index].min())
+    if pe_index < 0 or pe_index >= len(ev_ranges):
+        print('PE index {} is outside the design matrix ({} EVs)!'.format(pe_index+1, len(ev_ranges)))
+        return None
+    pe_range = float(ev_ranges[pe_index])
 
     return pe_range
 
 
-def generate_map(feat_dir, pe_index, output_dir=None, event_height=None):
+def generate_map(feat_dir, pe_index, output_dir=None, event_height=None, backend='numpy', compress=1, profiler=NO_PROFILE):
 
     #Make sure the feat_dir exists
     print('Checking feat directory...')
@@ -110,7 +230,8 @@ def generate_map(feat_dir, pe_index, output_dir=None, event_height=None):
 
         #Calculate the pe design range
         print('Calculating PE design model range...')
-        pe_range = calc_pe_scale(designmat_file, pe_index)
+        with profiler.stage('design range'):
+            pe_range = calc_pe_scale(designmat_file, pe_index)
         if pe_range is None:
             raise RuntimeError('Error calculating PE range!')
     else:
@@ -119,13 +240,189 @@ def generate_map(feat_dir, pe_index, output_dir=None, event_height=None):
 
     #Create percent signal change image
     print('Creating percent signal change image...')
-    perc_change_file = calc_perc_change(input_pe_file, mean_func_file, pe_range, output_dir)
+    perc_change_file = calc_perc_change(input_pe_file, mean_func_file, pe_range, output_dir, backend=backend, compress=compress,
+                                        profiler=profiler)
     if perc_change_file is None:
         raise RuntimeError('Error creating percent signal change image!')
 
     print('Percent Signal Change Image: {}'.format(perc_change_file))
+    return perc_change_file
+
+
+def find_pe_indices(feat_dir):
+    #All PE indices of a FEAT analysis: one per EV in design.mat, or every
+    #stats/pe*.nii.gz file if there's no design.mat
+    designmat_file = os.path.join(feat_dir, 'design.mat')
+    if os.path.exists(designmat_file):
+        return list(range(1, len(calc_ev_ranges(designmat_file))+1))
+    pe_indices = []
+    for file_name in os.listdir(os.path.join(feat_dir, 'stats')):
+        if file_name.startswith('pe') and file_name.endswith('.nii.gz') and file_name[2:-7].isdigit():
+            pe_indices.append(int(file_name[2:-7]))
+    return sorted(pe_indices)
+
+
+def _feat_pe_ranges(feat_dir, pe_indices, event_height=None):
+    #Event height of each PE: the EV ranges from design.mat, or the passed
+    #event_height for all of them
+    if event_height is not None:
+        return [float(event_height)]*len(pe_indices)
+    designmat_file = os.path.join(feat_dir, 'design.mat')
+    if not os.path.exists(designmat_file):
+        raise RuntimeError('design.mat file cannot be found: {}'.format(designmat_file))
+    pe_ranges = [calc_pe_scale(designmat_file, x) for x in pe_indices]
+    if None in pe_ranges:
+        raise RuntimeError('Error calculating PE range!')
+    return pe_ranges
+
+
+def _load_pe_stack(feat_dir, pe_indices):
+    #Read mean_func and the PE images of one FEAT directory. Returns the
+    #mean functional data, the (x, y, z, PE) stack and the first PE image
+    #(for its affine and header).
+    if not os.path.exists(feat_dir):
+        raise RuntimeError('Passed feat_dir does not exist: {}'.format(feat_dir))
+    mean_func_file = os.path.join(feat_dir, 'mean_func.nii.gz')
+    if not os.path.exists(mean_func_file):
+        raise RuntimeError('mean functional image file cannot be found: {}'.format(mean_func_file))
+    input_pe_files = [os.path.join(feat_dir, 'stats', 'pe{}.nii.gz'.format(x)) for x in pe_indices]
+    for input_pe_file in input_pe_files:
+        if not os.path.exists(input_pe_file):
+            raise RuntimeError('pe stats file cannot be found: {}'.format(input_pe_file))
+
+    import nibabel as nib
+    mean_func_data = nib.load(mean_func_file).get_fdata(dtype=np.float32)
+    pe_img = nib.load(input_pe_files[0])
+    pe_stack = np.empty(mean_func_data.shape+(len(pe_indices),), dtype=np.float32)
+    for pe_num, input_pe_file in enumerate(input_pe_files):
+        if pe_num == 0:
+            this_img = pe_img
+        else:
+            this_img = nib.load(input_pe_file)
+        if this_img.shape != mean_func_data.shape:
+            raise RuntimeError('PE image and mean functional image have different shapes: {}'.format(input_pe_file))
+        pe_stack[..., pe_num] = this_img.get_fdata(dtype=np.float32)
+    return mean_func_data, pe_stack, pe_img
+
+
+def calc_feat_maps(feat_dir, pe_indices='all', event_height=None):
+    #Calculate percent signal change maps for several PEs of one FEAT
+    #directory in memory. mean_func and design.mat are read once and all
+    #the maps are calculated together as a stack.
+    #Returns the (x, y, z, PE) stack, the PE indices and the first PE image
+    #(for its affine and header).
+    if not os.path.exists(feat_dir):
+        raise RuntimeError('Passed feat_dir does not exist: {}'.format(feat_dir))
+    if pe_indices == 'all':
+        pe_indices = find_pe_indices(feat_dir)
+    pe_indices = [int(x) for x in pe_indices]
+    if not pe_indices:
+        raise RuntimeError('No PEs found in feat directory: {}'.format(feat_dir))
+    pe_ranges = _feat_pe_ranges(feat_dir, pe_indices, event_height=event_height)
+    mean_func_data, pe_stack, pe_img = _load_pe_stack(feat_dir, pe_indices)
+    perc_change_stack = perc_change_array(pe_stack, mean_func_data[..., np.newaxis], np.array(pe_ranges))
+    return perc_change_stack, pe_indices, pe_img
+
+
+def generate_maps(feat_dir, pe_indices='all', output_dir=None, event_height=None, compress=1):
+    #Create percent signal change images for several PEs (or 'all') of one
+    #FEAT directory in a single pass. Returns the list of files written.
+    if output_dir is None:
+        output_dir = feat_dir
+    if not os.path.exists(output_dir):
+        raise RuntimeError('Passed output_dir does not exist: {}'.format(output_dir))
+
+    import nibabel as nib
+    perc_change_stack, pe_indices, pe_img = calc_feat_maps(feat_dir, pe_indices, event_height=event_height)
+    perc_change_files = []
+    for pe_num, pe_index in enumerate(pe_indices):
+        perc_change_file = perc_change_name('pe{}.nii.gz'.format(pe_index), output_dir, compress=compress)
+        perc_change_img = nib.Nifti1Image(perc_change_stack[..., pe_num], pe_img.affine, pe_img.header)
+        perc_change_img.set_data_dtype(np.float32)
+        nib.save(perc_change_img, perc_change_file)
+        perc_change_files.append(perc_change_file)
+    return perc_change_files
+
+
+def read_contrasts(designcon_file):
+    #Read the contrasts of a design.con file. Returns the (contrast, EV)
+    #weight matrix and the name of each contrast.
+    contrast_matrix, headers = read_vest(designcon_file)
+    contrast_names = [headers.get('ContrastName{}'.format(x+1), '') for x in range(contrast_matrix.shape[0])]
+    return contrast_matrix, contrast_names
+
+
+def calc_contrast_maps(feat_dir, contrast_matrix, event_height=None):
+    #Calculate percent signal change maps for linear combinations of the PEs
+    #of one FEAT directory: for each row of weights c,
+    #sum_i(c_i*range_i*pe_i)/mean_func*100. Only the PEs with a non-zero
+    #weight are read, once, and all the contrasts are combined in a single
+    #tensordot over the PE axis.
+    #Returns the (x, y, z, contrast) stack and the first PE image read.
+    if not os.path.exists(feat_dir):
+        raise RuntimeError('Passed feat_dir does not exist: {}'.format(feat_dir))
+    contrast_matrix = np.atleast_2d(np.asarray(contrast_matrix, dtype=np.float64))
+    num_evs = len(find_pe_indices(feat_dir))
+    if contrast_matrix.shape[1] != num_evs:
+        raise RuntimeError('Contrasts have {} weights but the design has {} EVs: {}'.format(contrast_matrix.shape[1], num_evs, feat_dir))
+    used_evs = np.nonzero(np.any(contrast_matrix != 0, axis=0))[0]
+    if len(used_evs) == 0:
+        raise RuntimeError('Every contrast weight is zero!')
+    pe_indices = [int(x)+1 for x in used_evs]
+
+    pe_ranges = _round_ranges(_feat_pe_ranges(feat_dir, pe_indices, event_height=event_height), dtype=np.float64)
+    pe_weights = (contrast_matrix[:, used_evs]*pe_ranges).astype(np.float32)
+    mean_func_data, pe_stack, pe_img = _load_pe_stack(feat_dir, pe_indices)
+    contrast_stack = np.tensordot(pe_stack, pe_weights, axes=([3], [1]))
+    del pe_stack
+    perc_change_stack = perc_change_array(contrast_stack, mean_func_data[..., np.newaxis], np.ones(contrast_matrix.shape[0]))
+    return perc_change_stack, pe_img
+
+
+def generate_contrast_maps(feat_dir, con_indices=None, contrast_weights=None, output_dir=None, event_height=None, compress=1):
+    #Create percent signal change images for contrasts of one FEAT
+    #directory in a single pass: con_indices are contrasts of design.con
+    #(or 'all'), written as cope[N]_percchange.nii.gz, and contrast_weights
+    #are extra weight vectors (one weight per EV), written as
+    #contrast[N]_percchange.nii.gz. Returns the list of files written.
+    if output_dir is None:
+        output_dir = feat_dir
+    if not os.path.exists(output_dir):
+        raise RuntimeError('Passed output_dir does not exist: {}'.format(output_dir))
+
+    contrast_rows = []
+    output_names = []
+    if con_indices is not None:
+        designcon_file = os.path.join(feat_dir, 'design.con')
+        if not os.path.exists(designcon_file):
+            raise RuntimeError('design.con file cannot be found: {}'.format(designcon_file))
+        design_contrasts, contrast_names = read_contrasts(designcon_file)
+        if con_indices == 'all':
+            con_indices = list(range(1, design_contrasts.shape[0]+1))
+        for con_index in con_indices:
+            if int(con_index) < 1 or int(con_index) > design_contrasts.shape[0]:
+                raise RuntimeError('Contrast {} is outside design.con ({} contrasts)!'.format(con_index, design_contrasts.shape[0]))
+            contrast_rows.append(design_contrasts[int(con_index)-1])
+            output_names.append('cope{}.nii.gz'.format(int(con_index)))
+            print('Contrast {}: {}'.format(int(con_index), contrast_names[int(con_index)-1]))
+    for weight_num, weights in enumerate(contrast_weights or []):
+        contrast_rows.append(np.asarray(weights, dtype=np.float64))
+        output_names.append('contrast{}.nii.gz'.format(weight_num+1))
+    if not contrast_rows:
+        raise RuntimeError('No contrasts requested!')
+
+    import nibabel as nib
+    perc_change_stack, pe_img = calc_contrast_maps(feat_dir, np.vstack(contrast_rows), event_height=event_height)
+    perc_change_files = []
+    for contrast_num, output_name in enumerate(output_names):
+        perc_change_file = perc_change_name(output_name, output_dir, compress=compress)
+        perc_change_img = nib.Nifti1Image(perc_change_stack[..., contrast_num], pe_img.affine, pe_img.header)
+        perc_change_img.set_data_dtype(np.float32)
+        nib.save(perc_change_img, perc_change_file)
+        perc_change_files.append(perc_change_file)
+    return perc_change_files
+
 
-    
 
 def main(args):
     
@@ -140,7 +437,17 @@ def main(args):
     else:
         event_height = None
 
-    generate_map(feat_dir, pe_index, output_dir=output_dir, event_height=event_height)
+    if not args.profile:
+        profiler = NO_PROFILE
+    elif StageProfiler is None:
+        raise RuntimeError('--profile needs mri_quickgifs_profile.py: add the mri_quickgifs directory to PYTHONPATH!')
+    else:
+        profiler = StageProfiler(enabled=1)
+    perc_change_file = generate_map(feat_dir, pe_index, output_dir=output_dir, event_height=event_height,
+                                    backend=args.backend, compress=int(not args.uncompressed), profiler=profiler)
+    if args.profile:
+        profile_file = os.path.join(os.path.split(perc_change_file)[0], 'percsigchange_pe{}_profile.json'.format(pe_index))
+        profiler.write_report(profile_file)
 
 
 if __name__ == "__main__":
@@ -149,6 +456,11 @@ if __name__ == "__main__":
         description='''Generate a percent signal change image for a specific PE of a FEAT design. ''',
         usage='python3 -m percsigchange feat_dir pe_index [output_dir]')
     parser.add_argument('--event_height', help='height of a single event, as modeled by FSL; if not passed, it will be set as the max of the EV minus the min of the EV in the design matrix', default=None)
+    parser.add_argument('--backend', help='how to calculate the image: in-process with numpy (default) or by calling fslmaths',
+                         choices=['numpy', 'fslmaths'], default='numpy')
+    parser.add_argument('--uncompressed', help='write a .nii image instead of .nii.gz', action='store_true')
+    parser.add_argument('--profile', help='record the time and memory used by each stage and write a json report next to the output image',
+                        action='store_const', const=1, default=0)
     parser.add_argument('feat_dir', help='.feat directory of the analysis')
     parser.add_argument('pe_index', help='index number of a PE in the design you wish to calculate a percent signal change map for (index begins at 1)')
     parser.add_argument('output_dir', nargs='?', default=None, help='where things will get written. If not provided, use feat directory')
@@ -0,0 +1,136 @@
+##############################################################
+#Description: create percent signal change images for many PEs (or
+#             contrasts) of many FEAT directories. Each directory's
+#             mean_func and design.mat are read once, its maps are
+#             calculated together, and the directories are spread across
+#             a pool of worker processes.
+#
+#Usage: python3 -m percsigchange_batch [--pes all|1,2,3] [--contrasts all|1,2] [--contrast=W1,W2,...] [--workers INT] [--output-dir DIR] feat_dir [feat_dir ...]
+#
+#History: (10/2026) Added batch mode for percsigchange
+#         (10/2026) Added contrast maps
+##################################################################
+
+import os, sys
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import percsigchange as psc
+
+
+def collect_feat_dirs(input_list):
+    #Expand glob patterns and text files listing directories into a
+    #de-duplicated list of FEAT directories
+    feat_dirs = []
+    for input_item in input_list:
+        if os.path.isfile(input_item):
+            with open(input_item, 'r') as fo:
+                found_dirs = [x.strip() for x in fo if x.strip() and not x.strip().startswith('#')]
+        else:
+            found_dirs = sorted(glob.glob(input_item))
+            if not found_dirs:
+                print('WARNING: nothing found for input: {}'.format(input_item))
+        for found_dir in found_dirs:
+            found_dir = os.path.abspath(found_dir)
+            if found_dir not in feat_dirs:
+                feat_dirs.append(found_dir)
+    return feat_dirs
+
+
+def _feat_output_dirs(feat_dirs, output_dir):
+    #Each FEAT directory gets its own subdirectory of output_dir, named
+    #after the FEAT directory (or writes into itself with no output_dir)
+    if output_dir is None:
+        return feat_dirs
+    sub_names = [os.path.basename(os.path.normpath(x)) for x in feat_dirs]
+    if len(set(sub_names)) != len(sub_names):
+        raise RuntimeError('FEAT directory names must be unique when an output directory is passed!')
+    return [os.path.join(output_dir, x) for x in sub_names]
+
+
+def _run_one(feat_dir, pe_indices, output_dir, event_height, compress, con_indices=None, contrast_weights=None):
+    try:
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+        if con_indices is not None or contrast_weights:
+            perc_change_files = psc.generate_contrast_maps(feat_dir, con_indices=con_indices, contrast_weights=contrast_weights,
+                                                           output_dir=output_dir, event_height=event_height, compress=compress)
+        else:
+            perc_change_files = psc.generate_maps(feat_dir, pe_indices, output_dir=output_dir,
+                                                  event_height=event_height, compress=compress)
+        return feat_dir, perc_change_files, None
+    except Exception as ex:
+        return feat_dir, None, '{}: {}'.format(type(ex).__name__, ex)
+
+
+def run_batch(feat_dirs, pe_indices='all', output_dir=None, event_height=None, compress=1, workers=None,
+              con_indices=None, contrast_weights=None):
+    #Create percent signal change maps for every FEAT directory on a pool of
+    #worker processes. If contrasts (con_indices from design.con, and/or
+    #contrast_weights vectors) are passed, contrast maps are made instead of
+    #PE maps. Returns (feat_dir, files written, error) for each directory,
+    #in input order.
+    if not feat_dirs:
+        raise RuntimeError('No FEAT directories to process!')
+    feat_output_dirs = _feat_output_dirs(feat_dirs, output_dir)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(int(workers), len(feat_dirs)))
+
+    print('Creating percent signal change maps for {} FEAT directories with {} workers...'.format(len(feat_dirs), workers))
+    result_dict = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_run_one, x, pe_indices, y, event_height, compress, con_indices, contrast_weights)
+                   for x, y in zip(feat_dirs, feat_output_dirs)]
+        for future in as_completed(futures):
+            feat_dir, perc_change_files, error_text = future.result()
+            result_dict[feat_dir] = (feat_dir, perc_change_files, error_text)
+            if error_text is None:
+                print('[{}/{}] Finished: {} ({} maps)'.format(len(result_dict), len(feat_dirs), feat_dir, len(perc_change_files)))
+            else:
+                print('[{}/{}] FAILED: {} -- {}'.format(len(result_dict), len(feat_dirs), feat_dir, error_text))
+    return [result_dict[x] for x in feat_dirs]
+
+
+def parse_pes(pes_arg):
+    if pes_arg == 'all':
+        return 'all'
+    return [int(x) for x in pes_arg.split(',') if x.strip()]
+
+
+def parse_weights(weights_arg):
+    #Contrast weights, one per EV, e.g. "0,1,-1"
+    return [float(x) for x in weights_arg.split(',') if x.strip()]
+
+
+if __name__ == "__main__":
+    #Set up argument parser and help dialogue
+    parser=argparse.ArgumentParser(
+        description='''Generate percent signal change images for many PEs of many FEAT directories. ''',
+        usage='python3 -m percsigchange_batch [--pes all|1,2,3] [--contrasts all|1,2] [--contrast=W1,W2,...] [--workers INT] [--output-dir DIR] feat_dir [feat_dir ...]')
+    parser.add_argument('--pes', help='comma-separated PE indices (index begins at 1), or "all" (default)', default='all')
+    parser.add_argument('--contrasts', help='make maps for these contrasts of design.con (comma-separated, index begins at 1), or "all", instead of PE maps',
+                        default=None)
+    parser.add_argument('--contrast', help='make a map for this contrast, one weight per EV (e.g. --contrast=1,-1,0); can be repeated',
+                        action='append', default=None)
+    parser.add_argument('--event_height', help='height of a single event, as modeled by FSL; if not passed, the range of each EV in the design matrix is used', default=None)
+    parser.add_argument('--workers', help='number of FEAT directories to process at once (default: number of cpus)', type=int, default=None)
+    parser.add_argument('--uncompressed', help='write .nii images instead of .nii.gz', action='store_true')
+    parser.add_argument('--output-dir', help='write each directory\'s maps to a subdirectory of this directory. If not provided, use each feat directory', default=None)
+    parser.add_argument('feat_dirs', nargs='+', help='.feat directories, glob patterns or text files listing them')
+    args = parser.parse_args()
+
+    if args.event_height is not None:
+        event_height = float(args.event_height)
+    else:
+        event_height = None
+    if args.contrasts is not None:
+        con_indices = parse_pes(args.contrasts)
+    else:
+        con_indices = None
+    contrast_weights = [parse_weights(x) for x in args.contrast or []]
+    results = run_batch(collect_feat_dirs(args.feat_dirs), pe_indices=parse_pes(args.pes), output_dir=args.output_dir,
+                        event_height=event_height, compress=int(not args.uncompressed), workers=args.workers,
+                        con_indices=con_indices, contrast_weights=contrast_weights)
+    if [x for x in results if x[2] is not None]:
+        sys.exit(1)
@@ -0,0 +1,151 @@
+##############################################################
+#Description: create a single 4D group image of the percent signal change
+#             for one PE across many FEAT directories (one volume per
+#             subject, in the order given). Each subject's map is written
+#             straight into a preallocated output volume (memory-mapped on
+#             disk for .nii output), so no per-subject images are needed.
+#             A sidecar text file lists the FEAT directory of each volume.
+#
+#Usage: python3 -m percsigchange_group [options] pe_index output_file feat_dir [feat_dir ...]
+#
+#History: (10/2026) Added group mode for percsigchange
+##################################################################
+
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+#nibabel is slow to import, so it is imported where images are read and
+#written; --help and argument errors don't load it
+import percsigchange as psc
+import percsigchange_batch as pscbatch
+
+
+def _subject_map(feat_dir, pe_index, event_height, subject_map_dir):
+    #Percent signal change map of one PE for one FEAT directory. The map
+    #is also written out as an image if subject_map_dir is passed.
+    perc_change_stack, pe_indices, pe_img = psc.calc_feat_maps(feat_dir, [pe_index], event_height=event_height)
+    perc_change_data = perc_change_stack[..., 0]
+    if subject_map_dir is not None:
+        import nibabel as nib
+        perc_change_file = psc.perc_change_name('pe{}.nii.gz'.format(pe_index), subject_map_dir)
+        perc_change_img = nib.Nifti1Image(perc_change_data, pe_img.affine, pe_img.header)
+        perc_change_img.set_data_dtype(np.float32)
+        nib.save(perc_change_img, perc_change_file)
+    return perc_change_data, pe_img.affine, pe_img.header
+
+
+def _subject_map_job(job):
+    return _subject_map(*job)
+
+
+def _create_output(output_file, ref_header, ref_affine, group_shape):
+    #Preallocate the 4D group image. For .nii output the data are memory-
+    #mapped straight into the output file; for .nii.gz they are held in
+    #memory and compressed when the image is saved.
+    group_header = ref_header.copy()
+    group_header.set_data_shape(group_shape)
+    group_header.set_data_dtype(np.float32)
+    group_header.set_slope_inter(1, 0)
+    group_header.set_qform(ref_affine)
+    group_header.set_sform(ref_affine)
+    if output_file.endswith('.nii'):
+        group_header['vox_offset'] = 0
+        with open(output_file, 'wb') as fo:
+            group_header.write_to(fo)
+            data_offset = fo.tell()
+            fo.truncate(data_offset + int(np.prod(group_shape))*4)
+        group_data = np.memmap(output_file, dtype=group_header.get_data_dtype(), mode='r+',
+                               offset=data_offset, shape=group_shape, order='F')
+    else:
+        group_data = np.empty(group_shape, dtype=np.float32)
+    return group_data, group_header
+
+
+def _write_subject_list(output_file, feat_dirs):
+    #Write the sidecar listing which FEAT directory each volume came from
+    subject_file = output_file.rsplit('.nii', 1)[0]+'_subjects.txt'
+    with open(subject_file, 'w') as fo:
+        for volume_num, feat_dir in enumerate(feat_dirs):
+            fo.write('{}\t{}\n'.format(volume_num, feat_dir))
+    return subject_file
+
+
+def generate_group_map(feat_dirs, pe_index, output_file, event_height=None, subject_maps=0, workers=1):
+    #Calculate one PE's percent signal change map for every FEAT directory
+    #and write them, in order, into a single 4D image. Returns the output
+    #image and sidecar subject list file names.
+    if not feat_dirs:
+        raise RuntimeError('No FEAT directories passed!')
+    output_dir = os.path.split(os.path.abspath(output_file))[0]
+    if not os.path.exists(output_dir):
+        raise RuntimeError('Output directory does not exist: {}'.format(output_dir))
+    if not (output_file.endswith('.nii') or output_file.endswith('.nii.gz')):
+        raise RuntimeError('Output file should end in .nii or .nii.gz: {}'.format(output_file))
+
+    jobs = []
+    for feat_dir in feat_dirs:
+        if subject_maps:
+            jobs.append((feat_dir, pe_index, event_height, feat_dir))
+        else:
+            jobs.append((feat_dir, pe_index, event_height, None))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(int(workers), len(jobs)))
+    print('Creating group percent signal change image for PE {} of {} FEAT directories...'.format(pe_index, len(feat_dirs)))
+
+    group_data = None
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        subject_results = executor.map(_subject_map_job, jobs)
+    else:
+        subject_results = map(_subject_map_job, jobs)
+    try:
+        for volume_num, (perc_change_data, ref_affine, ref_header) in enumerate(subject_results):
+            if group_data is None:
+                group_shape = perc_change_data.shape+(len(feat_dirs),)
+                group_data, group_header = _create_output(output_file, ref_header, ref_affine, group_shape)
+            if perc_change_data.shape != group_data.shape[:3]:
+                raise RuntimeError('Image shape {} of {} does not match the first subject {}!'.format(
+                    perc_change_data.shape, feat_dirs[volume_num], group_data.shape[:3]))
+            group_data[..., volume_num] = perc_change_data
+            print('[{}/{}] {}'.format(volume_num+1, len(feat_dirs), feat_dirs[volume_num]))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if isinstance(group_data, np.memmap):
+        group_data.flush()
+        del group_data
+    else:
+        import nibabel as nib
+        nib.save(nib.Nifti1Image(group_data, None, group_header), output_file)
+    subject_file = _write_subject_list(output_file, feat_dirs)
+
+    print('Group Percent Signal Change Image: {}'.format(output_file))
+    print('Subject List: {}'.format(subject_file))
+    return output_file, subject_file
+
+
+if __name__ == "__main__":
+    #Set up argument parser and help dialogue
+    parser=argparse.ArgumentParser(
+        description='''Generate a 4D image of one PE's percent signal change across many FEAT directories. ''',
+        usage='python3 -m percsigchange_group [options] pe_index output_file feat_dir [feat_dir ...]')
+    parser.add_argument('--event_height', help='height of a single event, as modeled by FSL; if not passed, the range of the EV in each design matrix is used', default=None)
+    parser.add_argument('--workers', help='number of FEAT directories to process at once (default: 1)', type=int, default=1)
+    parser.add_argument('--subject-maps', help='also write each subject\'s percent signal change image to its feat directory',
+                        action='store_const', const=1, default=0)
+    parser.add_argument('pe_index', help='index number of a PE in the design (index begins at 1)')
+    parser.add_argument('output_file', help='4D output image (.nii is written in place through a memory map; .nii.gz is compressed at the end)')
+    parser.add_argument('feat_dirs', nargs='+', help='.feat directories (in subject order), glob patterns or text files listing them')
+    args = parser.parse_args()
+
+    if args.event_height is not None:
+        event_height = float(args.event_height)
+    else:
+        event_height = None
+    generate_group_map(pscbatch.collect_feat_dirs(args.feat_dirs), int(args.pe_index), args.output_file,
+                       event_height=event_height, subject_maps=args.subject_maps, workers=args.workers)
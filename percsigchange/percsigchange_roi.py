@@ -0,0 +1,194 @@
+##############################################################
+#Description: extract the mean and median percent signal change within
+#             regions of interest for many PEs of many FEAT directories,
+#             without writing full-brain percent signal change images.
+#             Only the voxels inside the ROIs are used in the calculation.
+#
+#Usage: python3 -m percsigchange_roi [options] --roi MASK [--roi MASK ...] output_table feat_dir [feat_dir ...]
+#
+#Inputs:
+#   --roi: a mask or atlas image in the same space (and grid) as the FEAT
+#          directories' mean_func.nii.gz. A binary mask is one ROI named
+#          after the file; every non-zero value of an atlas is its own ROI,
+#          named [file prefix]:[value].
+#   output_table: .csv file (or .parquet, if pandas and pyarrow are installed)
+#
+#Outputs:
+#   One row per FEAT directory, PE and ROI: feat_dir, pe, roi, n_voxels,
+#   mean_psc, median_psc. Voxels where mean_func is zero are left out.
+#
+#History: (10/2026) Added ROI extraction for percsigchange
+##################################################################
+
+import os, sys
+import csv
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+#nibabel is slow to import, so it is imported where images are read and
+#written; --help and argument errors don't load it
+import percsigchange as psc
+import percsigchange_batch as pscbatch
+
+
+TABLE_COLUMNS = ['feat_dir', 'pe', 'roi', 'n_voxels', 'mean_psc', 'median_psc']
+
+
+def load_rois(roi_files):
+    #Read mask/atlas images into a list of (roi name, flat voxel indices)
+    #plus the grid shape they're defined on
+    import nibabel as nib
+    rois = []
+    roi_shape = None
+    for roi_file in roi_files:
+        roi_img = nib.load(roi_file)
+        roi_data = np.asanyarray(roi_img.dataobj)
+        if roi_data.ndim == 4 and roi_data.shape[3] == 1:
+            roi_data = roi_data[..., 0]
+        if roi_shape is None:
+            roi_shape = roi_data.shape
+        elif roi_data.shape != roi_shape:
+            raise RuntimeError('ROI images must all have the same shape: {}'.format(roi_file))
+        roi_prefix = os.path.split(roi_file)[-1].split('.nii')[0]
+        flat_data = roi_data.ravel(order='F')
+        roi_values = np.unique(flat_data[flat_data!=0])
+        if len(roi_values) == 0:
+            print('WARNING: ROI image has no non-zero voxels: {}'.format(roi_file))
+        for roi_value in roi_values:
+            if len(roi_values) == 1:
+                roi_name = roi_prefix
+            else:
+                roi_name = '{}:{}'.format(roi_prefix, roi_value)
+            rois.append((roi_name, np.flatnonzero(flat_data==roi_value)))
+    return rois, roi_shape
+
+
+def _read_voxels(image_file, voxel_indices, image_shape):
+    #Read an image and keep only the listed voxels (as float32)
+    import nibabel as nib
+    image_data = np.asanyarray(nib.load(image_file).dataobj)
+    if image_data.shape[:3] != tuple(image_shape):
+        raise RuntimeError('Image shape {} does not match the ROI shape {}: {}'.format(image_data.shape, image_shape, image_file))
+    return image_data.ravel(order='F')[voxel_indices].astype(np.float32)
+
+
+def extract_feat_rois(feat_dir, rois, roi_shape, pe_indices='all', event_height=None):
+    #Mean and median percent signal change of each ROI for the PEs of one
+    #FEAT directory. The calculation is only done for the union of the ROI
+    #voxels. Returns a list of table rows.
+    mean_func_file = os.path.join(feat_dir, 'mean_func.nii.gz')
+    if not os.path.exists(mean_func_file):
+        raise RuntimeError('mean functional image file cannot be found: {}'.format(mean_func_file))
+    if pe_indices == 'all':
+        pe_indices = psc.find_pe_indices(feat_dir)
+    pe_ranges = psc._feat_pe_ranges(feat_dir, pe_indices, event_height=event_height)
+
+    #Every voxel used by any ROI, and where each ROI's voxels sit in it
+    all_voxels = np.unique(np.concatenate([x[1] for x in rois]))
+    roi_positions = [np.searchsorted(all_voxels, x[1]) for x in rois]
+
+    mean_func_voxels = _read_voxels(mean_func_file, all_voxels, roi_shape)
+    pe_voxels = np.empty((len(all_voxels), len(pe_indices)), dtype=np.float32)
+    for pe_num, pe_index in enumerate(pe_indices):
+        input_pe_file = os.path.join(feat_dir, 'stats', 'pe{}.nii.gz'.format(pe_index))
+        if not os.path.exists(input_pe_file):
+            raise RuntimeError('pe stats file cannot be found: {}'.format(input_pe_file))
+        pe_voxels[:, pe_num] = _read_voxels(input_pe_file, all_voxels, roi_shape)
+    psc_voxels = psc.perc_change_array(pe_voxels, mean_func_voxels[:, np.newaxis], np.array(pe_ranges))
+
+    table_rows = []
+    for (roi_name, roi_voxels), positions in zip(rois, roi_positions):
+        #Leave out voxels outside the functional data (mean_func of zero)
+        positions = positions[mean_func_voxels[positions]!=0]
+        roi_psc = psc_voxels[positions, :]
+        for pe_num, pe_index in enumerate(pe_indices):
+            if len(positions):
+                mean_psc = float(roi_psc[:, pe_num].mean(dtype=np.float64))
+                median_psc = float(np.median(roi_psc[:, pe_num]))
+            else:
+                mean_psc = float('nan')
+                median_psc = float('nan')
+            table_rows.append([feat_dir, pe_index, roi_name, len(positions), mean_psc, median_psc])
+    return table_rows
+
+
+def _extract_job(job):
+    feat_dir = job[0]
+    try:
+        return feat_dir, extract_feat_rois(*job), None
+    except Exception as ex:
+        return feat_dir, None, '{}: {}'.format(type(ex).__name__, ex)
+
+
+def write_table(table_rows, output_table):
+    #Write the rows as a CSV file, or as Parquet (needs pandas and pyarrow)
+    if output_table.endswith('.parquet'):
+        try:
+            import pandas as pd
+        except ImportError:
+            raise RuntimeError('Writing .parquet output requires pandas (and pyarrow) to be installed!')
+        pd.DataFrame(table_rows, columns=TABLE_COLUMNS).to_parquet(output_table, index=False)
+    else:
+        with open(output_table, 'w', newline='') as fo:
+            table_writer = csv.writer(fo)
+            table_writer.writerow(TABLE_COLUMNS)
+            table_writer.writerows(table_rows)
+    return output_table
+
+
+def extract_rois(feat_dirs, roi_files, output_table, pe_indices='all', event_height=None, workers=1):
+    #Extract ROI percent signal change for every FEAT directory (spread
+    #over a pool of worker processes) and write one table. Returns the
+    #table rows and a list of (feat_dir, error) for any failures.
+    if not feat_dirs:
+        raise RuntimeError('No FEAT directories passed!')
+    rois, roi_shape = load_rois(roi_files)
+    if not rois:
+        raise RuntimeError('No ROIs found in the passed ROI images!')
+    print('Extracting percent signal change in {} ROIs from {} FEAT directories...'.format(len(rois), len(feat_dirs)))
+
+    jobs = [(x, rois, roi_shape, pe_indices, event_height) for x in feat_dirs]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(int(workers), len(jobs)))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_extract_job, jobs))
+    else:
+        results = [_extract_job(x) for x in jobs]
+
+    table_rows = []
+    failures = []
+    for feat_dir, feat_rows, error_text in results:
+        if error_text is None:
+            table_rows.extend(feat_rows)
+        else:
+            print('FAILED: {} -- {}'.format(feat_dir, error_text))
+            failures.append((feat_dir, error_text))
+    write_table(table_rows, output_table)
+    print('ROI Percent Signal Change Table: {}'.format(output_table))
+    return table_rows, failures
+
+
+if __name__ == "__main__":
+    #Set up argument parser and help dialogue
+    parser=argparse.ArgumentParser(
+        description='''Extract mean/median percent signal change within ROIs from FEAT directories. ''',
+        usage='python3 -m percsigchange_roi [options] --roi MASK [--roi MASK ...] output_table feat_dir [feat_dir ...]')
+    parser.add_argument('--roi', help='mask or atlas image (may be passed more than once)', action='append', required=True)
+    parser.add_argument('--pes', help='comma-separated PE indices (index begins at 1), or "all" (default)', default='all')
+    parser.add_argument('--event_height', help='height of a single event, as modeled by FSL; if not passed, the range of each EV in the design matrix is used', default=None)
+    parser.add_argument('--workers', help='number of FEAT directories to process at once (default: 1)', type=int, default=1)
+    parser.add_argument('output_table', help='output .csv (or .parquet) file')
+    parser.add_argument('feat_dirs', nargs='+', help='.feat directories, glob patterns or text files listing them')
+    args = parser.parse_args()
+
+    if args.event_height is not None:
+        event_height = float(args.event_height)
+    else:
+        event_height = None
+    table_rows, failures = extract_rois(pscbatch.collect_feat_dirs(args.feat_dirs), args.roi, args.output_table,
+                                        pe_indices=pscbatch.parse_pes(args.pes), event_height=event_height,
+                                        workers=args.workers)
+    if failures:
+        sys.exit(1)
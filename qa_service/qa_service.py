@@ -0,0 +1,384 @@
+#!/usr/bin/python3
+
+##############################################################
+#Description: long-running local service for mri_quickgifs and
+#             percsigchange jobs. A pool of worker processes is started
+#             once, with numpy, nibabel, imageio and Pillow already
+#             imported, and jobs submitted over a localhost HTTP endpoint
+#             run on it without paying for interpreter startup or imports.
+#             At most workers + queue_size jobs are accepted at a time;
+#             beyond that submissions are refused (HTTP 503 with a
+#             Retry-After header) until the pool catches up.
+#
+#
+#Usage: python3 qa_service.py [--port INT] [--workers INT] [--queue-size INT]
+#
+#Endpoints (JSON in and out):
+#   POST   /jobs        submit a job: {"tool": "quickgifs" | "percsigchange", "params": {...}}
+#   GET    /jobs        every job the service knows about
+#   GET    /jobs/ID     status, result and error text of one job
+#                        (?wait=SEC waits up to SEC seconds for it to finish)
+#   DELETE /jobs/ID     cancel a job that hasn't started yet
+#   GET    /status      worker, queue and job counts
+#
+#History: (10/2026) Added warm worker service
+##################################################################
+
+import os, sys
+import json
+import time
+import signal
+import argparse
+import threading
+import itertools
+import collections
+import multiprocessing
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(SERVICE_DIR)
+QUICKGIFS_DIR = os.path.join(REPO_DIR, 'mri_quickgifs')
+PERCSIGCHANGE_DIR = os.path.join(REPO_DIR, 'percsigchange')
+for tool_dir in [QUICKGIFS_DIR, PERCSIGCHANGE_DIR]:
+    if tool_dir not in sys.path:
+        sys.path.insert(0, tool_dir)
+
+DEFAULT_PORT = 8765
+
+#Finished jobs kept for status queries; older ones are forgotten
+JOB_HISTORY = 1000
+
+#Longest a status request may wait for a job to finish (seconds)
+MAX_WAIT = 30.0
+
+#mri_quickgifs.main() keyword options a quickgifs job may set
+QUICKGIFS_OPTIONS = ['float32', 'max_memory', 'gzip_backend', 'jobs', 'force', 'cache_dir', 'cache_max_mb',
+                     'cache_hash', 'profile', 'preview', 'encoder', 'detrend_order']
+
+#Parameters a job may pass for each tool (on top of the options above)
+TOOL_PARAMS = {
+    'quickgifs': ['input_file', 'output_dir', 'cuttrs'] + QUICKGIFS_OPTIONS,
+    'percsigchange': ['feat_dir', 'output_dir', 'pes', 'event_height', 'compress'],
+    }
+
+#Parameters holding paths; the service has its own working directory, so
+#these must be absolute
+PATH_PARAMS = ['input_file', 'feat_dir', 'output_dir', 'cache_dir']
+
+
+def _warm_worker():
+    #Runs once in each worker process: import the tools and the libraries
+    #they load lazily, so jobs don't pay for them
+    import mri_quickgifs_batch
+    import percsigchange_batch
+    import nibabel
+    import nibabel.volumeutils
+    import imageio
+    import PIL.Image
+
+
+def _worker_pid():
+    return os.getpid()
+
+
+def _run_quickgifs(params):
+    import mri_quickgifs_batch as mqbatch
+    options = dict([(x, params[x]) for x in QUICKGIFS_OPTIONS if x in params])
+    input_file, output_html, error_text = mqbatch._run_one(params['input_file'], int(params.get('cuttrs', 0)),
+                                                            params.get('output_dir'), options)
+    return {'output_html': output_html}, error_text
+
+
+def _run_percsigchange(params):
+    import percsigchange_batch as pscbatch
+    pes = params.get('pes', 'all')
+    if isinstance(pes, str):
+        pes = pscbatch.parse_pes(pes)
+    event_height = params.get('event_height')
+    if event_height is not None:
+        event_height = float(event_height)
+    output_dir = params.get('output_dir') or params['feat_dir']
+    feat_dir, perc_change_files, error_text = pscbatch._run_one(params['feat_dir'], pes, output_dir, event_height,
+                                                                int(params.get('compress', 1)))
+    return {'output_files': perc_change_files}, error_text
+
+
+def _run_job(tool, params):
+    #Runs in a worker process. Returns (result dict, error text or None,
+    #start time, end time).
+    start_time = time.time()
+    try:
+        if tool == 'quickgifs':
+            result, error_text = _run_quickgifs(params)
+        else:
+            result, error_text = _run_percsigchange(params)
+    except Exception as ex:
+        result, error_text = {}, '{}: {}'.format(type(ex).__name__, ex)
+    return result, error_text, start_time, time.time()
+
+
+def check_job(job_request):
+    #Return (tool, params) of a submitted job, or raise a ValueError
+    #describing what's wrong with it
+    if not isinstance(job_request, dict):
+        raise ValueError('Job must be a JSON object')
+    tool = job_request.get('tool')
+    if tool not in TOOL_PARAMS:
+        raise ValueError('Unknown tool: {} (choose from {})'.format(tool, ', '.join(TOOL_PARAMS.keys())))
+    params = job_request.get('params', {})
+    if not isinstance(params, dict):
+        raise ValueError('params must be a JSON object')
+    unknown_params = [x for x in params if x not in TOOL_PARAMS[tool]]
+    if unknown_params:
+        raise ValueError('Unknown {} parameters: {}'.format(tool, ', '.join(unknown_params)))
+    required_param = TOOL_PARAMS[tool][0]
+    if not params.get(required_param):
+        raise ValueError('{} jobs need a {}'.format(tool, required_param))
+    for param_name in PATH_PARAMS:
+        if params.get(param_name) is not None and not os.path.isabs(params[param_name]):
+            raise ValueError('{} must be an absolute path: {}'.format(param_name, params[param_name]))
+    return tool, params
+
+
+class _ServiceJob():
+    def __init__(self, job_id, tool, params):
+        self.job_id = job_id
+        self.tool = tool
+        self.params = params
+        self.status = 'queued'
+        self.future = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        #Set once the job has finished, failed or been cancelled
+        self.finished_event = threading.Event()
+
+    def describe(self):
+        return {
+            'id': self.job_id,
+            'tool': self.tool,
+            'params': self.params,
+            'status': self.status,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+            'result': self.result,
+            'error': self.error,
+            }
+
+
+class QAService():
+    #The job table and worker pool behind the HTTP endpoint. Jobs wait in
+    #the service's own queue and are only handed to the pool when a worker
+    #is free, so queued jobs can still be cancelled.
+    def __init__(self, workers=None, queue_size=16):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = max(1, int(workers))
+        self.max_pending = self.workers + max(0, int(queue_size))
+        self.jobs = collections.OrderedDict()
+        self.queue = collections.deque()
+        self.num_running = 0
+        #Re-entrant: a done callback can run inside _dispatch
+        self._lock = threading.RLock()
+        self._job_ids = itertools.count(1)
+        #Spawned (not forked) workers, since the HTTP server is threaded
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker,
+                                            mp_context=multiprocessing.get_context('spawn'))
+
+    def warm_up(self):
+        #Start every worker process now rather than on the first jobs
+        worker_pids = [x.result() for x in [self.executor.submit(_worker_pid) for x in range(self.workers)]]
+        return len(set(worker_pids))
+
+    def submit(self, tool, params):
+        #Queue a job. Returns the job, or None if the service is full.
+        with self._lock:
+            if self.num_running + len(self.queue) >= self.max_pending:
+                return None
+            job = _ServiceJob(str(next(self._job_ids)), tool, params)
+            self.jobs[job.job_id] = job
+            self.queue.append(job)
+            self._forget_old_jobs()
+            self._dispatch()
+        return job
+
+    def _dispatch(self):
+        #Hand queued jobs to free workers
+        with self._lock:
+            while self.queue and self.num_running < self.workers:
+                job = self.queue.popleft()
+                job.status = 'running'
+                job.started = time.time()
+                self.num_running += 1
+                job.future = self.executor.submit(_run_job, job.tool, job.params)
+                job.future.add_done_callback(lambda x, job=job: self._job_done(job))
+
+    def _job_done(self, job):
+        try:
+            result, error_text, start_time, end_time = job.future.result()
+        except Exception as ex:
+            result, error_text, start_time, end_time = {}, '{}: {}'.format(type(ex).__name__, ex), job.started, time.time()
+        with self._lock:
+            job.result, job.error, job.started, job.finished = result, error_text, start_time, end_time
+            job.status = 'failed' if error_text is not None else 'done'
+            self.num_running -= 1
+            self._dispatch()
+        job.finished_event.set()
+        print('Job {} ({}) {}'.format(job.job_id, job.tool, job.status))
+
+    def _forget_old_jobs(self):
+        finished_ids = [x.job_id for x in self.jobs.values() if x.finished is not None]
+        for job_id in finished_ids[:max(0, len(finished_ids)-JOB_HISTORY)]:
+            del self.jobs[job_id]
+
+    def cancel(self, job_id):
+        #Cancel a queued job; returns False if it's already running or done
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status != 'queued':
+                return False
+            self.queue.remove(job)
+            job.status = 'cancelled'
+            job.finished = time.time()
+        job.finished_event.set()
+        return True
+
+    def status(self):
+        with self._lock:
+            status_counts = collections.Counter([x.status for x in self.jobs.values()])
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'running': self.num_running,
+                'queued': len(self.queue),
+                'jobs': dict(status_counts),
+                }
+
+    def describe_jobs(self, job_id=None, wait=0):
+        #Description of one job (None if unknown), or a list of every job.
+        #With wait, first wait up to that many seconds for the job to finish.
+        if job_id is not None and wait > 0 and job_id in self.jobs:
+            self.jobs[job_id].finished_event.wait(min(float(wait), MAX_WAIT))
+        with self._lock:
+            if job_id is not None:
+                return self.jobs[job_id].describe() if job_id in self.jobs else None
+            return [x.describe() for x in self.jobs.values()]
+
+    def shutdown(self):
+        with self._lock:
+            for job in self.queue:
+                job.status = 'cancelled'
+            self.queue.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _ServiceHandler(BaseHTTPRequestHandler):
+    #HTTP front end of a QAService (set as the server's "service" attribute)
+
+    def _send_json(self, status_code, body, headers=None):
+        body_bytes = json.dumps(body, indent=1).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body_bytes)))
+        for header_name, header_value in (headers or {}).items():
+            self.send_header(header_name, header_value)
+        self.end_headers()
+        self.wfile.write(body_bytes)
+
+    def _job_id(self):
+        #ID of a /jobs/ID path, or None
+        path_parts = urllib.parse.urlsplit(self.path).path.strip('/').split('/')
+        if len(path_parts) == 2 and path_parts[0] == 'jobs':
+            return path_parts[1]
+        return None
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path.rstrip('/') == '/status':
+            self._send_json(200, service.status())
+        elif self.path.rstrip('/') == '/jobs':
+            self._send_json(200, {'jobs': service.describe_jobs()})
+        elif self._job_id() is not None and service.describe_jobs(self._job_id()) is not None:
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+            try:
+                wait = float(query.get('wait', ['0'])[0])
+            except ValueError:
+                self._send_json(400, {'error': 'wait must be a number of seconds'})
+                return
+            self._send_json(200, service.describe_jobs(self._job_id(), wait=wait))
+        else:
+            self._send_json(404, {'error': 'Not found: {}'.format(self.path)})
+
+    def do_POST(self):
+        service = self.server.service
+        if self.path.rstrip('/') != '/jobs':
+            self._send_json(404, {'error': 'Not found: {}'.format(self.path)})
+            return
+        try:
+            request_length = int(self.headers.get('Content-Length', 0))
+            tool, params = check_job(json.loads(self.rfile.read(request_length).decode('utf-8')))
+        except ValueError as ex:
+            self._send_json(400, {'error': str(ex)})
+            return
+        job = service.submit(tool, params)
+        if job is None:
+            self._send_json(503, {'error': 'Job queue is full ({} jobs pending)'.format(service.max_pending)},
+                            headers={'Retry-After': '1'})
+            return
+        self._send_json(202, job.describe(), headers={'Location': '/jobs/{}'.format(job.job_id)})
+
+    def do_DELETE(self):
+        service = self.server.service
+        job_id = self._job_id()
+        if job_id is None or service.describe_jobs(job_id) is None:
+            self._send_json(404, {'error': 'Not found: {}'.format(self.path)})
+        elif service.cancel(job_id):
+            self._send_json(200, service.describe_jobs(job_id))
+        else:
+            self._send_json(409, {'error': 'Job {} has already started'.format(job_id)})
+
+    def log_message(self, format, *args):
+        #Only log errors; every status poll would otherwise be printed
+        if len(args) > 1 and str(args[1]).startswith(('4', '5')):
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+def serve(port=DEFAULT_PORT, workers=None, queue_size=16):
+    #Run the service on localhost until interrupted (Ctrl-C or SIGTERM)
+    service = QAService(workers=workers, queue_size=queue_size)
+    print('Starting {} workers...'.format(service.workers))
+    service.warm_up()
+    server = ThreadingHTTPServer(('127.0.0.1', port), _ServiceHandler)
+    server.daemon_threads = True
+    server.service = service
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print('QA service listening on http://127.0.0.1:{} ({} workers, up to {} pending jobs)'.format(
+        server.server_address[1], service.workers, service.max_pending))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print('Shutting down QA service...')
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == "__main__":
+
+    #Set up argument parser and help dialogue
+    parser=argparse.ArgumentParser(
+        description='''Serve mri_quickgifs and percsigchange jobs from a pool of warm worker processes. ''',
+        usage='python3 qa_service.py [--port INT] [--workers INT] [--queue-size INT]')
+    parser.add_argument('--port', help='localhost port to listen on (default: {})'.format(DEFAULT_PORT), type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', help='number of jobs run at once (default: number of cpus)', type=int, default=None)
+    parser.add_argument('--queue-size', help='jobs that may wait for a free worker before submissions are refused (default: 16)',
+                        type=int, default=16)
+    args = parser.parse_args()
+
+    serve(port=args.port, workers=args.workers, queue_size=args.queue_size)
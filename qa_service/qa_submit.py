@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+
+##############################################################
+#Description: thin client for qa_service.py. Submits mri_quickgifs and
+#             percsigchange jobs to a running service, optionally waits
+#             for them to finish, and shows or cancels jobs. Uses only the
+#             standard library, so it starts in a few tens of milliseconds.
+#             When the service's queue is full, submissions are retried
+#             until they are accepted.
+#
+#
+#Usage: python3 qa_submit.py [--url URL] quickgifs [--wait] [options] input_file [output_dir]
+#       python3 qa_submit.py [--url URL] percsigchange [--wait] [--pes all|1,2,3] [options] feat_dir [output_dir]
+#       python3 qa_submit.py [--url URL] status [job_id]
+#       python3 qa_submit.py [--url URL] cancel job_id
+#
+#History: (10/2026) Added warm worker service
+##################################################################
+
+import os, sys
+import json
+import time
+import argparse
+import urllib.error
+import urllib.request
+
+DEFAULT_URL = 'http://127.0.0.1:8765'
+
+#Seconds each status request waits on the service for a job to finish
+WAIT_SECONDS = 10.0
+
+
+def _request(url, method='GET', body=None):
+    #Send a request to the service and return (HTTP status, JSON body,
+    #headers); HTTP errors are returned rather than raised
+    if body is not None:
+        body = json.dumps(body).encode('utf-8')
+    service_request = urllib.request.Request(url, data=body, method=method, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(service_request) as response:
+            return response.status, json.loads(response.read().decode('utf-8')), response.headers
+    except urllib.error.HTTPError as err:
+        return err.code, json.loads(err.read().decode('utf-8') or '{}'), err.headers
+    except urllib.error.URLError as err:
+        raise RuntimeError('Cannot reach the QA service at {} ({})'.format(url, err.reason))
+
+
+def submit(service_url, tool, params, timeout=None):
+    #Submit a job, retrying while the service's queue is full. Returns the
+    #job description.
+    start_time = time.time()
+    reported_full = False
+    while True:
+        status_code, body, headers = _request(service_url.rstrip('/')+'/jobs', method='POST',
+                                              body={'tool': tool, 'params': params})
+        if status_code == 202:
+            return body
+        if status_code != 503:
+            raise RuntimeError('Job refused: {}'.format(body.get('error', status_code)))
+        if timeout is not None and time.time() - start_time > timeout:
+            raise RuntimeError('Timed out waiting for room in the QA service queue')
+        if not reported_full:
+            print('QA service queue is full; waiting to submit...')
+            reported_full = True
+        time.sleep(float(headers.get('Retry-After', 1)))
+
+
+def job_status(service_url, job_id=None, wait=0):
+    #Description of one job, or the service's overall status. With wait,
+    #the service holds the reply until the job finishes (or wait seconds pass).
+    if job_id is None:
+        status_url = service_url.rstrip('/')+'/status'
+    else:
+        status_url = service_url.rstrip('/')+'/jobs/{}?wait={}'.format(job_id, wait)
+    status_code, body, headers = _request(status_url)
+    if status_code != 200:
+        raise RuntimeError(body.get('error', status_code))
+    return body
+
+
+def wait(service_url, job_id, timeout=None):
+    #Wait for a job to finish; returns its final description
+    start_time = time.time()
+    while True:
+        wait_seconds = WAIT_SECONDS
+        if timeout is not None:
+            wait_seconds = max(0.0, min(wait_seconds, timeout - (time.time() - start_time)))
+        job = job_status(service_url, job_id, wait=wait_seconds)
+        if job['status'] in ['done', 'failed', 'cancelled']:
+            return job
+        if timeout is not None and time.time() - start_time >= timeout:
+            raise RuntimeError('Timed out waiting for job {}'.format(job_id))
+
+
+def cancel(service_url, job_id):
+    status_code, body, headers = _request(service_url.rstrip('/')+'/jobs/{}'.format(job_id), method='DELETE')
+    if status_code != 200:
+        raise RuntimeError(body.get('error', status_code))
+    return body
+
+
+def _print_job(job):
+    print('Job {} ({}): {}'.format(job['id'], job['tool'], job['status']))
+    for result_name, result_value in (job.get('result') or {}).items():
+        if isinstance(result_value, list):
+            for result_item in result_value:
+                print('    {}'.format(result_item))
+        elif result_value is not None:
+            print('    {}: {}'.format(result_name, result_value))
+    if job.get('error'):
+        print(job['error'])
+
+
+def _absolute(path):
+    #The service has its own working directory, so paths are sent absolute
+    if path is None:
+        return None
+    return os.path.abspath(path)
+
+
+if __name__ == "__main__":
+
+    #Set up argument parser and help dialogue
+    parser=argparse.ArgumentParser(
+        description='''Submit mri_quickgifs and percsigchange jobs to a running qa_service.py. ''',
+        usage='python3 qa_submit.py [--url URL] {quickgifs,percsigchange,status,cancel} ...')
+    parser.add_argument('--url', help='address of the service (default: {})'.format(DEFAULT_URL), default=DEFAULT_URL)
+    parser.add_argument('--timeout', help='give up after this many seconds of waiting (default: wait indefinitely)',
+                        type=float, default=None)
+    subparsers = parser.add_subparsers(dest='command')
+
+    quickgifs_parser = subparsers.add_parser('quickgifs', help='submit an mri_quickgifs job')
+    quickgifs_parser.add_argument('--wait', help='wait for the job to finish and print its result',
+                                  action='store_const', const=1, default=0)
+    quickgifs_parser.add_argument('--cuttrs', help='set number of trs to exclude (i.e. pre-steady-state trs)', type=int, default=0)
+    quickgifs_parser.add_argument('--float32', help='accumulate the temporal statistics in float32',
+                                  action='store_const', const=1, default=0)
+    quickgifs_parser.add_argument('--max-memory', help='approximate memory budget in MB', type=float, default=None)
+    quickgifs_parser.add_argument('--jobs', help='threads used by the job (default: 1)', type=int, default=1)
+    quickgifs_parser.add_argument('--force', help='ignore cached results and redo everything', action='store_const', const=1, default=0)
+    quickgifs_parser.add_argument('--cache-dir', help='shared directory for cached statistics', default=None)
+    quickgifs_parser.add_argument('--detrend-order', help='order of the polynomial removed before the standard deviation (default: 1)',
+                                  type=int, default=1)
+    quickgifs_parser.add_argument('--preview', help='write small preview reports instead of the full-resolution gifs',
+                                  action='store_const', const=1, default=0)
+    quickgifs_parser.add_argument('--encoder', help='animation format/encoder (default: gif)', default='gif')
+    quickgifs_parser.add_argument('input_file', help='4D .nii or .nii.gz image')
+    quickgifs_parser.add_argument('output_dir', nargs='?', default=None, help='where things will get written (default: the image\'s directory)')
+
+    psc_parser = subparsers.add_parser('percsigchange', help='submit a percsigchange job')
+    psc_parser.add_argument('--wait', help='wait for the job to finish and print its result',
+                            action='store_const', const=1, default=0)
+    psc_parser.add_argument('--pes', help='comma-separated PE indices (index begins at 1), or "all" (default)', default='all')
+    psc_parser.add_argument('--event_height', help='height of a single event, as modeled by FSL', type=float, default=None)
+    psc_parser.add_argument('--uncompressed', help='write .nii images instead of .nii.gz', action='store_true')
+    psc_parser.add_argument('feat_dir', help='.feat directory of the analysis')
+    psc_parser.add_argument('output_dir', nargs='?', default=None, help='where things will get written (default: the feat directory)')
+
+    status_parser = subparsers.add_parser('status', help='show the service status, or one job')
+    status_parser.add_argument('job_id', nargs='?', default=None)
+
+    cancel_parser = subparsers.add_parser('cancel', help='cancel a job that hasn\'t started yet')
+    cancel_parser.add_argument('job_id')
+    args = parser.parse_args()
+
+    try:
+        if args.command in ['quickgifs', 'percsigchange']:
+            if args.command == 'quickgifs':
+                params = {'input_file': _absolute(args.input_file), 'output_dir': _absolute(args.output_dir),
+                          'cuttrs': args.cuttrs, 'float32': args.float32, 'max_memory': args.max_memory,
+                          'jobs': args.jobs, 'force': args.force, 'cache_dir': _absolute(args.cache_dir),
+                          'detrend_order': args.detrend_order, 'preview': args.preview, 'encoder': args.encoder}
+            else:
+                params = {'feat_dir': _absolute(args.feat_dir), 'output_dir': _absolute(args.output_dir),
+                          'pes': args.pes, 'event_height': args.event_height, 'compress': int(not args.uncompressed)}
+            job = submit(args.url, args.command, params, timeout=args.timeout)
+            print('Submitted job {}'.format(job['id']))
+            if args.wait:
+                job = wait(args.url, job['id'], timeout=args.timeout)
+                _print_job(job)
+                if job['status'] != 'done':
+                    sys.exit(1)
+        elif args.command == 'status':
+            if args.job_id is None:
+                print(json.dumps(job_status(args.url), indent=1))
+            else:
+                _print_job(job_status(args.url, args.job_id))
+        elif args.command == 'cancel':
+            _print_job(cancel(args.url, args.job_id))
+        else:
+            parser.print_help()
+            sys.exit(1)
+    except RuntimeError as err:
+        print(err)
+        sys.exit(1)
@@ -0,0 +1,19 @@
+##############################################################
+#Description: pytest setup for the Graner_QA_tools tests. The tools are
+#             scripts rather than packages, so their directories are put on
+#             the import path (as benchmarks/ and qa_service/ do).
+#
+#History: (10/2026) Added tests
+##################################################################
+
+import os, sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+QUICKGIFS_DIR = os.path.join(REPO_DIR, 'mri_quickgifs')
+PERCSIGCHANGE_DIR = os.path.join(REPO_DIR, 'percsigchange')
+DATA_DIR = os.path.join(TESTS_DIR, 'data')
+
+for tool_dir in [QUICKGIFS_DIR, PERCSIGCHANGE_DIR]:
+    if tool_dir not in sys.path:
+        sys.path.insert(0, tool_dir)
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+
+##############################################################
+#Description: (re)generate the percsigchange test fixture in
+#             percsigchange.feat/: a tiny float32 stats/pe1 image, a
+#             mean_func image with zero (outside the brain) voxels and a
+#             two-EV design.mat, plus pe1_percchange_expected.nii.gz, the
+#             percent signal change image for PE 1 made with the original
+#             fslmaths command:
+#                 fslmaths pe1 -mul RANGE -div mean_func -mul 100.0 out
+#             If fslmaths isn't on the path, the same operations are applied
+#             one at a time in float32 (fslmaths' default internal type,
+#             with x/0 set to 0) and the fixture README should say so.
+#
+#Usage: python3 make_percsigchange_fixture.py
+#
+#History: (10/2026) Added tests
+##################################################################
+
+import os
+import shutil
+import subprocess
+import numpy as np
+import nibabel as nib
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+FEAT_DIR = os.path.join(DATA_DIR, 'percsigchange.feat')
+EXPECTED_FILE = os.path.join(DATA_DIR, 'pe1_percchange_expected.nii.gz')
+IMAGE_SHAPE = (5, 4, 3)
+AFFINE = np.diag([3.0, 3.0, 3.5, 1.0])
+
+
+def _write_inputs():
+    rng = np.random.RandomState(1234)
+    if not os.path.exists(os.path.join(FEAT_DIR, 'stats')):
+        os.makedirs(os.path.join(FEAT_DIR, 'stats'))
+
+    #PE estimates of either sign; mean_func is a masked brain image, with
+    #zeros around the edge and low values at the boundary
+    pe_data = (rng.standard_normal(IMAGE_SHAPE)*25).astype(np.float32)
+    mean_func_data = rng.uniform(300, 12000, IMAGE_SHAPE).astype(np.float32)
+    mean_func_data[0] = 0
+    mean_func_data[:, 0, :] = 0
+    mean_func_data[-1, -1, :] = rng.uniform(0.5, 2.0, IMAGE_SHAPE[2])
+    for image_data, image_file in [(pe_data, os.path.join(FEAT_DIR, 'stats', 'pe1.nii.gz')),
+                                   (mean_func_data, os.path.join(FEAT_DIR, 'mean_func.nii.gz'))]:
+        image = nib.Nifti1Image(image_data, AFFINE)
+        image.set_data_dtype(np.float32)
+        nib.save(image, image_file)
+
+    #EV 1 ranges over 1.2345678 (1.23457 once rounded for fslmaths)
+    design_matrix = np.zeros((8, 2))
+    design_matrix[:, 0] = [0, 1.2345678, 0.6, 0, 1.2345678, 0.2, 0, 0.9]
+    design_matrix[:, 1] = rng.standard_normal(8)
+    with open(os.path.join(FEAT_DIR, 'design.mat'), 'w') as fo:
+        fo.write('/NumWaves\t2\n/NumPoints\t8\n/PPheights\t\t1.234568e+00\t1.000000e+00\n\n/Matrix\n')
+        for design_row in design_matrix:
+            fo.write('\t'.join('{:.6e}'.format(x) for x in design_row)+'\t\n')
+    return '{:.5f}'.format(design_matrix[:, 0].max() - design_matrix[:, 0].min())
+
+
+def _fslmaths_steps(pe_file, mean_func_file, str_pe_range):
+    #The fslmaths call, one operation at a time in float32
+    pe_img = nib.load(pe_file)
+    perc_change_data = pe_img.get_fdata(dtype=np.float32) * np.float32(str_pe_range)
+    mean_func_data = nib.load(mean_func_file).get_fdata(dtype=np.float32)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        perc_change_data = perc_change_data / mean_func_data
+    perc_change_data[mean_func_data == 0] = 0
+    perc_change_data = perc_change_data * np.float32(100.0)
+    perc_change_img = nib.Nifti1Image(perc_change_data.astype(np.float32), pe_img.affine, pe_img.header)
+    perc_change_img.set_data_dtype(np.float32)
+    nib.save(perc_change_img, EXPECTED_FILE)
+
+
+if __name__ == "__main__":
+    str_pe_range = _write_inputs()
+    pe_file = os.path.join(FEAT_DIR, 'stats', 'pe1.nii.gz')
+    mean_func_file = os.path.join(FEAT_DIR, 'mean_func.nii.gz')
+    if shutil.which('fslmaths') is not None:
+        subprocess.run(['fslmaths', pe_file, '-mul', str_pe_range, '-div', mean_func_file, '-mul', '100.0', EXPECTED_FILE],
+                       check=True)
+        print('Expected image made with fslmaths: {}'.format(EXPECTED_FILE))
+    else:
+        _fslmaths_steps(pe_file, mean_func_file, str_pe_range)
+        print('fslmaths not found; expected image made with float32 numpy steps: {}'.format(EXPECTED_FILE))
@@ -0,0 +1,54 @@
+##############################################################
+#Description: --help of every command line tool, each in a fresh python
+#             process, must not import the slow optional packages
+#             (nibabel, imageio, Pillow, scipy, pandas).
+#
+#History: (10/2026) Added tests
+##################################################################
+
+import os
+import sys
+import subprocess
+import pytest
+
+from conftest import REPO_DIR
+
+CLI_SCRIPTS = [
+    'mri_quickgifs/mri_quickgifs.py',
+    'mri_quickgifs/mri_quickgifs_batch.py',
+    'mri_quickgifs/mri_quickgifs_metrics.py',
+    'mri_quickgifs/mri_quickgifs_realtime.py',
+    'percsigchange/percsigchange.py',
+    'percsigchange/percsigchange_batch.py',
+    'percsigchange/percsigchange_group.py',
+    'percsigchange/percsigchange_roi.py',
+    'qa_service/qa_service.py',
+    'qa_service/qa_submit.py',
+    ]
+
+SLOW_MODULES = ['nibabel', 'imageio', 'PIL', 'scipy', 'pandas']
+
+#Runs a script as __main__ (as "python script.py --help" would) and then
+#prints the slow modules that were imported
+HELP_DRIVER = '''
+import os, sys, runpy
+script_file = sys.argv[1]
+sys.path.insert(0, os.path.dirname(script_file))
+sys.argv = [script_file, '--help']
+try:
+    runpy.run_path(script_file, run_name='__main__')
+except SystemExit as err:
+    if err.code not in (0, None):
+        raise
+sys.stdout.write('\\nIMPORTED:' + ','.join(x for x in {} if x in sys.modules) + '\\n')
+'''.format(SLOW_MODULES)
+
+
+@pytest.mark.parametrize('script', CLI_SCRIPTS)
+def test_help_skips_slow_imports(script):
+    env = dict(os.environ)
+    env.pop('PYTHONPATH', None)
+    help_run = subprocess.run([sys.executable, '-c', HELP_DRIVER, os.path.join(REPO_DIR, script)],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, universal_newlines=True, check=True)
+    assert 'usage:' in help_run.stdout
+    assert help_run.stdout.rstrip().splitlines()[-1] == 'IMPORTED:'
@@ -0,0 +1,195 @@
+##############################################################
+#Description: the in-process (numpy) percent signal change calculation
+#             against a stored fslmaths-style result (see data/README.md),
+#             and contrast maps against the maps of their PEs.
+#
+#History: (10/2026) Added tests
+##################################################################
+
+import os, sys
+import subprocess
+import numpy as np
+import nibabel as nib
+import pytest
+
+from conftest import DATA_DIR, PERCSIGCHANGE_DIR, QUICKGIFS_DIR
+import percsigchange
+
+FEAT_DIR = os.path.join(DATA_DIR, 'percsigchange.feat')
+EXPECTED_FILE = os.path.join(DATA_DIR, 'pe1_percchange_expected.nii.gz')
+
+
+def _expected():
+    return nib.load(EXPECTED_FILE).get_fdata(dtype=np.float32)
+
+
+def _zero_mean():
+    return nib.load(os.path.join(FEAT_DIR, 'mean_func.nii.gz')).get_fdata(dtype=np.float32) == 0
+
+
+@pytest.mark.parametrize('event_height', [None, 1.2345678])
+def test_numpy_backend_matches_fixture(tmp_path, event_height):
+    #The range comes from design.mat, or is passed (and rounded the same way)
+    perc_change_file = percsigchange.generate_map(FEAT_DIR, 1, output_dir=str(tmp_path), event_height=event_height, backend='numpy')
+    perc_change_img = nib.load(perc_change_file)
+    assert perc_change_img.get_data_dtype() == np.float32
+    assert np.allclose(perc_change_img.affine, nib.load(EXPECTED_FILE).affine)
+    np.testing.assert_allclose(perc_change_img.get_fdata(dtype=np.float32), _expected(), rtol=1e-6, atol=1e-6)
+
+
+def test_zero_mean_voxels_are_zero(tmp_path):
+    zero_mean = _zero_mean()
+    assert zero_mean.any()
+    perc_change_file = percsigchange.generate_map(FEAT_DIR, 1, output_dir=str(tmp_path))
+    perc_change_data = nib.load(perc_change_file).get_fdata()
+    assert np.all(perc_change_data[zero_mean] == 0)
+    assert np.all(np.isfinite(perc_change_data))
+    assert np.all(perc_change_data[~zero_mean] != 0)
+
+
+def test_perc_change_array_stack():
+    #A stack of PEs (along the last axis) gives the single-PE result per PE
+    pe_data = nib.load(os.path.join(FEAT_DIR, 'stats', 'pe1.nii.gz')).get_fdata(dtype=np.float32)
+    mean_func_data = nib.load(os.path.join(FEAT_DIR, 'mean_func.nii.gz')).get_fdata(dtype=np.float32)
+    perc_change_data = percsigchange.perc_change_array(np.stack([pe_data, -pe_data], axis=-1), mean_func_data[..., np.newaxis],
+                                                       [1.2345678, 1.2345678])
+    np.testing.assert_allclose(perc_change_data[..., 0], _expected(), rtol=1e-6, atol=1e-6)
+    np.testing.assert_allclose(perc_change_data[..., 1], -_expected(), rtol=1e-6, atol=1e-6)
+
+
+@pytest.mark.parametrize('uncompressed', [0, 1])
+def test_output_name_follows_uncompressed(tmp_path, uncompressed):
+    command = [sys.executable, os.path.join(PERCSIGCHANGE_DIR, 'percsigchange.py'), FEAT_DIR, '1', str(tmp_path)]
+    if uncompressed:
+        command.insert(2, '--uncompressed')
+    subprocess.run(command, check=True, stdout=subprocess.PIPE)
+    if uncompressed:
+        expected_names = ['pe1_percchange.nii']
+    else:
+        expected_names = ['pe1_percchange.nii.gz']
+    assert sorted(os.listdir(str(tmp_path))) == expected_names
+    perc_change_file = os.path.join(str(tmp_path), expected_names[0])
+    with open(perc_change_file, 'rb') as fi:
+        assert (fi.read(2) == b'\x1f\x8b') == (not uncompressed)
+    np.testing.assert_allclose(nib.load(perc_change_file).get_fdata(dtype=np.float32), _expected(), rtol=1e-6, atol=1e-6)
+
+
+@pytest.mark.parametrize('compress, extension', [(1, '.nii.gz'), (0, '.nii')])
+def test_perc_change_name(compress, extension):
+    for pe_name in ['pe3.nii.gz', 'pe3.nii']:
+        assert percsigchange.perc_change_name(pe_name, '/out', compress=compress) == '/out/pe3_percchange'+extension
+
+
+def test_profiled_stages(tmp_path):
+    #percsigchange uses mri_quickgifs' stage profiler
+    import mri_quickgifs_profile
+    profiler = mri_quickgifs_profile.StageProfiler(enabled=1)
+    percsigchange.generate_map(FEAT_DIR, 1, output_dir=str(tmp_path), profiler=profiler)
+    assert [x['stage'] for x in profiler.report()['stages']] == ['design range', 'load images', 'calculate percent change', 'save image']
+
+
+def test_profile_without_quickgifs_on_path(tmp_path):
+    #Without mri_quickgifs on the path the map is still made, and only
+    #--profile fails; with it, the profile report is written
+    command = [sys.executable, os.path.join(PERCSIGCHANGE_DIR, 'percsigchange.py'), FEAT_DIR, '1']
+    env = dict(os.environ)
+    env.pop('PYTHONPATH', None)
+    for run_name in ['plain', 'failed', 'profiled']:
+        (tmp_path / run_name).mkdir()
+    subprocess.run(command+[str(tmp_path / 'plain')], check=True, stdout=subprocess.PIPE, env=env)
+    assert os.listdir(str(tmp_path / 'plain')) == ['pe1_percchange.nii.gz']
+    failed_run = subprocess.run(command[:2]+['--profile']+command[2:]+[str(tmp_path / 'failed')],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    assert failed_run.returncode != 0
+    assert b'PYTHONPATH' in failed_run.stderr
+    env['PYTHONPATH'] = QUICKGIFS_DIR
+    subprocess.run(command[:2]+['--profile']+command[2:]+[str(tmp_path / 'profiled')], check=True, stdout=subprocess.PIPE, env=env)
+    assert sorted(os.listdir(str(tmp_path / 'profiled'))) == ['pe1_percchange.nii.gz', 'percsigchange_pe1_profile.json']
+
+
+def _write_contrast_feat(feat_dir):
+    #A copy of the fixture with three EVs (PE images of either sign, with
+    #different ranges) and a design.con of three contrasts
+    rng = np.random.RandomState(7)
+    os.makedirs(os.path.join(feat_dir, 'stats'))
+    mean_func_img = nib.load(os.path.join(FEAT_DIR, 'mean_func.nii.gz'))
+    nib.save(mean_func_img, os.path.join(feat_dir, 'mean_func.nii.gz'))
+    for pe_index in [1, 2, 3]:
+        pe_img = nib.Nifti1Image((rng.standard_normal(mean_func_img.shape)*25).astype(np.float32), mean_func_img.affine)
+        pe_img.set_data_dtype(np.float32)
+        nib.save(pe_img, os.path.join(feat_dir, 'stats', 'pe{}.nii.gz'.format(pe_index)))
+    design_matrix = rng.uniform(-1, 1, (8, 3))*[1.0, 0.7, 2.3]
+    with open(os.path.join(feat_dir, 'design.mat'), 'w') as fo:
+        fo.write('/NumWaves\t3\n/NumPoints\t8\n\n/Matrix\n')
+        for design_row in design_matrix:
+            fo.write('\t'.join('{:.6e}'.format(x) for x in design_row)+'\t\n')
+    with open(os.path.join(feat_dir, 'design.con'), 'w') as fo:
+        fo.write('/ContrastName1\tsecond\n/ContrastName2\tfirst-second\n/ContrastName3\tthird-first\n')
+        fo.write('/NumWaves\t3\n/NumContrasts\t3\n\n/Matrix\n')
+        fo.write('0 1 0\n1 -1 0\n-1 0 1\n')
+    return feat_dir
+
+
+def _pe_maps(feat_dir):
+    perc_change_stack = percsigchange.calc_feat_maps(feat_dir)[0]
+    return [perc_change_stack[..., x] for x in range(perc_change_stack.shape[-1])]
+
+
+def test_single_weight_contrast_matches_pe_map(tmp_path):
+    feat_dir = _write_contrast_feat(str(tmp_path / 'contrast.feat'))
+    perc_change_file = percsigchange.generate_contrast_maps(feat_dir, contrast_weights=[[0, 1, 0]], output_dir=str(tmp_path))[0]
+    pe2_file = percsigchange.generate_maps(feat_dir, pe_indices=[2], output_dir=str(tmp_path))[0]
+    assert os.path.basename(perc_change_file) == 'contrast1_percchange.nii.gz'
+    assert os.path.basename(pe2_file) == 'pe2_percchange.nii.gz'
+    perc_change_img = nib.load(perc_change_file)
+    assert perc_change_img.get_data_dtype() == np.float32
+    assert np.allclose(perc_change_img.affine, nib.load(pe2_file).affine)
+    np.testing.assert_allclose(perc_change_img.get_fdata(), nib.load(pe2_file).get_fdata(), rtol=1e-5, atol=1e-5)
+
+
+def test_difference_contrast_matches_pe_maps(tmp_path):
+    feat_dir = _write_contrast_feat(str(tmp_path / 'contrast.feat'))
+    pe_maps = _pe_maps(feat_dir)
+    perc_change_stack = percsigchange.calc_contrast_maps(feat_dir, [[1, -1, 0], [-1, 0, 1]])[0]
+    np.testing.assert_allclose(perc_change_stack[..., 0], pe_maps[0]-pe_maps[1], rtol=1e-5, atol=1e-4)
+    np.testing.assert_allclose(perc_change_stack[..., 1], pe_maps[2]-pe_maps[0], rtol=1e-5, atol=1e-4)
+    assert np.all(perc_change_stack[_zero_mean()] == 0)
+
+
+def test_contrast_reads_only_weighted_pes(tmp_path, monkeypatch):
+    feat_dir = _write_contrast_feat(str(tmp_path / 'contrast.feat'))
+    loaded_files = []
+    original_load = nib.load
+
+    def recording_load(file_name, *args, **kwargs):
+        loaded_files.append(os.path.basename(str(file_name)))
+        return original_load(file_name, *args, **kwargs)
+
+    monkeypatch.setattr(nib, 'load', recording_load)
+    percsigchange.calc_contrast_maps(feat_dir, [[1, 0, -1], [0.5, 0, 0]])
+    assert sorted(loaded_files) == ['mean_func.nii.gz', 'pe1.nii.gz', 'pe3.nii.gz']
+
+
+def test_design_con_contrasts(tmp_path):
+    feat_dir = _write_contrast_feat(str(tmp_path / 'contrast.feat'))
+    contrast_matrix, contrast_names = percsigchange.read_contrasts(os.path.join(feat_dir, 'design.con'))
+    assert contrast_names == ['second', 'first-second', 'third-first']
+    np.testing.assert_array_equal(contrast_matrix, [[0, 1, 0], [1, -1, 0], [-1, 0, 1]])
+    perc_change_files = percsigchange.generate_contrast_maps(feat_dir, con_indices=[3, 1], output_dir=str(tmp_path))
+    assert [os.path.basename(x) for x in perc_change_files] == ['cope3_percchange.nii.gz', 'cope1_percchange.nii.gz']
+    pe_maps = _pe_maps(feat_dir)
+    np.testing.assert_allclose(nib.load(perc_change_files[0]).get_fdata(), pe_maps[2]-pe_maps[0], rtol=1e-5, atol=1e-4)
+    np.testing.assert_allclose(nib.load(perc_change_files[1]).get_fdata(), pe_maps[1], rtol=1e-5, atol=1e-5)
+
+
+def test_batch_contrast_with_leading_negative_weight(tmp_path):
+    #--contrast=-1,0,1 is one argument, so the leading "-" is not read as an option
+    import percsigchange_batch
+    assert percsigchange_batch.parse_weights('-1,0,1') == [-1.0, 0.0, 1.0]
+    assert percsigchange_batch.parse_weights(' 0.5, -0.5 ,') == [0.5, -0.5]
+    feat_dir = _write_contrast_feat(str(tmp_path / 'contrast.feat'))
+    command = [sys.executable, os.path.join(PERCSIGCHANGE_DIR, 'percsigchange_batch.py'), '--contrast=-1,0,1', '--workers', '1', feat_dir]
+    subprocess.run(command, check=True, stdout=subprocess.PIPE)
+    pe_maps = _pe_maps(feat_dir)
+    perc_change_data = nib.load(os.path.join(feat_dir, 'contrast1_percchange.nii.gz')).get_fdata()
+    np.testing.assert_allclose(perc_change_data, pe_maps[2]-pe_maps[0], rtol=1e-5, atol=1e-4)
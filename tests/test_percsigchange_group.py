@@ -0,0 +1,79 @@
+##############################################################
+#Description: the 4D group image of percsigchange_group against the
+#             per-subject maps of percsigchange, in the order given, for
+#             memory-mapped .nii and compressed .nii.gz output, plus the
+#             subject list sidecar.
+#
+#History: (10/2026) Added tests
+##################################################################
+
+import os
+import shutil
+import numpy as np
+import nibabel as nib
+import pytest
+
+from conftest import DATA_DIR
+import percsigchange
+import percsigchange_group
+
+FEAT_DIR = os.path.join(DATA_DIR, 'percsigchange.feat')
+PE_SCALES = {'sub-03': 1.0, 'sub-01': -0.5, 'sub-02': 2.5}
+
+
+def _subject_feats(base_dir):
+    #Copies of the fixture with different PE 1 images, in a non-sorted order
+    feat_dirs = []
+    for subject, pe_scale in PE_SCALES.items():
+        feat_dir = os.path.join(base_dir, '{}.feat'.format(subject))
+        shutil.copytree(FEAT_DIR, feat_dir)
+        pe_file = os.path.join(feat_dir, 'stats', 'pe1.nii.gz')
+        pe_img = nib.load(pe_file)
+        nib.save(nib.Nifti1Image((pe_img.get_fdata()*pe_scale).astype(np.float32), pe_img.affine), pe_file)
+        feat_dirs.append(feat_dir)
+    return feat_dirs
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+@pytest.mark.parametrize('extension', ['.nii', '.nii.gz'])
+def test_group_image_matches_subject_maps(tmp_path, extension, workers):
+    feat_dirs = _subject_feats(str(tmp_path))
+    output_file = str(tmp_path / ('group_pe1'+extension))
+    group_file, subject_file = percsigchange_group.generate_group_map(feat_dirs, 1, output_file, workers=workers)
+    assert group_file == output_file
+    assert subject_file == str(tmp_path / 'group_pe1_subjects.txt')
+
+    with open(output_file, 'rb') as fi:
+        assert (fi.read(2) == b'\x1f\x8b') == extension.endswith('.gz')
+    group_img = nib.load(output_file)
+    assert group_img.get_data_dtype() == np.float32
+    np.testing.assert_array_equal(group_img.affine, nib.load(os.path.join(FEAT_DIR, 'stats', 'pe1.nii.gz')).affine)
+    group_data = group_img.get_fdata(dtype=np.float32)
+    assert group_data.shape == (5, 4, 3, len(feat_dirs))
+    if extension == '.nii':
+        #The memory-mapped file holds exactly the header and the data
+        assert os.path.getsize(output_file) == int(group_img.dataobj.offset) + group_data.size*4
+
+    for volume_num, feat_dir in enumerate(feat_dirs):
+        map_dir = str(tmp_path / 'map{}'.format(volume_num))
+        os.mkdir(map_dir)
+        subject_map = nib.load(percsigchange.generate_map(feat_dir, 1, output_dir=map_dir)).get_fdata(dtype=np.float32)
+        np.testing.assert_array_equal(group_data[..., volume_num], subject_map)
+
+    with open(subject_file, 'r') as fi:
+        assert fi.read() == ''.join('{}\t{}\n'.format(x, y) for x, y in enumerate(feat_dirs))
+
+
+def test_subject_maps_written(tmp_path):
+    feat_dirs = _subject_feats(str(tmp_path))
+    output_file = str(tmp_path / 'group_pe1.nii')
+    percsigchange_group.generate_group_map(feat_dirs, 1, output_file, subject_maps=1)
+    group_data = nib.load(output_file).get_fdata(dtype=np.float32)
+    for volume_num, feat_dir in enumerate(feat_dirs):
+        subject_map = nib.load(os.path.join(feat_dir, 'pe1_percchange.nii.gz')).get_fdata(dtype=np.float32)
+        np.testing.assert_array_equal(group_data[..., volume_num], subject_map)
+
+
+def test_bad_output_name(tmp_path):
+    with pytest.raises(RuntimeError):
+        percsigchange_group.generate_group_map(_subject_feats(str(tmp_path)), 1, str(tmp_path / 'group.img'))
@@ -0,0 +1,83 @@
+##############################################################
+#Description: ROI extraction of percsigchange_roi (only the ROI voxels
+#             are read and calculated) against the full-brain maps of
+#             percsigchange.generate_maps.
+#
+#History: (10/2026) Added tests
+##################################################################
+
+import os
+import shutil
+import numpy as np
+import nibabel as nib
+import pytest
+
+from conftest import DATA_DIR
+import percsigchange
+import percsigchange_roi
+
+FEAT_DIR = os.path.join(DATA_DIR, 'percsigchange.feat')
+
+
+def _two_pe_feat(feat_dir):
+    #The fixture with a PE image for its second EV as well
+    shutil.copytree(FEAT_DIR, feat_dir)
+    pe1_img = nib.load(os.path.join(feat_dir, 'stats', 'pe1.nii.gz'))
+    pe2_data = (np.random.RandomState(8).standard_normal(pe1_img.shape)*40).astype(np.float32)
+    nib.save(nib.Nifti1Image(pe2_data, pe1_img.affine), os.path.join(feat_dir, 'stats', 'pe2.nii.gz'))
+    return feat_dir
+
+
+def _write_rois(roi_dir):
+    #A binary mask (including some voxels where mean_func is zero) and an
+    #atlas with three regions, one of which is only outside the brain
+    mean_func_img = nib.load(os.path.join(FEAT_DIR, 'mean_func.nii.gz'))
+    mask_data = np.zeros(mean_func_img.shape, dtype=np.uint8)
+    mask_data[:3, :3, 1:] = 1
+    atlas_data = np.zeros(mean_func_img.shape, dtype=np.int16)
+    atlas_data[1:, 1:, 0] = 2
+    atlas_data[2:, :, 2] = 5
+    atlas_data[0, 2:, :] = 7
+    roi_files = [os.path.join(roi_dir, 'mask.nii.gz'), os.path.join(roi_dir, 'atlas.nii')]
+    nib.save(nib.Nifti1Image(mask_data, mean_func_img.affine), roi_files[0])
+    nib.save(nib.Nifti1Image(atlas_data, mean_func_img.affine), roi_files[1])
+    return roi_files, {'mask': mask_data == 1, 'atlas:2': atlas_data == 2, 'atlas:5': atlas_data == 5, 'atlas:7': atlas_data == 7}
+
+
+@pytest.mark.parametrize('event_height', [None, 0.8])
+def test_rois_match_full_maps(tmp_path, event_height):
+    feat_dir = _two_pe_feat(str(tmp_path / 'run.feat'))
+    roi_files, roi_masks = _write_rois(str(tmp_path))
+    rois, roi_shape = percsigchange_roi.load_rois(roi_files)
+    assert [x[0] for x in rois] == ['mask', 'atlas:2', 'atlas:5', 'atlas:7']
+
+    table_rows = percsigchange_roi.extract_feat_rois(feat_dir, rois, roi_shape, event_height=event_height)
+    map_dir = str(tmp_path / 'maps')
+    os.mkdir(map_dir)
+    perc_change_files = percsigchange.generate_maps(feat_dir, output_dir=map_dir, event_height=event_height)
+    nonzero_mean = nib.load(os.path.join(FEAT_DIR, 'mean_func.nii.gz')).get_fdata() != 0
+
+    assert len(table_rows) == len(rois)*2
+    #The mask and atlas region 5 overlap voxels where mean_func is zero
+    for roi_name in ['mask', 'atlas:5']:
+        assert 0 < (roi_masks[roi_name] & nonzero_mean).sum() < roi_masks[roi_name].sum()
+    for feat_name, pe_index, roi_name, n_voxels, mean_psc, median_psc in table_rows:
+        assert feat_name == feat_dir
+        roi_voxels = roi_masks[roi_name] & nonzero_mean
+        assert n_voxels == roi_voxels.sum()
+        if roi_name == 'atlas:7':
+            #Only voxels outside the brain: nothing left to average
+            assert n_voxels == 0
+            assert np.isnan(mean_psc) and np.isnan(median_psc)
+            continue
+        map_voxels = nib.load(perc_change_files[pe_index-1]).get_fdata()[roi_voxels]
+        np.testing.assert_allclose(mean_psc, map_voxels.mean(), rtol=1e-6)
+        np.testing.assert_allclose(median_psc, np.median(map_voxels), rtol=1e-6)
+
+
+def test_missing_design_mat(tmp_path):
+    feat_dir = _two_pe_feat(str(tmp_path / 'run.feat'))
+    os.remove(os.path.join(feat_dir, 'design.mat'))
+    rois, roi_shape = percsigchange_roi.load_rois(_write_rois(str(tmp_path))[0])
+    with pytest.raises(RuntimeError, match='design.mat'):
+        percsigchange_roi.extract_feat_rois(feat_dir, rois, roi_shape)
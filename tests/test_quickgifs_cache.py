@@ -0,0 +1,152 @@
+##############################################################
+#Description: cached reruns of mri_quickgifs.main: only the missing outputs
+#             are redone, with any number of --jobs.
+#
+#History: (10/2026) Added tests
+##################################################################
+
+import os
+import re
+import json
+import time
+import numpy as np
+import nibabel as nib
+import pytest
+
+import mri_quickgifs
+
+
+def _write_series(input_file):
+    #Small int16 4D series with a drift, so every statistic is nonzero
+    rng = np.random.RandomState(0)
+    series_data = 1000 + 50*rng.standard_normal((10, 8, 6, 14))
+    series_data += np.linspace(0, 20, 14)
+    nib.Nifti1Image(series_data.astype(np.int16), np.eye(4)).to_filename(input_file)
+
+
+def _run(input_file, output_dir, jobs):
+    return mri_quickgifs.main(2, input_file, 0, output_dir, jobs=jobs)
+
+
+@pytest.mark.parametrize('jobs', [1, 2, 0])
+@pytest.mark.parametrize('removed_output', ['metrics', 'html'])
+def test_cached_rerun_with_every_gif_present(tmp_path, capsys, jobs, removed_output):
+    input_file = str(tmp_path / 's.nii')
+    _write_series(input_file)
+    output_dir = str(tmp_path / 'out')
+    os.mkdir(output_dir)
+    output_html = _run(input_file, output_dir, jobs)
+    quickgifs_dir = os.path.dirname(output_html)
+    removed_file = {'metrics': os.path.join(quickgifs_dir, 'mriquickgifs_s_metrics.json'),
+                    'html': output_html}[removed_output]
+    gif_dir = os.path.join(quickgifs_dir, 'pictures_gifs')
+    gif_times = dict((x, os.path.getmtime(os.path.join(gif_dir, x))) for x in os.listdir(gif_dir))
+    os.remove(removed_file)
+    capsys.readouterr()
+
+    assert _run(input_file, output_dir, jobs) == output_html
+    assert 'Using cached statistics' in capsys.readouterr().out
+    assert os.path.exists(removed_file)
+    #No gif was rewritten
+    assert gif_times == dict((x, os.path.getmtime(os.path.join(gif_dir, x))) for x in os.listdir(gif_dir))
+
+
+def test_cached_rerun_redoes_missing_gif(tmp_path):
+    input_file = str(tmp_path / 's.nii')
+    _write_series(input_file)
+    output_dir = str(tmp_path / 'out')
+    os.mkdir(output_dir)
+    output_html = _run(input_file, output_dir, 2)
+    gif_dir = os.path.join(os.path.dirname(output_html), 'pictures_gifs')
+    gif_file = os.path.join(gif_dir, sorted(os.listdir(gif_dir))[0])
+    with open(gif_file, 'rb') as fi:
+        gif_bytes = fi.read()
+    os.remove(gif_file)
+
+    _run(input_file, output_dir, 2)
+    with open(gif_file, 'rb') as fi:
+        assert fi.read() == gif_bytes
+
+
+def test_up_to_date_rerun_profile(tmp_path):
+    #The profile report of a skipped rerun includes the closed cache check stage
+    input_file = str(tmp_path / 's.nii')
+    _write_series(input_file)
+    output_dir = str(tmp_path / 'out')
+    os.mkdir(output_dir)
+    output_html = _run(input_file, output_dir, 1)
+    mri_quickgifs.main(2, input_file, 0, output_dir, profile=1)
+    with open(os.path.join(os.path.dirname(output_html), 'mriquickgifs_s_profile.json'), 'r') as fo:
+        report = json.load(fo)
+    assert [x['stage'] for x in report['stages']] == ['load header', 'cache check']
+
+
+def _linked_files(output_html):
+    with open(output_html, 'r') as fo:
+        html_text = fo.read()
+    return sorted(set(re.findall(r'pictures_gifs.([\w.]+?\.(?:gif|png|webp|mp4))', html_text)))
+
+
+def test_encoder_switch_rewrites_report(tmp_path, capsys):
+    #gif -> apng -> gif: the last run links the gifs again
+    input_file = str(tmp_path / 's.nii')
+    _write_series(input_file)
+    output_dir = str(tmp_path / 'out')
+    os.mkdir(output_dir)
+    gif_links = None
+    for encoder in ['gif', 'apng', 'gif']:
+        capsys.readouterr()
+        output_html = mri_quickgifs.main(2, input_file, 0, output_dir, encoder=encoder)
+        run_text = capsys.readouterr().out
+        assert 'up to date' not in run_text
+        linked_files = _linked_files(output_html)
+        assert len(linked_files) == 12
+        extension = {'gif': '.gif', 'apng': '.png'}[encoder]
+        assert all([x.endswith(extension) for x in linked_files])
+        assert all([os.path.exists(os.path.join(os.path.dirname(output_html), 'pictures_gifs', x)) for x in linked_files])
+        with open(os.path.join(os.path.dirname(output_html), 'mriquickgifs_s_metrics.json'), 'r') as fo:
+            assert json.load(fo)['encoding']['encoder'] == encoder
+        if gif_links is None:
+            gif_links = linked_files
+    assert linked_files == gif_links
+    assert 'Using cached statistics' in run_text
+
+    #A fourth run with the same encoder is skipped
+    mri_quickgifs.main(2, input_file, 0, output_dir, encoder='gif')
+    assert 'up to date' in capsys.readouterr().out
+
+
+def test_encoder_switch_rewrites_same_name_animations(tmp_path):
+    #gif and gif-optimized files share names, so switching rewrites them
+    input_file = str(tmp_path / 's.nii')
+    _write_series(input_file)
+    output_dir = str(tmp_path / 'out')
+    os.mkdir(output_dir)
+    output_html = mri_quickgifs.main(2, input_file, 0, output_dir, encoder='gif')
+    gif_dir = os.path.join(os.path.dirname(output_html), 'pictures_gifs')
+    gif_times = dict((x, os.path.getmtime(os.path.join(gif_dir, x))) for x in os.listdir(gif_dir))
+    time.sleep(0.01)
+    mri_quickgifs.main(2, input_file, 0, output_dir, encoder='gif-optimized')
+    assert all([os.path.getmtime(os.path.join(gif_dir, x)) > y for x, y in gif_times.items()])
+
+
+def test_preview_switch_both_ways(tmp_path, capsys):
+    input_file = str(tmp_path / 's.nii')
+    _write_series(input_file)
+    output_dir = str(tmp_path / 'out')
+    os.mkdir(output_dir)
+    for preview in [0, 1, 0, 1]:
+        capsys.readouterr()
+        output_html = mri_quickgifs.main(2, input_file, 0, output_dir, preview=preview)
+        run_text = capsys.readouterr().out
+        assert 'up to date' not in run_text
+        linked_files = _linked_files(output_html)
+        if preview:
+            assert len(linked_files) == 6
+            assert len([x for x in linked_files if '_preview_' in x]) == 3
+            assert len([x for x in linked_files if x.endswith('_sheet.png')]) == 3
+        else:
+            assert len(linked_files) == 12
+            assert not [x for x in linked_files if '_preview_' in x or x.endswith('_sheet.png')]
+    #Only the first run read the input
+    assert 'Using cached statistics' in run_text
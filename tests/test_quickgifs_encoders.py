@@ -0,0 +1,48 @@
+##############################################################
+#Description: the gif-optimized encoder against the default gif writer:
+#             both files are decoded and must show the same frames.
+#
+#History: (10/2026) Added tests
+##################################################################
+
+import numpy as np
+import pytest
+from PIL import Image, ImageSequence
+
+import mri_quickgifs
+import mri_quickgifs_encoders as mqenc
+
+
+def _decode(gif_file):
+    return np.array([np.array(frame.convert('L')) for frame in ImageSequence.Iterator(Image.open(gif_file))])
+
+
+def _merge_repeats(gray_frames):
+    #Both writers store a run of identical frames as one longer frame
+    keep = [0] + [i for i in range(1, len(gray_frames)) if not np.array_equal(gray_frames[i], gray_frames[i-1])]
+    return gray_frames[keep]
+
+
+def _frame_sets():
+    rng = np.random.RandomState(5)
+    series_data = 600 + 30*rng.standard_normal((14, 12, 9, 11))
+    series_data[:3] = 0
+    series_data[:, :, 4, 5] += 200
+    mean_data = series_data.mean(axis=3)
+    stdev_data = series_data.std(axis=3)
+    return {
+        'mean': mri_quickgifs._build_frames(mean_data, 3),
+        'snr': mri_quickgifs._build_frames(mean_data/np.where(stdev_data == 0, 1, stdev_data), 2),
+        'movie': mri_quickgifs._build_frames(series_data[:, 6, :, :], 3, prog_rows_flag=1),
+        'few levels': mri_quickgifs._build_frames(np.round(mean_data/300), 1),
+        }
+
+
+@pytest.mark.parametrize('frame_set', ['mean', 'snr', 'movie', 'few levels'])
+def test_gif_optimized_matches_gif(tmp_path, frame_set):
+    frames = _frame_sets()[frame_set]
+    gif_file = mqenc.encode_frames(frames, str(tmp_path / 'default'), encoder='gif')[0]
+    optimized_file = mqenc.encode_frames(frames, str(tmp_path / 'optimized'), encoder='gif-optimized')[0]
+    optimized_frames = _decode(optimized_file)
+    assert np.array_equal(optimized_frames, _decode(gif_file))
+    assert np.array_equal(optimized_frames, _merge_repeats(frames[..., 0]))
@@ -0,0 +1,131 @@
+##############################################################
+#Description: job dispatch of the mri_quickgifs GUI, run without a display:
+#             the window's widgets are replaced by small stand-ins and
+#             mri_quickgifs.main by a job that waits to be released.
+#
+#History: (10/2026) Added tests
+##################################################################
+
+import time
+import queue
+import threading
+import collections
+import pytest
+
+pytest.importorskip('tkinter')
+import mri_quickgifs_gui as mqgui
+
+
+class _Var():
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class _List():
+    def __init__(self):
+        self.items = []
+
+    def insert(self, index, item):
+        if index == 'end':
+            self.items.append(item)
+        else:
+            self.items.insert(index, item)
+
+    def delete(self, index):
+        del self.items[index]
+
+    def curselection(self):
+        return self.selection
+
+
+class _Window():
+    def after(self, ms, callback):
+        pass
+
+
+@pytest.fixture
+def gui(monkeypatch):
+    #A GUI whose jobs run until their input file's event is set
+    release = collections.defaultdict(threading.Event)
+    started = []
+
+    def fake_main(cuttrs, raw_input_file, save_int, output_dir, progress=None):
+        started.append(raw_input_file)
+        while not release[raw_input_file].wait(0.01):
+            progress('statistics', 0.5)
+
+    monkeypatch.setattr(mqgui.mquick, 'main', fake_main)
+    monkeypatch.setattr(mqgui.tk, 'END', 'end')
+    gui = mqgui.quickgifs_gui.__new__(mqgui.quickgifs_gui)
+    gui.window = _Window()
+    gui.jobs = []
+    gui.pending = collections.deque()
+    gui.num_running = 0
+    gui.max_running = 1
+    gui.events = queue.Queue()
+    gui.inputfile_var = _Var('')
+    gui.dummytr_var = _Var('0')
+    gui.save_var = _Var(0)
+    gui.outdir_var = _Var('/tmp')
+    gui.workers_var = _Var('1')
+    gui.jobs_list = _List()
+    gui.release = release
+    gui.started = started
+    yield gui
+    for job in gui.jobs:
+        job.cancel_event.set()
+        release[job.raw_input_file].set()
+        if job.thread is not None:
+            job.thread.join()
+
+
+def _poll_until(gui, condition):
+    for attempt in range(500):
+        gui.poll_jobs()
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError('Timed out waiting for the GUI jobs')
+
+
+def test_parallel_runs_change_applies_to_queued_jobs(gui):
+    gui.inputfile_var.set('a.nii;b.nii;c.nii;d.nii')
+    gui.gui_run_btn()
+    _poll_until(gui, lambda: gui.started == ['a.nii'])
+    assert [x.raw_input_file for x in gui.pending] == ['b.nii', 'c.nii', 'd.nii']
+
+    #Raising the value starts more of the queued jobs at the next poll
+    gui.workers_var.set('3')
+    _poll_until(gui, lambda: sorted(gui.started) == ['a.nii', 'b.nii', 'c.nii'])
+    assert gui.num_running == 3
+
+    #Lowering it (or an invalid value) lets the running jobs finish first
+    gui.workers_var.set('1')
+    gui.release['a.nii'].set()
+    gui.release['b.nii'].set()
+    _poll_until(gui, lambda: gui.num_running == 1)
+    assert 'd.nii' not in gui.started
+    gui.workers_var.set('x')
+    gui.release['c.nii'].set()
+    _poll_until(gui, lambda: 'd.nii' in gui.started)
+    gui.release['d.nii'].set()
+    _poll_until(gui, lambda: gui.num_running == 0)
+    assert [x.status for x in gui.jobs] == ['done']*4
+
+
+def test_cancel_queued_and_running_jobs(gui):
+    gui.inputfile_var.set('a.nii;b.nii')
+    gui.gui_run_btn()
+    _poll_until(gui, lambda: gui.started == ['a.nii'])
+    gui.jobs_list.selection = (0, 1)
+    gui.gui_cancel_btn()
+    assert [x.status for x in gui.jobs] == ['cancelling', 'cancelled']
+    _poll_until(gui, lambda: gui.num_running == 0)
+    assert [x.status for x in gui.jobs] == ['cancelled', 'cancelled']
+    assert gui.started == ['a.nii']
@@ -0,0 +1,92 @@
+##############################################################
+#Description: the per-volume QC series of mri_quickgifs_metrics against a
+#             direct calculation on the whole series, and undefined summary
+#             values written as valid JSON (null).
+#
+#History: (10/2026) Added tests
+##################################################################
+
+import json
+import numpy as np
+import pytest
+
+import mri_quickgifs_metrics as mqmetrics
+
+
+def _reference_series(series_data):
+    mask = mqmetrics.brain_mask(series_data[..., 0].astype(np.float64))
+    mask_data = series_data[mask].astype(np.float64)
+    slice_index = np.nonzero(mask)[2]
+    slice_means = np.zeros((series_data.shape[2], series_data.shape[3]))
+    for slice_num in range(series_data.shape[2]):
+        if (slice_index == slice_num).any():
+            slice_means[slice_num] = mask_data[slice_index == slice_num].mean(axis=0)
+    dvars = np.concatenate(([np.nan], np.sqrt(np.mean(np.diff(mask_data, axis=1)**2, axis=0))))
+    return {'global_signal': mask_data.mean(axis=0), 'dvars': dvars, 'slice_means': slice_means}
+
+
+@pytest.mark.parametrize('dtype', [np.int16, np.float32, np.float64])
+@pytest.mark.parametrize('chunk_sizes', [[23], [1]*23, [5, 1, 9, 8]])
+def test_series_match_reference(dtype, chunk_sizes):
+    rng = np.random.RandomState(3)
+    series_data = 800 + 40*rng.standard_normal((9, 7, 6, 23))
+    series_data[0] = 0
+    series_data[:, :, -1] = 0
+    series_data = series_data.astype(dtype)
+    volume_metrics = mqmetrics.VolumeMetrics(series_data.shape[:3])
+    first_vol = 0
+    for chunk_size in chunk_sizes:
+        chunk = series_data[..., first_vol:first_vol+chunk_size]
+        if chunk_size == 1:
+            chunk = chunk[..., 0]
+        volume_metrics.update(chunk)
+        first_vol += chunk_size
+
+    series = volume_metrics.series()
+    reference = _reference_series(series_data)
+    for series_name in ['global_signal', 'dvars', 'slice_means']:
+        np.testing.assert_allclose(series[series_name], reference[series_name], rtol=1e-5, atol=1e-6)
+    #Slices without mask voxels have zero means
+    assert np.all(series['slice_means'][-1] == 0)
+
+
+def _summarize_series(series_data):
+    volume_metrics = mqmetrics.VolumeMetrics(series_data.shape[:3])
+    volume_metrics.update(series_data)
+    mean_image = series_data.mean(axis=3)
+    stdev_image = series_data.std(axis=3)
+    tsnr_image = np.zeros(mean_image.shape)
+    np.divide(mean_image, stdev_image, out=tsnr_image, where=stdev_image!=0)
+    return mqmetrics.summarize(mean_image, stdev_image, tsnr_image, volume_metrics.series())
+
+
+def _reject_constant(constant):
+    raise ValueError('Invalid JSON constant: {}'.format(constant))
+
+
+@pytest.mark.parametrize('case', ['empty mask', 'single volume'])
+def test_undefined_metrics_are_null(tmp_path, case):
+    rng = np.random.RandomState(6)
+    if case == 'empty mask':
+        series_data = np.zeros((6, 5, 4, 8))
+        undefined_names = ['median_tsnr', 'mean_tsnr', 'median_stdev', 'global_signal_cv']
+    else:
+        series_data = 800 + 40*rng.standard_normal((6, 5, 4, 1))
+        undefined_names = ['mean_dvars', 'max_dvars']
+    metrics = _summarize_series(series_data)
+    for metric_name in undefined_names:
+        assert metrics[metric_name] is None
+    metrics_file = mqmetrics.write_metrics(metrics, str(tmp_path / 'metrics.json'))
+    #Strict JSON: NaN and Infinity are not allowed
+    with open(metrics_file, 'r') as fi:
+        assert json.load(fi, parse_constant=_reject_constant) == metrics
+    assert mqmetrics.format_value(None) == 'n/a'
+
+    #Runs with undefined values can still be gathered into a table
+    aggregate_rows = mqmetrics.aggregate([metrics_file]*3, str(tmp_path / 'table.csv'))
+    assert all(x[undefined_names[0]] is None for x in aggregate_rows)
+
+
+def test_write_metrics_rejects_nan(tmp_path):
+    with pytest.raises(ValueError):
+        mqmetrics.write_metrics({'median_tsnr': float('nan')}, str(tmp_path / 'metrics.json'))
@@ -0,0 +1,151 @@
+##############################################################
+#Description: mri_quickgifs_realtime with a directory of per-volume files
+#             and with a 4D .nii file that volumes are appended to: the
+#             volumes are picked up as they arrive, and the running (Welford)
+#             mean and variance match numpy on the final cut series.
+#
+#History: (10/2026) Added tests
+##################################################################
+
+import os
+import numpy as np
+import nibabel as nib
+import pytest
+
+import mri_quickgifs_realtime as mqrt
+
+VOL_SHAPE = (8, 7, 5)
+NUM_VOLS = 15
+CUTTRS = 2
+AFFINE = np.diag([2.0, 2.5, 3.0, 1.0])
+
+
+def _series():
+    #int16 series with a drift and a constant voxel
+    rng = np.random.RandomState(11)
+    series_data = rng.uniform(600, 2500, VOL_SHAPE+(1,)) + np.linspace(0, 25, NUM_VOLS) + 15*rng.standard_normal(VOL_SHAPE+(NUM_VOLS,))
+    series_data[0, 0, 0] = 900
+    return np.round(series_data).astype(np.int16)
+
+
+def _check_stats(realtime_qc, series_data):
+    #Welford statistics against numpy on the whole cut series
+    cut_data = series_data[..., CUTTRS:].astype(np.float64)
+    assert realtime_qc.num_seen == series_data.shape[3]
+    assert realtime_qc.num_used() == cut_data.shape[3]
+    mean_data, stdev_data, tsnr_data = realtime_qc.stats.finalize()
+    np.testing.assert_allclose(mean_data, cut_data.mean(axis=3), rtol=1e-12)
+    np.testing.assert_allclose(stdev_data**2, cut_data.var(axis=3), rtol=1e-9, atol=1e-9)
+    assert tsnr_data[0, 0, 0] == 0
+    np.testing.assert_allclose(tsnr_data[1:], mean_data[1:]/stdev_data[1:], rtol=1e-12)
+    np.testing.assert_array_equal(np.stack(realtime_qc.center_z_slices, axis=2), series_data[:, :, 2, CUTTRS:])
+
+
+def _add_new_volumes(source, realtime_qc, expected_new):
+    volumes = source.new_volumes()
+    assert len(volumes) == expected_new
+    for volume in volumes:
+        realtime_qc.add_volume(volume)
+
+
+def test_welford_matches_numpy():
+    series_data = np.random.RandomState(3).standard_normal((4, 3, 2, 50))*30 + 1e4
+    welford_stats = mqrt._WelfordStats(series_data.shape[:3])
+    for vol_num in range(series_data.shape[3]):
+        welford_stats.update(series_data[..., vol_num])
+        mean_data, stdev_data, tsnr_data = welford_stats.finalize()
+        np.testing.assert_allclose(mean_data, series_data[..., :vol_num+1].mean(axis=3), rtol=1e-12)
+        np.testing.assert_allclose(stdev_data, series_data[..., :vol_num+1].std(axis=3), rtol=1e-7, atol=1e-9)
+    with pytest.raises(RuntimeError):
+        mqrt._WelfordStats((2, 2, 2)).finalize()
+
+
+def test_volume_directory(tmp_path):
+    series_data = _series()
+    input_dir = tmp_path / 'run1'
+    input_dir.mkdir()
+    (input_dir / 'notes.txt').write_text('not an image')
+    source = mqrt._VolumeDirSource(str(input_dir))
+    realtime_qc = mqrt.RealtimeQuickgifs(str(tmp_path / 'out'), 'run1', (2.0, 2.5, 3.0), cuttrs=CUTTRS)
+    assert source.new_volumes() == []
+
+    #Volumes arrive in batches, compressed or not; a file that is still
+    #being written is left for the next call
+    vol_files = [str(input_dir / 'vol{:03d}.nii{}'.format(x, ['', '.gz'][x % 2])) for x in range(NUM_VOLS)]
+    for vol_num in range(6):
+        nib.Nifti1Image(series_data[..., vol_num], AFFINE).to_filename(vol_files[vol_num])
+    nib.Nifti1Image(series_data[..., 6], AFFINE).to_filename(vol_files[6])
+    with open(vol_files[6], 'rb') as fi:
+        complete_bytes = fi.read()
+    with open(vol_files[6], 'wb') as fo:
+        fo.write(complete_bytes[:len(complete_bytes)//2])
+    _add_new_volumes(source, realtime_qc, 6)
+    with open(vol_files[6], 'wb') as fo:
+        fo.write(complete_bytes)
+    for vol_num in range(7, NUM_VOLS):
+        nib.Nifti1Image(series_data[..., vol_num], AFFINE).to_filename(vol_files[vol_num])
+    _add_new_volumes(source, realtime_qc, NUM_VOLS-6)
+    _add_new_volumes(source, realtime_qc, 0)
+    assert tuple(source.voxel_sizes()) == (2.0, 2.5, 3.0)
+    _check_stats(realtime_qc, series_data)
+
+
+def test_appended_file(tmp_path):
+    #The header already has the final length; the data is appended in
+    #pieces, including part of a volume
+    series_data = _series()
+    complete_file = str(tmp_path / 'complete.nii')
+    series_img = nib.Nifti1Image(series_data, AFFINE)
+    series_img.header.set_slope_inter(1.0, 0.0)
+    series_img.to_filename(complete_file)
+    with open(complete_file, 'rb') as fi:
+        complete_bytes = fi.read()
+    data_offset = int(nib.load(complete_file).dataobj.offset)
+    vol_bytes = int(np.prod(VOL_SHAPE))*2
+    input_file = str(tmp_path / 'run1.nii')
+    with open(input_file, 'wb') as fo:
+        fo.write(complete_bytes[:data_offset+4*vol_bytes+vol_bytes//3])
+
+    source = mqrt._AppendedFileSource(input_file)
+    realtime_qc = mqrt.RealtimeQuickgifs(str(tmp_path / 'out'), 'run1', source.voxel_sizes(), cuttrs=CUTTRS)
+    _add_new_volumes(source, realtime_qc, 4)
+    with open(input_file, 'ab') as fo:
+        fo.write(complete_bytes[data_offset+4*vol_bytes+vol_bytes//3:data_offset+9*vol_bytes])
+    _add_new_volumes(source, realtime_qc, 5)
+    _add_new_volumes(source, realtime_qc, 0)
+    with open(input_file, 'ab') as fo:
+        fo.write(complete_bytes[data_offset+9*vol_bytes:])
+    _add_new_volumes(source, realtime_qc, NUM_VOLS-9)
+    _check_stats(realtime_qc, series_data)
+
+
+def test_appended_file_scaling(tmp_path):
+    #scl_slope and scl_inter are applied to each volume read
+    series_data = _series()
+    input_file = str(tmp_path / 'run1.nii')
+    series_img = nib.Nifti1Image(series_data, AFFINE)
+    series_img.header.set_slope_inter(0.5, 20.0)
+    series_img.to_filename(input_file)
+    volumes = mqrt._AppendedFileSource(input_file).new_volumes()
+    np.testing.assert_allclose(np.stack(volumes, axis=3), series_data*0.5 + 20.0)
+
+
+@pytest.mark.parametrize('input_kind', ['directory', 'appended'])
+def test_run_realtime(tmp_path, capsys, input_kind):
+    series_data = _series()
+    if input_kind == 'directory':
+        input_path = str(tmp_path / 'run1')
+        os.mkdir(input_path)
+        for vol_num in range(NUM_VOLS):
+            nib.Nifti1Image(series_data[..., vol_num], AFFINE).to_filename(os.path.join(input_path, 'vol{:03d}.nii.gz'.format(vol_num)))
+    else:
+        input_path = str(tmp_path / 'run1.nii')
+        nib.Nifti1Image(series_data, AFFINE).to_filename(input_path)
+    output_dir = str(tmp_path / 'out')
+    os.mkdir(output_dir)
+    output_html = mqrt.run_realtime(input_path, output_dir=output_dir, cuttrs=CUTTRS, refresh=5, poll=0.01, timeout=5.0,
+                                    expected_vols=NUM_VOLS)
+    assert output_html == os.path.join(output_dir, 'quickgifs_run1', 'mriquickgifs_run1.html')
+    assert os.path.exists(output_html)
+    assert 'Volumes received: {}'.format(NUM_VOLS) in capsys.readouterr().out
+    assert len([x for x in os.listdir(os.path.join(output_dir, 'quickgifs_run1', 'pictures_gifs')) if x.endswith('.gif')]) == 12
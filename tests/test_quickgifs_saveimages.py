@@ -0,0 +1,160 @@
+##############################################################
+#Description: --saveimages output of mri_quickgifs: the float32 image and
+#             series writers, the background writer, and the saved mean,
+#             stdev, tSNR and detrended series against a least-squares fit
+#             of the cut series.
+#
+#History: (10/2026) Added tests
+##################################################################
+
+import os
+import numpy as np
+import nibabel as nib
+import pytest
+
+import mri_quickgifs
+import mri_quickgifs_saveimages as mqsave
+
+AFFINE = np.array([[2.0, 0, 0, -9], [0, 2.5, 0, -7], [0, 0, 3.0, 4], [0, 0, 0, 1]])
+NUM_VOLS = 16
+CUTTRS = 3
+
+
+def _int16_header(image_shape):
+    #An int16 input header with scaling, which the saved images must not keep
+    input_header = nib.Nifti1Header()
+    input_header.set_data_shape(image_shape)
+    input_header.set_data_dtype(np.int16)
+    input_header.set_slope_inter(2.0, 10.0)
+    return input_header
+
+
+def _write_series(input_file):
+    #int16 series with a quadratic drift and a few constant voxels
+    rng = np.random.RandomState(4)
+    t = np.linspace(-1, 1, NUM_VOLS)
+    series_data = (rng.uniform(800, 2000, (9, 7, 5, 1)) + rng.uniform(-40, 40, (9, 7, 5, 1))*t
+                   + rng.uniform(-20, 20, (9, 7, 5, 1))*t**2 + 10*rng.standard_normal((9, 7, 5, NUM_VOLS)))
+    series_data[0, 0, :] = 1000
+    series_data = np.round(series_data).astype(np.int16)
+    nib.Nifti1Image(series_data, AFFINE).to_filename(input_file)
+    return series_data
+
+
+def _reference(series_data, detrend_order):
+    #Mean, detrended stdev, tSNR and (x, y, z, volume) residuals from a
+    #float64 least-squares fit of each voxel's cut series
+    cut_data = series_data[..., CUTTRS:].astype(np.float64)
+    num_vols = cut_data.shape[3]
+    flat_data = cut_data.reshape((-1, num_vols)).T
+    design = np.vander(np.linspace(-1, 1, num_vols), detrend_order+1)
+    residuals = flat_data - np.dot(design, np.linalg.lstsq(design, flat_data, rcond=None)[0])
+    mean_data = cut_data.mean(axis=3)
+    stdev_data = np.sqrt(np.mean(residuals**2, axis=0)).reshape(cut_data.shape[:3])
+    tsnr_data = np.zeros(cut_data.shape[:3])
+    np.divide(mean_data, stdev_data, out=tsnr_data, where=stdev_data > 1e-6)
+    return {'mean': mean_data, 'stdev': stdev_data, 'tsnr': tsnr_data}, residuals.T.reshape(cut_data.shape)
+
+
+def _saved_file(output_html, image_name, compresslevel):
+    saveint_dir = os.path.join(os.path.dirname(output_html), 'intermediate_images')
+    return mqsave.image_file(saveint_dir, 's_cut_{}'.format(image_name), compresslevel)
+
+
+def _is_gzip(image_file):
+    with open(image_file, 'rb') as fi:
+        return fi.read(2) == b'\x1f\x8b'
+
+
+@pytest.mark.parametrize('compresslevel, extension', [(0, '.nii'), (1, '.nii.gz'), (9, '.nii.gz')])
+def test_write_image(tmp_path, compresslevel, extension):
+    image_data = np.random.RandomState(1).standard_normal((6, 5, 4))*100
+    output_file = mqsave.image_file(str(tmp_path), 'image', compresslevel)
+    assert output_file == str(tmp_path / ('image'+extension))
+    mqsave.write_image(image_data, _int16_header((6, 5, 4, 9)), AFFINE, output_file, compresslevel)
+    assert _is_gzip(output_file) == bool(compresslevel)
+    saved_img = nib.load(output_file)
+    assert saved_img.get_data_dtype() == np.float32
+    assert saved_img.shape == (6, 5, 4)
+    np.testing.assert_array_equal(saved_img.affine, AFFINE)
+    np.testing.assert_array_equal(saved_img.get_fdata(), image_data.astype(np.float32))
+
+
+@pytest.mark.parametrize('compresslevel', [0, 1])
+def test_write_series(tmp_path, compresslevel):
+    #(volumes, voxels) chunks of consecutive volumes make one 4D image
+    series_data = np.random.RandomState(2).standard_normal((6, 5, 4, 11))
+    flat_series = series_data.reshape((-1, 11), order='F').T
+    volume_chunks = [flat_series[:4], flat_series[4:5], flat_series[5:]]
+    output_file = mqsave.image_file(str(tmp_path), 'series', compresslevel)
+    mqsave.write_series(iter(volume_chunks), series_data.shape, _int16_header(series_data.shape), AFFINE, output_file, compresslevel)
+    saved_img = nib.load(output_file)
+    assert saved_img.get_data_dtype() == np.float32
+    np.testing.assert_array_equal(saved_img.affine, AFFINE)
+    np.testing.assert_array_equal(saved_img.get_fdata(), series_data.astype(np.float32))
+    with pytest.raises(RuntimeError):
+        mqsave.write_series(iter(volume_chunks[:2]), series_data.shape, _int16_header(series_data.shape), AFFINE, output_file, compresslevel)
+
+
+def test_image_writer(tmp_path):
+    writer = mqsave.ImageWriter()
+    output_files = [str(tmp_path / 'image{}.nii.gz'.format(x)) for x in range(3)]
+    for image_num, output_file in enumerate(output_files):
+        writer.submit(mqsave.write_image, np.full((3, 3, 2), image_num), _int16_header((3, 3, 2)), AFFINE, output_file)
+    assert writer.wait() == output_files
+    for image_num, output_file in enumerate(output_files):
+        assert np.all(nib.load(output_file).get_fdata() == image_num)
+    #Errors on the writer thread are raised by wait()
+    writer = mqsave.ImageWriter()
+    writer.submit(mqsave.write_image, np.zeros((3, 3, 2)), _int16_header((3, 3, 2)), AFFINE, str(tmp_path / 'missing' / 'image.nii'))
+    with pytest.raises(OSError):
+        writer.wait()
+
+
+@pytest.mark.parametrize('compresslevel', [0, 1])
+@pytest.mark.parametrize('detrend_order', [1, 2])
+def test_saved_images_match_reference(tmp_path, compresslevel, detrend_order):
+    input_file = str(tmp_path / 's.nii')
+    series_data = _write_series(input_file)
+    output_dir = str(tmp_path / 'out')
+    os.mkdir(output_dir)
+    output_html = mri_quickgifs.main(CUTTRS, input_file, 1, output_dir, detrend_order=detrend_order,
+                                     save_compression=compresslevel, save_series=1)
+    reference_images, reference_residuals = _reference(series_data, detrend_order)
+    for image_name in ['mean', 'stdev', 'tsnr', 'detrended']:
+        saved_file = _saved_file(output_html, image_name, compresslevel)
+        assert saved_file.endswith('.nii') == (compresslevel == 0)
+        assert _is_gzip(saved_file) == bool(compresslevel)
+        saved_img = nib.load(saved_file)
+        assert saved_img.get_data_dtype() == np.float32
+        np.testing.assert_allclose(saved_img.affine, AFFINE)
+        if image_name == 'detrended':
+            assert saved_img.shape == series_data.shape[:3]+(NUM_VOLS-CUTTRS,)
+            np.testing.assert_allclose(saved_img.get_fdata(), reference_residuals, rtol=0, atol=1e-3)
+        else:
+            np.testing.assert_allclose(saved_img.get_fdata(), reference_images[image_name], rtol=1e-5, atol=1e-4)
+
+
+def test_missing_images_rewritten_from_cache(tmp_path, capsys):
+    input_file = str(tmp_path / 's.nii')
+    _write_series(input_file)
+    output_dir = str(tmp_path / 'out')
+    os.mkdir(output_dir)
+    output_html = mri_quickgifs.main(CUTTRS, input_file, 1, output_dir, save_series=1)
+    saved_files = dict((x, _saved_file(output_html, x, mqsave.DEFAULT_COMPRESSION)) for x in ['mean', 'stdev', 'tsnr', 'detrended'])
+    saved_data = dict((x, nib.load(y).get_fdata()) for x, y in saved_files.items())
+
+    #A missing statistic image is written from the cached arrays
+    os.remove(saved_files['stdev'])
+    capsys.readouterr()
+    mri_quickgifs.main(CUTTRS, input_file, 1, output_dir, save_series=1)
+    assert 'Using cached statistics' in capsys.readouterr().out
+    np.testing.assert_array_equal(nib.load(saved_files['stdev']).get_fdata(), saved_data['stdev'])
+
+    #The detrended series needs the fit, which isn't cached, so it is made
+    #by a full run
+    os.remove(saved_files['detrended'])
+    mri_quickgifs.main(CUTTRS, input_file, 1, output_dir, save_series=1)
+    assert 'Using cached statistics' not in capsys.readouterr().out
+    for image_name, saved_file in saved_files.items():
+        np.testing.assert_allclose(nib.load(saved_file).get_fdata(), saved_data[image_name], rtol=1e-6, atol=1e-6)
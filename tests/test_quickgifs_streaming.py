@@ -0,0 +1,69 @@
+##############################################################
+#Description: compressed and uncompressed copies of the same scaled int16
+#             series give identical mean, stdev and tSNR images when read
+#             in small chunks (--max-memory) after --cuttrs, with any gzip
+#             backend.
+#
+#History: (10/2026) Added tests
+##################################################################
+
+import os
+import re
+import numpy as np
+import nibabel as nib
+import pytest
+
+import mri_quickgifs
+
+NUM_VOLS = 20
+CUTTRS = 3
+#Small enough that only a couple of volumes are read at a time
+MAX_MEMORY = 0.03
+SLOPE = 0.5
+INTER = 100.0
+
+
+def _write_series(input_file):
+    #The same raw int16 values, with scl_slope and scl_inter set
+    rng = np.random.RandomState(9)
+    series_data = rng.uniform(800, 2000, (9, 7, 5, 1)) + np.linspace(0, 30, NUM_VOLS) + 12*rng.standard_normal((9, 7, 5, NUM_VOLS))
+    series_img = nib.Nifti1Image(np.round(series_data).astype(np.int16), np.diag([2.0, 2.0, 3.0, 1.0]))
+    series_img.header.set_slope_inter(SLOPE, INTER)
+    series_img.to_filename(input_file)
+    assert nib.load(input_file).dataobj.slope == SLOPE
+
+
+def _run(tmp_path, run_name, input_extension, gzip_backend, capsys):
+    #Returns the saved mean, stdev and tSNR images of one run
+    run_dir = tmp_path / run_name
+    run_dir.mkdir()
+    input_file = str(run_dir / ('s'+input_extension))
+    _write_series(input_file)
+    capsys.readouterr()
+    output_html = mri_quickgifs.main(CUTTRS, input_file, 1, str(run_dir), max_memory=MAX_MEMORY, gzip_backend=gzip_backend,
+                                     save_compression=0)
+    chunk_vols = int(re.search(r'Reading (\d+) volumes at a time', capsys.readouterr().out).group(1))
+    assert 1 < chunk_vols < NUM_VOLS-CUTTRS
+    saveint_dir = os.path.join(os.path.dirname(output_html), 'intermediate_images')
+    return dict((x, nib.load(os.path.join(saveint_dir, 's_cut_{}.nii'.format(x))).get_fdata()) for x in ['mean', 'stdev', 'tsnr'])
+
+
+def test_compressed_matches_uncompressed(tmp_path, capsys):
+    uncompressed_images = _run(tmp_path, 'nii', '.nii', 'auto', capsys)
+    for run_name, gzip_backend in [('auto', 'auto'), ('stdlib', 'stdlib')]:
+        compressed_images = _run(tmp_path, run_name, '.nii.gz', gzip_backend, capsys)
+        for image_name in ['mean', 'stdev', 'tsnr']:
+            np.testing.assert_array_equal(compressed_images[image_name], uncompressed_images[image_name])
+
+    #The scaling is applied: the mean is the scaled mean of the cut series
+    series_data = nib.load(str(tmp_path / 'nii' / 's.nii')).get_fdata()[..., CUTTRS:]
+    np.testing.assert_allclose(uncompressed_images['mean'], series_data.mean(axis=3), rtol=1e-6)
+
+
+@pytest.mark.parametrize('gzip_backend, module_name', [('isal', 'isal'), ('zlib-ng', 'zlib_ng')])
+def test_optional_backends_match_stdlib(tmp_path, capsys, gzip_backend, module_name):
+    pytest.importorskip(module_name)
+    stdlib_images = _run(tmp_path, 'stdlib', '.nii.gz', 'stdlib', capsys)
+    backend_images = _run(tmp_path, gzip_backend, '.nii.gz', gzip_backend, capsys)
+    for image_name in ['mean', 'stdev', 'tsnr']:
+        np.testing.assert_array_equal(backend_images[image_name], stdlib_images[image_name])
@@ -0,0 +1,115 @@
+##############################################################
+#Description: mri_quickgifs' streaming temporal statistics (the Legendre
+#             polynomial fit accumulated chunk by chunk, slab by slab)
+#             against a least-squares fit of the whole series, and against
+#             scipy.signal.detrend for the constant and linear cases.
+#
+#History: (10/2026) Added tests
+##################################################################
+
+import numpy as np
+import pytest
+
+import mri_quickgifs
+
+VOL_SHAPE = (7, 6, 5)
+NUM_VOLS = 37
+CHUNK_SIZES = {
+    'whole': [NUM_VOLS],
+    'single': [1]*NUM_VOLS,
+    'uneven': [5, 1, 13, 18],
+    }
+
+
+def _series():
+    #int16 series with a cubic drift, noise and a few constant voxels
+    rng = np.random.RandomState(7)
+    t = np.linspace(-1, 1, NUM_VOLS)
+    drift = (rng.uniform(-30, 30, VOL_SHAPE+(1,))*t + rng.uniform(-20, 20, VOL_SHAPE+(1,))*t**2
+             + rng.uniform(-10, 10, VOL_SHAPE+(1,))*t**3)
+    series_data = rng.uniform(500, 3000, VOL_SHAPE+(1,)) + drift + rng.standard_normal(VOL_SHAPE+(NUM_VOLS,))*15
+    series_data[0, 0, :] = 1200
+    return np.round(series_data).astype(np.int16)
+
+
+def _reference(series_data, detrend_order):
+    #Mean, detrended stdev, tSNR and (volumes, voxels) residuals from a
+    #float64 least-squares fit of each voxel's whole series
+    flat_data = series_data.reshape((-1, NUM_VOLS), order='F').T.astype(np.float64)
+    design = np.vander(np.linspace(-1, 1, NUM_VOLS), detrend_order+1)
+    coefficients = np.linalg.lstsq(design, flat_data, rcond=None)[0]
+    residuals = flat_data - np.dot(design, coefficients)
+    mean_data = flat_data.mean(axis=0).reshape(VOL_SHAPE, order='F')
+    stdev_data = np.sqrt(np.mean(residuals**2, axis=0)).reshape(VOL_SHAPE, order='F')
+    tsnr_data = np.zeros(VOL_SHAPE)
+    np.divide(mean_data, stdev_data, out=tsnr_data, where=stdev_data > 1e-6)
+    return mean_data, stdev_data, tsnr_data, residuals
+
+
+def _chunks(series_data, chunk_sizes):
+    first_vol = 0
+    for chunk_size in chunk_sizes:
+        chunk = series_data[..., first_vol:first_vol+chunk_size]
+        if chunk_size == 1:
+            chunk = chunk[..., 0]
+        yield first_vol, chunk
+        first_vol += chunk_size
+
+
+@pytest.fixture(autouse=True)
+def small_slabs(monkeypatch):
+    #Several slabs of voxels (the last one partial), as in a real image
+    monkeypatch.setattr(mri_quickgifs, 'STATS_SLAB_VOXELS', 64)
+
+
+@pytest.mark.parametrize('chunking', sorted(CHUNK_SIZES))
+@pytest.mark.parametrize('jobs', [1, 3])
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+@pytest.mark.parametrize('detrend_order', [0, 1, 2, 3])
+def test_matches_lstsq(detrend_order, dtype, jobs, chunking):
+    series_data = _series()
+    stats = mri_quickgifs._TemporalStats(VOL_SHAPE, dtype=dtype, detrend_order=detrend_order, total_vols=NUM_VOLS, jobs=jobs)
+    assert len(stats.slabs) > 1
+    for first_vol, chunk in _chunks(series_data, CHUNK_SIZES[chunking]):
+        stats.update(chunk)
+    mean_data, stdev_data, tsnr_data = stats.finalize(keep_fit=1)
+    ref_mean, ref_stdev, ref_tsnr, ref_residuals = _reference(series_data, detrend_order)
+
+    if dtype == np.float64:
+        rtol = 1e-9
+    else:
+        rtol = 1e-4
+    assert mean_data.dtype == dtype
+    np.testing.assert_allclose(mean_data, ref_mean, rtol=rtol)
+    np.testing.assert_allclose(stdev_data, ref_stdev, rtol=rtol, atol=rtol*15)
+    varying = ref_stdev > 1
+    np.testing.assert_allclose(tsnr_data[varying], ref_tsnr[varying], rtol=rtol*10)
+    #Constant voxels have no standard deviation, and a tSNR of 0
+    assert np.all(stdev_data[0, 0] < rtol*15)
+
+    residuals = np.concatenate(list(stats.residuals(_chunks(series_data, CHUNK_SIZES[chunking]))), axis=0)
+    assert residuals.dtype == np.float32
+    assert residuals.shape == (NUM_VOLS, int(np.prod(VOL_SHAPE)))
+    np.testing.assert_allclose(residuals, ref_residuals, rtol=0, atol=1e-3)
+
+
+@pytest.mark.parametrize('detrend_order, detrend_type', [(0, 'constant'), (1, 'linear')])
+def test_matches_scipy_detrend(detrend_order, detrend_type):
+    signal = pytest.importorskip('scipy.signal')
+    series_data = _series()
+    stats = mri_quickgifs._TemporalStats(VOL_SHAPE, detrend_order=detrend_order, total_vols=NUM_VOLS, jobs=2)
+    for first_vol, chunk in _chunks(series_data, CHUNK_SIZES['uneven']):
+        stats.update(chunk)
+    mean_data, stdev_data, tsnr_data = stats.finalize()
+    detrended_data = signal.detrend(series_data.astype(np.float64), axis=3, type=detrend_type)
+    np.testing.assert_allclose(stdev_data, detrended_data.std(axis=3), rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(mean_data, series_data.mean(axis=3), rtol=1e-12)
+
+
+def test_unknown_length_series():
+    #Without total_vols (as in real-time use) the fit is the same
+    series_data = _series()
+    stats = mri_quickgifs._TemporalStats(VOL_SHAPE, detrend_order=2)
+    for first_vol, chunk in _chunks(series_data, CHUNK_SIZES['uneven']):
+        stats.update(chunk)
+    np.testing.assert_allclose(stats.finalize()[1], _reference(series_data, 2)[1], rtol=1e-6, atol=1e-6)